@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Benchmarks of the zeroscale proxy, printed as JSON
+
+ZeroScale runs in a process of its own, in front of tests/echo_server.py in
+another, with a fake plugin whose start and unpause take a set time. Clients
+run in this process, so the proxy's memory can be measured on its own.
+
+usage: python benchmarks/bench.py [--output results.json] [--quick]"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from zeroscale.base_server import BaseServer
+from zeroscale.event_loop import EVENT_LOOPS, install_event_loop
+from zeroscale.proxy import ENGINES
+from zeroscale.status import Status
+from zeroscale.zeroscale import ZeroScale, start_servers
+
+ECHO_SERVER = os.path.join(ROOT, "tests", "echo_server.py")
+
+# Seconds to wait for a server to accept connections
+READY_TIMEOUT = 10
+# Idle seconds before the proxy pauses or stops the server in wake-up runs
+WAKE_IDLE = .2
+
+CHUNK = 65536
+MIB = 1 << 20
+
+logger = logging.getLogger("bench")
+
+
+class FakeServer(BaseServer):
+    """A plugin whose start and unpause take a set time, in front of an
+        echo server that is always up"""
+
+    def __init__(self, start_delay: float = 0, unpause_delay: float = 0):
+        self.start_delay = start_delay
+        self.unpause_delay = unpause_delay
+        self.status = Status.stopped
+
+    async def start(self):
+        if self.status is not Status.stopped:
+            return
+        self.status = Status.starting
+        await asyncio.sleep(self.start_delay)
+        self.status = Status.running
+
+    async def stop(self):
+        self.status = Status.stopped
+
+    async def pause(self):
+        if self.status is Status.running:
+            self.status = Status.paused
+
+    async def unpause(self):
+        if self.status is not Status.paused:
+            return
+        await asyncio.sleep(self.unpause_delay)
+        self.status = Status.running
+
+    def close(self):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def wait_listening(port: int):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while True:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(.05)
+
+
+def raise_file_limit():
+    """Allow as many open files as the hard limit, for many connections"""
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def rss(pid: int) -> int:
+    """Resident memory of a process in bytes, or None off Linux"""
+
+    try:
+        with open("/proc/%i/status" % pid) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def run_proxy(args, listen_port: int, server_port: int, **options):
+    """Body of the proxy process, serving until SIGINT"""
+
+    install_event_loop(args.event_loop)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    server = FakeServer(args.start_delay, args.unpause_delay)
+    zeroscale = ZeroScale(server, listen_port, server_port,
+            server_host="localhost",
+            ignore_bad_clients=True,
+            proxy_engine=args.proxy_engine,
+            splice=args.splice,
+            **options)
+    start_servers([zeroscale])
+
+
+class Proxy:
+    """ZeroScale in a process of its own, in front of the echo server"""
+
+    def __init__(self, args, server_port: int, **options):
+        self.port = free_port()
+        self.process = multiprocessing.Process(target=run_proxy,
+                args=(args, self.port, server_port), kwargs=options, daemon=True)
+
+    def __enter__(self):
+        self.process.start()
+        wait_listening(self.port)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.kill(self.process.pid, signal.SIGINT)
+        self.process.join(READY_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+
+    def rss(self) -> int:
+        return rss(self.process.pid)
+
+
+async def connect(port: int):
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return reader, writer
+
+
+async def throughput(port: int, total: int) -> dict:
+    """Bulk data echoed through a single connection"""
+
+    reader, writer = await connect(port)
+    chunk = b"x" * CHUNK
+
+    async def send():
+        sent = 0
+        while sent < total:
+            writer.write(chunk)
+            await writer.drain()
+            sent += len(chunk)
+
+    start = time.perf_counter()
+    sender = asyncio.ensure_future(send())
+    received = 0
+    while received < total:
+        data = await reader.read(CHUNK)
+        if not data:
+            raise ConnectionError("Connection closed after %i bytes" % received)
+        received += len(data)
+    seconds = time.perf_counter() - start
+    await sender
+    writer.close()
+
+    return {
+        "bytes": received,
+        "seconds": seconds,
+        "mib_per_second": received / MIB / seconds,
+    }
+
+
+async def round_trips(port: int, count: int, size: int = 64):
+    reader, writer = await connect(port)
+    message = b"x" * size
+    samples = []
+
+    for _ in range(count):
+        start = time.perf_counter()
+        writer.write(message)
+        await reader.readexactly(size)
+        samples.append(time.perf_counter() - start)
+
+    writer.close()
+    return samples
+
+
+async def latency(proxy_port: int, echo_port: int, count: int) -> dict:
+    """Round trips of small messages, through the proxy and straight to the echo server"""
+
+    direct = await round_trips(echo_port, count)
+    proxied = await round_trips(proxy_port, count)
+
+    result = {"samples": count}
+    for name, fraction in (("p50", .5), ("p99", .99)):
+        result["direct_%s_seconds" % name] = percentile(direct, fraction)
+        result["proxied_%s_seconds" % name] = percentile(proxied, fraction)
+        result["added_%s_seconds" % name] = \
+            percentile(proxied, fraction) - percentile(direct, fraction)
+    return result
+
+
+async def accepts(port: int, duration: float, concurrency: int) -> dict:
+    """New connections that get a byte echoed, then close, as fast as possible"""
+
+    count = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal count
+        while time.perf_counter() < deadline:
+            reader, writer = await connect(port)
+            writer.write(b"x")
+            await reader.readexactly(1)
+            writer.close()
+            count += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    return {
+        "connections": count,
+        "seconds": seconds,
+        "accepts_per_second": count / seconds,
+        "concurrency": concurrency,
+    }
+
+
+async def idle_memory(proxy: Proxy, connections: int) -> dict:
+    """Growth of the proxy's memory with connections that are open but idle"""
+
+    await asyncio.sleep(.5)
+    before = proxy.rss()
+
+    clients = []
+    for _ in range(connections):
+        reader, writer = await connect(proxy.port)
+        writer.write(b"x")
+        await reader.readexactly(1)
+        clients.append(writer)
+
+    await asyncio.sleep(.5)
+    after = proxy.rss()
+
+    for writer in clients:
+        writer.close()
+
+    if before is None or after is None:
+        return {"connections": connections, "bytes_per_connection": None}
+    return {
+        "connections": connections,
+        "rss_before_bytes": before,
+        "rss_after_bytes": after,
+        "bytes_per_connection": (after - before) / connections,
+    }
+
+
+async def wake_up(port: int, runs: int, delay: float) -> dict:
+    """Time from connecting to the first echoed byte, once the server is
+        scaled down, with delay being how long the plugin takes to come up"""
+
+    samples = []
+    for _ in range(runs):
+        # Long enough for the proxy to scale the server down again
+        await asyncio.sleep(WAKE_IDLE + .3)
+
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection("localhost", port)
+        writer.write(b"x")
+        await reader.readexactly(1)
+        samples.append(time.perf_counter() - start)
+        writer.close()
+
+    return {
+        "runs": runs,
+        "plugin_delay_seconds": delay,
+        "p50_seconds": percentile(samples, .5),
+        "max_seconds": max(samples),
+        "overhead_p50_seconds": percentile(samples, .5) - delay,
+    }
+
+
+def startup(module: str, runs: int) -> dict:
+    """Time a fresh interpreter takes to run a command line entry point
+        through to printing its help, like a service restart would"""
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", module, "--help"],
+                cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+
+    return {
+        "runs": runs,
+        "p50_seconds": percentile(samples, .5),
+        "max_seconds": max(samples),
+    }
+
+
+def run(loop, coroutine):
+    return loop.run_until_complete(coroutine)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the zeroscale proxy, printing JSON results.")
+    parser.add_argument("--output", "-o", type=str, help="File to write the results to. Defaults to stdout.")
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, for a rough check.")
+    parser.add_argument("--proxy_engine", choices=ENGINES, default="stream")
+    parser.add_argument("--splice", action="store_true")
+    parser.add_argument("--event_loop", choices=EVENT_LOOPS, default="asyncio")
+    parser.add_argument("--start_delay", type=float, default=.5,
+            help="Seconds the fake plugin takes to start. Default .5.")
+    parser.add_argument("--unpause_delay", type=float, default=.01,
+            help="Seconds the fake plugin takes to unpause. Default .01.")
+    parser.add_argument("--bytes", type=int, default=256 * MIB,
+            help="Bytes echoed for the throughput run.")
+    parser.add_argument("--round_trips", type=int, default=5000)
+    parser.add_argument("--accept_seconds", type=float, default=3)
+    parser.add_argument("--accept_concurrency", type=int, default=32)
+    parser.add_argument("--idle_connections", type=int, default=1000)
+    parser.add_argument("--wake_runs", type=int, default=10)
+    parser.add_argument("--startup_runs", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.bytes = min(args.bytes, 32 * MIB)
+        args.round_trips = min(args.round_trips, 1000)
+        args.accept_seconds = min(args.accept_seconds, 1)
+        args.idle_connections = min(args.idle_connections, 200)
+        args.wake_runs = min(args.wake_runs, 3)
+        args.startup_runs = min(args.startup_runs, 5)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    raise_file_limit()
+    # The proxy processes only need the arguments, not a fresh interpreter
+    multiprocessing.set_start_method("fork")
+
+    results = {}
+
+    logger.info("Measuring startup")
+    results["startup"] = startup("zeroscale", args.startup_runs)
+    results["startup_docker"] = startup("zeroscale.__docker__", args.startup_runs)
+
+    echo_port = free_port()
+    echo = subprocess.Popen([sys.executable, ECHO_SERVER, str(echo_port)])
+
+    try:
+        wait_listening(echo_port)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        # Clients are held while the server first starts, instead of being
+        # sent the fake status
+        with Proxy(args, echo_port, server_idle_shutdown=3600, hold_clients=True) as proxy:
+            logger.info("Measuring throughput")
+            results["throughput"] = run(loop, throughput(proxy.port, args.bytes))
+            logger.info("Measuring latency")
+            results["latency"] = run(loop, latency(proxy.port, echo_port, args.round_trips))
+            logger.info("Measuring accepts")
+            results["accepts"] = run(loop, accepts(
+                proxy.port, args.accept_seconds, args.accept_concurrency))
+            logger.info("Measuring idle connection memory")
+            results["idle_memory"] = run(loop, idle_memory(proxy, args.idle_connections))
+
+        logger.info("Measuring wake up from paused")
+        with Proxy(args, echo_port, server_idle_shutdown=WAKE_IDLE) as proxy:
+            # Started as soon as it is served, then paused
+            run(loop, asyncio.sleep(args.start_delay))
+            results["wake_paused"] = run(loop, wake_up(
+                proxy.port, args.wake_runs, args.unpause_delay))
+
+        logger.info("Measuring wake up from stopped")
+        with Proxy(args, echo_port, server_idle_shutdown=WAKE_IDLE,
+                method_pause=False, hold_clients=True) as proxy:
+            # Started by the check that the proxy is listening
+            run(loop, asyncio.sleep(args.start_delay))
+            results["wake_stopped"] = run(loop, wake_up(
+                proxy.port, args.wake_runs, args.start_delay))
+
+        loop.close()
+    finally:
+        echo.terminate()
+        echo.wait()
+
+    report = {
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            key: getattr(args, key) for key in (
+                "proxy_engine", "splice", "event_loop", "start_delay",
+                "unpause_delay", "bytes", "round_trips", "accept_seconds",
+                "accept_concurrency", "idle_connections", "wake_runs",
+                "startup_runs")
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -13,6 +13,9 @@ test_deps = [
 docker_deps = [
     "docker>=5.0,<6.0",
 ]
+uvloop_deps = [
+    "uvloop>=0.14",
+]
 
 setup(
     name="zeroscale",
@@ -29,6 +32,7 @@ setup(
     extras_require={
         "test": test_deps,
         "docker": docker_deps,
+        "uvloop": uvloop_deps,
     },
     zip_safe=False,
     python_requires=">=3.5",
@@ -2,6 +2,7 @@ import asyncio
 import pytest
 
 from zeroscale.base_server import BaseServer
+from zeroscale.status import Status
 
 @pytest.mark.asyncio
 async def test_base():
@@ -21,3 +22,28 @@ async def test_base():
     assert await server.is_valid_connection(None)
 
     assert type(server.fake_status()) is bytes
+
+@pytest.mark.asyncio
+async def test_status_listeners():
+    server = BaseServer()
+    seen = []
+
+    server.add_status_listener(seen.append)
+    server.status = Status.starting
+    assert seen == [Status.starting]
+
+    waiter = asyncio.ensure_future(server.wait_for_status(Status.running))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    server.status = Status.paused
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    server.status = Status.running
+    assert await waiter is Status.running
+    assert seen == [Status.starting, Status.paused, Status.running]
+
+    server.remove_status_listener(seen.append)
+    server.status = Status.stopped
+    assert seen[-1] is Status.running
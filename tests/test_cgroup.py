@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from zeroscale.cgroup import LEAF_NAME, Cgroup, MemoryReclaimer
+from zeroscale.plugins.generic import Server as Generic
+from zeroscale.status import Status
+
+def cgroups_available():
+    try:
+        Cgroup.create().remove()
+        return True
+    except OSError:
+        return False
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not cgroups_available(), reason="requires a writable cgroup v2")
+async def test_freeze():
+    server = Generic("sh", "-c", "sleep 60 & sleep 60")
+    server.set_pause_method("cgroup")
+    await server.start()
+
+    await server.pause()
+    assert server.paused_by == "cgroup"
+    assert server.cgroup.is_frozen()
+
+    await server.unpause()
+    assert server.status is Status.running
+    assert not server.cgroup.is_frozen()
+
+    server.close()
+    await server.proc.wait()
+    await server.remove_cgroup()
+
+def memory_available():
+    try:
+        cgroup = Cgroup.create(memory=True)
+    except OSError:
+        return False
+    available = os.path.exists(cgroup.file("memory.high"))
+    cgroup.remove()
+    return available
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not memory_available(), reason="requires the memory controller delegated")
+async def test_memory_high():
+    server = Generic("sleep", "60")
+    server.set_pause_method("cgroup")
+    server.set_memory_reclaim("high", keep=1 << 20)
+    await server.start()
+
+    await server.pause()
+    assert server.cgroup.read("memory.high") == str(1 << 20)
+
+    await server.unpause()
+    assert server.cgroup.read("memory.high") == "max"
+
+    server.close()
+    await server.proc.wait()
+    await server.remove_cgroup()
+
+def test_enable_controller(tmp_path):
+    # A stand-in for a cgroup with a process of its own, like a systemd
+    # service's, to check the process is moved out before the controller
+    # is enabled
+    for name, value in (
+            ("cgroup.controllers", "cpu memory"),
+            ("cgroup.subtree_control", ""),
+            ("cgroup.procs", "123\n")):
+        (tmp_path / name).write_text(value)
+
+    Cgroup(str(tmp_path)).enable_controller("memory")
+    assert (tmp_path / LEAF_NAME / "cgroup.procs").read_text() == "123"
+    assert (tmp_path / "cgroup.subtree_control").read_text() == "+memory"
+
+    (tmp_path / "cgroup.controllers").write_text("cpu")
+    (tmp_path / "cgroup.subtree_control").write_text("")
+    with pytest.raises(OSError):
+        Cgroup(str(tmp_path)).enable_controller("memory")
+
+def write_memory_stats(path, faults, stall):
+    (path / "memory.stat").write_text("anon 4096\npgmajfault %i\n" % faults)
+    (path / "memory.pressure").write_text(
+        "some avg10=0.00 avg60=0.00 avg300=0.00 total=%i\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n" % stall)
+
+@pytest.mark.asyncio
+async def test_measure_refaults(tmp_path):
+    cgroup = Cgroup(str(tmp_path))
+    reclaimer = MemoryReclaimer("reclaim")
+    write_memory_stats(tmp_path, faults=10, stall=500)
+    reclaimer.restore(cgroup)
+
+    # Faulted back in once thawed
+    write_memory_stats(tmp_path, faults=25, stall=120500)
+    assert await reclaimer.measure(cgroup, window=0) == (15, .12)
+
+    # Without pressure stall information, only faults are counted
+    (tmp_path / "memory.pressure").unlink()
+    reclaimer.restore(cgroup)
+    write_memory_stats(tmp_path, faults=30, stall=0)
+    (tmp_path / "memory.pressure").unlink()
+    assert await reclaimer.measure(cgroup, window=0) == (5, None)
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import pytest
+import shutil
+
+from zeroscale.checkpoint import CriuImage, RestoredProcess, directory_size
+from zeroscale.plugins.generic import Server as Generic
+from zeroscale.status import Status
+
+def test_directory_size(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(b"x" * 5)
+
+    assert directory_size(str(tmp_path)) == 15
+
+@pytest.mark.asyncio
+async def test_restored_process():
+    proc = await asyncio.create_subprocess_exec("sleep", "60")
+    restored = RestoredProcess(proc.pid)
+
+    restored.kill()
+    # Reaped by its real parent, as init would for a restored one
+    await proc.wait()
+
+    assert await asyncio.wait_for(restored.wait(), timeout=5) is not None
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(shutil.which("criu") is not None, reason="tests the fallback without CRIU")
+async def test_checkpoint_fallback(unused_tcp_port, tmp_path):
+    server = Generic('tests/echo_server.py', str(unused_tcp_port))
+    server.set_checkpoint_dir(str(tmp_path))
+    await server.start()
+
+    # Without CRIU, it is paused instead
+    await server.checkpoint()
+    assert server.status is Status.paused
+    assert server.image is None
+    assert server.proc.returncode is None
+    assert server.checkpoint_stats.checkpoint_failures == 1
+    assert os.listdir(str(tmp_path)) == []
+
+    await server.unpause()
+    assert server.status is Status.running
+
+    # A checkpoint that cannot be restored leaves it stopped, to start over
+    server.close()
+    await server.proc.wait()
+    server.status = Status.paused
+    server.image = CriuImage(str(tmp_path))
+    server.image.path = str(tmp_path / "missing")
+
+    await server.unpause()
+    assert server.status is Status.stopped
+    assert server.image is None
+    assert server.checkpoint_stats.restore_failures == 1
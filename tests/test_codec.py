@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+
+from zeroscale.codec import (
+    PacketReader, decode_string, decode_varint, decode_varlong, encode_packet,
+    encode_string, encode_varint, encode_varlong)
+
+class CountingReader:
+    """Stream reader that counts read() calls"""
+
+    def __init__(self, data, chunk=None):
+        self.data = data
+        self.chunk = chunk
+        self.reads = 0
+
+    async def read(self, n=-1):
+        self.reads += 1
+        n = min(n, self.chunk or n)
+        data, self.data = self.data[:n], self.data[n:]
+        return data
+
+def test_varint():
+    for value, encoded in ((0, b"\x00"), (127, b"\x7f"), (128, b"\x80\x01"),
+            (2097151, b"\xff\xff\x7f"), (2147483647, b"\xff\xff\xff\xff\x07"),
+            (-1, b"\xff\xff\xff\xff\x0f")):
+        assert encode_varint(value) == encoded
+        assert decode_varint(encoded) == (value, len(encoded))
+
+    with pytest.raises(IndexError):
+        decode_varint(b"\x80")
+    with pytest.raises(ValueError):
+        decode_varint(b"\xff" * 6)
+
+def test_varlong():
+    for value, encoded in ((0, b"\x00"), (2147483648, b"\x80\x80\x80\x80\x08"),
+            (-1, b"\xff" * 9 + b"\x01")):
+        assert encode_varlong(value) == encoded
+        assert decode_varlong(encoded) == (value, len(encoded))
+
+def test_string():
+    encoded = encode_string("héllo")
+    assert encoded == b"\x06h\xc3\xa9llo"
+    assert decode_string(encoded + b"rest") == ("héllo", 7)
+
+    with pytest.raises(IndexError):
+        decode_string(b"\x06abc")
+
+@pytest.mark.asyncio
+async def test_packet_reader():
+    big = encode_packet(0x00, b"x" * 50000)
+    reader = CountingReader(encode_packet(0x00, b"handshake") + encode_packet(0x01) + big)
+    packets = PacketReader(reader)
+
+    # Both small packets come from a single read
+    assert await packets.read_packet(1024) == (0x00, b"handshake")
+    assert await packets.read_packet(1024) == (0x01, b"")
+    assert reader.reads == 1
+
+    assert await packets.read_packet(1 << 20) == (0x00, b"x" * 50000)
+    with pytest.raises(asyncio.IncompleteReadError):
+        await packets.read_packet(1024)
+
+@pytest.mark.asyncio
+async def test_packet_reader_limits():
+    with pytest.raises(ValueError):
+        await PacketReader(CountingReader(encode_packet(0x00, b"x" * 2000))).read_packet(1024)
+
+    # Lengths split across reads
+    reader = CountingReader(encode_packet(0x02, b"y" * 300), chunk=1)
+    assert await PacketReader(reader).read_packet(1024) == (0x02, b"y" * 300)
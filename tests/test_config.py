@@ -0,0 +1,94 @@
+import argparse
+import pytest
+
+from zeroscale.config import load_config, load_entries, reload_entries
+from zeroscale.parser import RELOADABLE_OPTIONS, add_common_options, zeroscale_options
+
+CONFIG = """
+[DEFAULT]
+idle_shutdown = 30
+
+[minecraft]
+plugin = minecraft
+listen_port = 25565
+server_port = 25575
+method_stop = yes
+
+[echo]
+listen_port = 8000
+server_port = 9000
+idle_shutdown = 5
+plugin_argument =
+    tests/echo_server.py
+    9000
+"""
+
+def make_parser():
+    parser = argparse.ArgumentParser()
+    add_common_options(parser)
+    parser.add_argument("container_id", nargs="?")
+    return parser
+
+def test_load_config(tmp_path):
+    path = tmp_path / "zeroscale.ini"
+    path.write_text(CONFIG)
+
+    (mc_name, mc_args), (echo_name, echo_args) = load_config(make_parser(), str(path))
+
+    assert mc_name == "minecraft"
+    assert mc_args.plugin == "minecraft"
+    assert mc_args.method_stop
+    assert mc_args.method_stop
+    assert mc_args.idle_shutdown == 30
+
+    assert echo_name == "echo"
+    assert echo_args.plugin == "generic"
+    assert not echo_args.method_stop
+    assert echo_args.idle_shutdown == 5
+    assert echo_args.plugin_argument == ["tests/echo_server.py", "9000"]
+
+    options = zeroscale_options(echo_args)
+    assert options["listen_port"] == 8000
+    assert options["server_port"] == 9000
+    assert options["method_pause"]
+
+def test_positional(tmp_path):
+    path = tmp_path / "zeroscale.ini"
+    path.write_text("[server]\ncontainer_id = my_server\n")
+
+    (name, args), = load_config(make_parser(), str(path))
+    assert args.container_id == "my_server"
+
+def test_unknown_option(tmp_path):
+    path = tmp_path / "zeroscale.ini"
+    path.write_text("[server]\nnot_an_option = 1\n")
+
+    with pytest.raises(ValueError):
+        load_config(make_parser(), str(path))
+
+    path.write_text("[server]\ndebug = yes\n")
+
+    with pytest.raises(ValueError):
+        load_config(make_parser(), str(path))
+
+def test_reload_entries(tmp_path):
+    path = tmp_path / "zeroscale.ini"
+    path.write_text(CONFIG)
+    parser = make_parser()
+    argv = ["--config", str(path)]
+    entries = load_entries(parser, parser.parse_args(argv))
+
+    path.write_text(CONFIG.replace("idle_shutdown = 5", "idle_shutdown = 60")
+            .replace("plugin = minecraft", "plugin = terraria")
+            .replace("method_stop = yes", "method_stop = no") + "[new]\n")
+    (mc_name, mc_args), (echo_name, echo_args) = reload_entries(
+            parser, argv, entries=entries, reloadable=RELOADABLE_OPTIONS)
+
+    assert echo_args.idle_shutdown == 60
+    # Needs a restart, so kept as it was
+    assert mc_args.plugin == "minecraft"
+    assert mc_args.method_stop
+
+    path.write_text("[minecraft]\nnot_an_option = 1\n")
+    with pytest.raises(ValueError):
+        reload_entries(parser, argv, entries=entries, reloadable=RELOADABLE_OPTIONS)
@@ -0,0 +1,198 @@
+import asyncio
+
+import pytest
+
+docker = pytest.importorskip("docker")
+
+from zeroscale.docker import DockerProxyServer
+from zeroscale.status import Status
+
+class StubContainer:
+    """Stands in for a docker-py container, failing once removed"""
+
+    def __init__(self, container_id, status="running"):
+        self.id = container_id
+        self.status = status
+        self.attrs = {"Config": {}, "State": {}}
+        self.removed = False
+        self.calls = []
+
+    def check(self):
+        if self.removed:
+            raise docker.errors.NotFound("No such container: %s" % self.id)
+
+    def reload(self):
+        self.check()
+
+    def pause(self):
+        self.check()
+        self.calls.append("pause")
+        self.status = "paused"
+
+    def unpause(self):
+        self.check()
+        self.calls.append("unpause")
+        self.status = "running"
+
+    def stop(self):
+        self.check()
+        self.calls.append("stop")
+        self.status = "exited"
+
+class StubContainers:
+    def __init__(self, container):
+        self.container = container
+        self.gets = 0
+
+    def get(self, container_id):
+        self.gets += 1
+        if self.container is None or self.container.removed:
+            raise docker.errors.NotFound("No such container: %s" % container_id)
+        return self.container
+
+class StubClient:
+    def __init__(self, container):
+        self.containers = StubContainers(container)
+
+    def close(self):
+        pass
+
+def make_server(status="running"):
+    client = StubClient(StubContainer("abc", status))
+    return DockerProxyServer("game", docker_client=client), client
+
+def test_container_cached():
+    server, client = make_server()
+    assert server.status is Status.running
+
+    server.get_container_status()
+    server.container_call("pause")
+    assert client.containers.gets == 1
+    assert client.containers.container.calls == ["pause"]
+
+def test_container_replaced():
+    server, client = make_server()
+    old = client.containers.container
+
+    # Removed and created again under the same name
+    old.removed = True
+    client.containers.container = StubContainer("def", "paused")
+
+    assert server.get_container_status() is Status.paused
+    assert server.container.id == "def"
+
+    client.containers.container.removed = True
+    client.containers.container = StubContainer("ghi")
+    server.container_call("pause")
+    assert server.container.id == "ghi"
+    assert server.container.calls == ["pause"]
+
+@pytest.mark.asyncio
+async def test_pause_removed_container():
+    server, client = make_server()
+    client.containers.container.removed = True
+
+    # Logged, not raised, and nothing left to unpause
+    await server.pause()
+    assert server.status is Status.stopped
+
+def test_container_event():
+    server, client = make_server("exited")
+    assert server.status is Status.stopped
+
+    # Started by something else, without a health check
+    server.container_event("start")
+    assert server.status is Status.running and server.healthy
+
+    server.container_event("pause")
+    assert server.status is Status.paused
+    server.container_event("unpause")
+    assert server.status is Status.running
+    server.container_event("die")
+    assert server.status is Status.stopped
+
+    # With a health check, only running once healthy
+    server.container.attrs["Config"]["Healthcheck"] = {}
+    server.container_event("start")
+    assert server.status is Status.starting and not server.healthy
+    server.container_event("health_status: unhealthy")
+    assert server.status is Status.starting
+    server.container_event("health_status: healthy")
+    assert server.status is Status.running
+
+    # Exiting for a checkpoint leaves it paused, to be restored
+    server.status = Status.paused
+    server.checkpoint_name = "zeroscale-0"
+    server.container_event("die")
+    assert server.status is Status.paused
+
+def test_dispatch():
+    server, client = make_server()
+    other, _ = make_server()
+    other.container_id = "other"
+    events = server.events
+    events.servers = [server, other]
+    server.get_container()
+
+    # Matched by name, ID, or the ID of the cached container
+    events._dispatch({"Action": "pause", "Actor": {"ID": "x", "Attributes": {"name": "game"}}})
+    assert server.status is Status.paused and other.status is Status.running
+    events._dispatch({"status": "unpause", "Actor": {"ID": "abc", "Attributes": {}}})
+    assert server.status is Status.running
+    events._dispatch({"Action": "die", "Actor": {"ID": "other", "Attributes": {}}})
+    assert server.status is Status.running and other.status is Status.stopped
+
+    events._dispatch({"Action": "die", "Actor": {"ID": "unknown", "Attributes": {"name": "x"}}})
+    assert server.status is Status.running
+
+@pytest.mark.asyncio
+async def test_wait_for_event():
+    server, client = make_server()
+
+    waiter = asyncio.ensure_future(server.wait_for_event())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    server.container_event("pause")
+    await asyncio.wait_for(waiter, timeout=1)
+    assert server.waiters == []
+
+    # Returns once the timeout is up, without an event
+    await asyncio.wait_for(server.wait_for_event(.01), timeout=1)
+
+@pytest.mark.asyncio
+async def test_resync_waits_for_transition():
+    server, client = make_server()
+    events = server.events
+    events.servers = [server]
+    events.alive = False
+
+    # A pause in progress, which the events stream reconnects during
+    await server.lifecycle.lock.acquire()
+    events._set_alive(True)
+    client.containers.container.status = "paused"
+    await asyncio.sleep(.1)
+    assert server.status is Status.running
+
+    # Caught up once the transition is done
+    server.lifecycle.lock.release()
+    await asyncio.sleep(.1)
+    assert server.status is Status.paused
+
+@pytest.mark.asyncio
+async def test_checkpoint_removed():
+    server, client = make_server()
+    removed = []
+    server.remove_checkpoint = removed.append
+
+    # Stopped while checkpointed, so started from scratch next time
+    server.checkpoint_name = "zeroscale-0"
+    server.status = Status.paused
+    await server.stop()
+    assert server.status is Status.stopped
+    assert removed == ["zeroscale-0"]
+
+    # Nothing restores it once closed
+    server.checkpoint_name = "zeroscale-1"
+    server.close()
+    assert removed == ["zeroscale-0", "zeroscale-1"]
+    assert server.checkpoint_name is None
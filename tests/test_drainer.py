@@ -0,0 +1,39 @@
+import asyncio
+import re
+import sys
+import pytest
+
+from zeroscale.drainer import OutputDrainer
+
+SCRIPT = """
+print("starting")
+print("Done (1.5s)!", flush=True)
+for i in range(100000):
+    print("chatty line", i)
+"""
+
+async def drain(script, pattern):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", script, stdout=asyncio.subprocess.PIPE)
+    drainer = OutputDrainer(proc.stdout, re.compile(pattern), tail_lines=10)
+
+    ready = await drainer.ready
+    # Would block on a full pipe without the drainer
+    await asyncio.wait_for(proc.wait(), timeout=10)
+    await drainer.wait_closed()
+
+    return ready, drainer
+
+@pytest.mark.asyncio
+async def test_ready():
+    ready, drainer = await drain(SCRIPT, rb"Done \([0-9.]*s\)")
+
+    assert ready
+    assert len(drainer.lines) == 10
+    assert drainer.tail()[-1] == "chatty line 99999"
+
+@pytest.mark.asyncio
+async def test_never_ready():
+    ready, drainer = await drain(SCRIPT, rb"Never printed")
+
+    assert not ready
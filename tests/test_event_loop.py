@@ -0,0 +1,13 @@
+import sys
+
+from zeroscale.event_loop import install_event_loop
+
+def test_asyncio():
+    assert install_event_loop("asyncio") == "asyncio"
+
+def test_uvloop_missing(monkeypatch):
+    # A None entry makes the import raise ImportError
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    assert install_event_loop("uvloop") == "asyncio"
+    assert install_event_loop("auto") == "asyncio"
@@ -119,3 +119,31 @@ def test_setters():
 
     server.set_unpause_signal(Signals.SIGTERM)
     assert server.unpause_signal == Signals.SIGTERM
+
+class BrokenCgroup:
+    """A cgroup that can neither be frozen nor thawed"""
+
+    async def freeze(self):
+        raise OSError("freeze failed")
+
+    async def thaw(self):
+        raise TimeoutError("thaw failed")
+
+@pytest.mark.asyncio
+async def test_freeze_failure():
+    server = Generic('sleep', '60')
+    server.set_pause_method('cgroup')
+    await server.start()
+    cgroup, server.cgroup = server.cgroup, BrokenCgroup()
+
+    # Falls back to signalling the process group
+    await server.pause()
+    assert server.status is Status.paused
+    assert server.paused_by == 'group'
+
+    await server.unpause()
+    assert server.status is Status.running
+
+    server.cgroup = cgroup
+    await server.stop()
+    await server.remove_cgroup()
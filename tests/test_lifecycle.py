@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+
+from zeroscale.base_server import BaseServer
+from zeroscale.lifecycle import transition
+from zeroscale.status import Status
+
+class CountingServer(BaseServer):
+    def __init__(self):
+        self.status = Status.paused
+        self.calls = []
+
+    @transition()
+    async def start(self):
+        self.calls.append("start")
+        self.status = Status.starting
+        await asyncio.sleep(10)
+        self.status = Status.running
+
+    @transition("start")
+    async def stop(self):
+        self.calls.append("stop")
+        self.status = Status.stopped
+
+    @transition()
+    async def pause(self):
+        if self.status is not Status.running:
+            return
+        self.calls.append("pause")
+        await asyncio.sleep(.01)
+        self.status = Status.paused
+
+    @transition()
+    async def unpause(self):
+        if self.status is not Status.paused:
+            return
+        self.calls.append("unpause")
+        await asyncio.sleep(.01)
+        self.status = Status.running
+
+@pytest.mark.asyncio
+async def test_coalesce():
+    server = CountingServer()
+
+    await asyncio.gather(*(server.unpause() for _ in range(50)))
+
+    assert server.calls == ["unpause"]
+    assert server.status is Status.running
+    assert server.lifecycle.history[-1].callers == 50
+
+@pytest.mark.asyncio
+async def test_serialize():
+    server = CountingServer()
+
+    # Scheduled in order, which gather() does not promise on Python 3.6
+    transitions = [asyncio.ensure_future(transition()) for transition in (
+        server.unpause, server.pause, server.unpause)]
+    await asyncio.gather(*transitions)
+
+    assert server.calls == ["unpause", "pause", "unpause"]
+    assert [record.after for record in server.lifecycle.history] == [
+        Status.running, Status.paused, Status.running]
+
+@pytest.mark.asyncio
+async def test_preempt():
+    server = CountingServer()
+    server.status = Status.stopped
+
+    starts = [asyncio.ensure_future(server.start()) for _ in range(2)]
+    await asyncio.sleep(0)
+    await asyncio.wait_for(server.stop(), timeout=1)
+
+    assert server.calls == ["start", "stop"]
+    assert server.status is Status.stopped
+    # Every caller of the preempted start sees the stop finish, not an error
+    await asyncio.wait_for(asyncio.gather(*starts), timeout=1)
+
+@pytest.mark.asyncio
+async def test_cancel_caller():
+    server = CountingServer()
+    server.status = Status.stopped
+
+    start = asyncio.ensure_future(server.start())
+    other_start = asyncio.ensure_future(server.start())
+    await asyncio.sleep(0)
+    start.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await start
+    # The other caller keeps waiting for the start
+    assert not other_start.done()
+    assert server.status is Status.starting
+
+    await asyncio.wait_for(server.stop(), timeout=1)
+    await asyncio.wait_for(other_start, timeout=1)
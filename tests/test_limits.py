@@ -0,0 +1,33 @@
+from zeroscale.limits import ClientLimits, RateLimiter
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=1, burst=2)
+
+    assert limiter.allow("10.0.0.1", now=100)
+    assert limiter.allow("10.0.0.1", now=100)
+    assert not limiter.allow("10.0.0.1", now=100)
+    # Other sources have their own bucket
+    assert limiter.allow("10.0.0.2", now=100)
+    # Refilled at the rate
+    assert limiter.allow("10.0.0.1", now=101)
+    assert not limiter.allow("10.0.0.1", now=101)
+
+    # A time of zero is a time like any other
+    limiter = RateLimiter(rate=1, burst=1)
+    assert limiter.allow("10.0.0.1", now=0)
+    assert not limiter.allow("10.0.0.1", now=0)
+    assert limiter.allow("10.0.0.1", now=1)
+
+def test_max_connections():
+    limits = ClientLimits(max_connections=2)
+
+    assert limits.admit("10.0.0.1", 1) is None
+    assert limits.admit("10.0.0.1", 2) == "connections"
+
+def test_start_limit():
+    limits = ClientLimits(start_rate=1, trusted_networks=["192.168.0.0/16"])
+
+    assert limits.allow_start("10.0.0.1")
+    assert not limits.allow_start("10.0.0.1")
+    assert limits.allow_start("192.168.1.1")
+    assert limits.allow_start("192.168.1.1")
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+
+from zeroscale.base_server import BaseServer
+from zeroscale.metrics import Histogram, ServerMetrics, render, serve_metrics
+from zeroscale.status import Status
+from zeroscale.zeroscale import ZeroScale
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 10))
+
+    for value in (.5, 1, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 56.5
+
+def test_status_time():
+    server = BaseServer()
+    server.status = Status.stopped
+    metrics = ServerMetrics(server)
+
+    server.status = Status.starting
+    server.status = Status.running
+
+    assert metrics.cold_start.count == 1
+    assert metrics.current_status_seconds()[Status.running] >= 0
+
+@pytest.mark.asyncio
+async def test_endpoint(unused_tcp_port):
+    server = BaseServer()
+    server.status = Status.stopped
+    zeroscale = ZeroScale(server, 8080, 8080, name="test")
+    zeroscale.stats.upstream_bytes = 42
+    server.refault_stall_seconds = .25
+
+    metrics = render([zeroscale])
+    assert b'zeroscale_proxied_bytes_total{server="test",direction="upstream"} 42' in metrics
+    assert b'zeroscale_refault_stall_seconds_total{server="test"} 0.25' in metrics
+
+    metrics_server = await serve_metrics([zeroscale], unused_tcp_port)
+    reader, writer = await asyncio.open_connection(port=unused_tcp_port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    metrics_server.close()
+
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert b'zeroscale_cold_start_seconds_bucket{le="+Inf",server="test"} 0' in response
@@ -0,0 +1,97 @@
+import asyncio
+import pytest
+
+from zeroscale.codec import PacketReader, decode_string, encode_packet, encode_varint
+from zeroscale.plugins.minecraft import Server as Minecraft, STATE_LOGIN, STATE_STATUS, parse_handshake
+
+class Writer:
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
+
+def handshake(next_state, address="localhost"):
+    address = address.encode()
+    return encode_packet(0x00, encode_varint(763) + encode_varint(len(address))
+            + address + (25565).to_bytes(2, byteorder="big") + encode_varint(next_state))
+
+def reader(*packets):
+    stream = asyncio.StreamReader()
+    for packet in packets:
+        stream.feed_data(packet)
+    stream.feed_eof()
+    return stream
+
+@pytest.mark.asyncio
+async def test_valid_connection():
+    server = Minecraft()
+
+    assert await server.is_valid_connection(reader(handshake(STATE_STATUS)))
+    assert await server.is_valid_connection(reader(handshake(STATE_LOGIN)))
+    # Longer than 127 bytes, like a Forge or BungeeCord handshake
+    assert await server.is_valid_connection(reader(handshake(STATE_LOGIN, "a" * 300)))
+    assert not await server.is_valid_connection(reader(handshake(3)))
+    assert not await server.is_valid_connection(reader(encode_packet(0x05)))
+
+@pytest.mark.asyncio
+async def test_answer_client():
+    server = Minecraft()
+    status = encode_packet(0x00, b'\x0b{"a": "b"}')
+    ping = encode_packet(0x01, b"12345678")
+
+    # Nothing to answer with before the real server was asked
+    assert not await server.answer_client(reader(handshake(STATE_STATUS)), Writer())
+
+    server.status_response = status
+    writer = Writer()
+    assert await server.answer_client(
+            reader(handshake(STATE_STATUS), encode_packet(0x00), ping), writer)
+    assert writer.data == status + ping
+
+    # Players logging in need the real server
+    writer = Writer()
+    assert not await server.answer_client(reader(handshake(STATE_LOGIN)), writer)
+    assert writer.data == b""
+
+@pytest.mark.asyncio
+async def test_query_status(unused_tcp_port):
+    status = encode_packet(0x00, b'\x0b{"a": "b"}')
+
+    async def real_server(server_reader, server_writer):
+        packets = PacketReader(server_reader)
+        packet_id, payload = await packets.read_packet(1024)
+        assert parse_handshake(payload)[3] == STATE_STATUS
+        assert await packets.read_packet(1024) == (0x00, b"")
+        server_writer.write(status)
+        server_writer.close()
+
+    real = await asyncio.start_server(real_server, host="127.0.0.1", port=unused_tcp_port)
+    server = Minecraft()
+    server_reader, server_writer = await asyncio.open_connection("127.0.0.1", unused_tcp_port)
+
+    await server.query_status(server_reader, server_writer)
+    assert server.status_response == status
+
+    server_writer.close()
+    real.close()
+
+@pytest.mark.asyncio
+async def test_fake_status(tmp_path):
+    server = Minecraft()
+    favicon = tmp_path / "favicon.png"
+    favicon.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 30000)
+
+    server.set_fake_status(motd="Back soon", favicon=str(favicon), players=["Steve"])
+    status = server.fake_status()
+
+    packet_id, payload = await PacketReader(reader(status)).read_packet(1 << 20)
+    assert packet_id == 0x00
+    text, _ = decode_string(payload)
+    assert '"text":"Back soon"' in text
+    assert '"name":"Steve"' in text
+    assert '"favicon":"data:image/png;base64,iVBORw0KGgo' in text
+
+    favicon.write_bytes(b"GIF89a")
+    with pytest.raises(ValueError):
+        server.set_fake_status(favicon=str(favicon))
@@ -0,0 +1,44 @@
+from importlib import import_module
+
+import pytest
+
+import zeroscale.plugins
+from zeroscale.plugins import available_plugins, builtin_plugins, load_plugin
+from zeroscale.plugins.minecraft import Server as Minecraft
+
+class EntryPoint:
+    """Stand-in for importlib.metadata.EntryPoint, which needs Python 3.8"""
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def load(self):
+        return import_module(self.value)
+
+# Names a module, like a plugin package would
+INSTALLED = EntryPoint("echo", "tests.echo_server")
+# Installed under the name of a builtin plugin, which hides it
+SHADOWED = EntryPoint("minecraft", "tests.echo_server")
+
+@pytest.fixture
+def entry_points(monkeypatch):
+    monkeypatch.setattr(zeroscale.plugins, "_entry_points", lambda: [INSTALLED, SHADOWED])
+
+def test_builtin_plugins():
+    assert builtin_plugins() == ["generic", "minecraft", "terraria"]
+    assert load_plugin("minecraft").Server is Minecraft
+
+def test_entry_points(entry_points):
+    assert available_plugins() == {
+        "echo": "tests.echo_server",
+        "generic": "zeroscale.plugins.generic",
+        "minecraft": "zeroscale.plugins.minecraft",
+        "terraria": "zeroscale.plugins.terraria",
+    }
+    assert load_plugin("echo").__name__ == "tests.echo_server"
+    assert load_plugin("minecraft").Server is Minecraft
+
+def test_unknown_plugin(entry_points):
+    with pytest.raises(ImportError):
+        load_plugin("nonexistent")
@@ -0,0 +1,49 @@
+import time
+
+from zeroscale.prewarm import ArrivalHistory, HOUR, HOURS_PER_WEEK, hour_of_week, local_week
+
+WEEK = HOURS_PER_WEEK * HOUR
+
+def history_with(tmp_path, times):
+    history = ArrivalHistory(str(tmp_path / "history.json"))
+    for when in times:
+        history.record(when)
+    return history
+
+def test_probabilities(tmp_path):
+    start = 1000 * WEEK
+    # Clients at the same hour in 3 of 4 weeks
+    history = history_with(tmp_path, [start, start + WEEK, start + 3 * WEEK])
+    now = start + 4 * WEEK - 1
+
+    probabilities = history.probabilities(now)
+
+    assert max(probabilities) == .75
+    assert sorted(probabilities)[-2] == 0
+
+def test_save_and_load(tmp_path):
+    history = history_with(tmp_path, [time.time()])
+    history.save()
+
+    assert ArrivalHistory(history.path).hours == history.hours
+
+def test_backtest(tmp_path):
+    start = 1000 * WEEK
+    history = history_with(tmp_path, [start + week * WEEK for week in range(4)])
+
+    hits, false_alarms, misses = history.backtest(.5, now=start + 4 * WEEK - 1)
+
+    assert (hits, false_alarms, misses) == (4, 0, 0)
+
+def test_local_week(tmp_path):
+    monday = 1000 * HOURS_PER_WEEK
+    monday -= hour_of_week(monday)
+    # Wednesday and Friday, apart in weeks counted from the epoch but in the
+    # same local week
+    wednesday, friday = monday + 2 * 24, monday + 4 * 24
+    assert local_week(wednesday) == local_week(friday) != local_week(monday - 1)
+
+    history = history_with(tmp_path, [wednesday * HOUR, friday * HOUR])
+    now = (friday + HOURS_PER_WEEK) * HOUR
+
+    assert max(history.probabilities(now, exclude_week=local_week(wednesday))) == 0
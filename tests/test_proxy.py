@@ -0,0 +1,160 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+from zeroscale import proxy as proxy_module
+from zeroscale.proxy import ProxyStats, ReplayReader, _resume_reading, proxy, splice_proxy
+
+async def echo(reader, writer):
+    while True:
+        data = await reader.read(8192)
+        if not data:
+            break
+        writer.write(data)
+    writer.close()
+
+class OpaqueReader:
+    """A reader that keeps its buffer to itself"""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    async def read(self, n=-1):
+        return await self.reader.read(n)
+
+    def at_eof(self):
+        return self.reader.at_eof()
+
+async def proxied_echo(unused_tcp_port_factory, wrap=None, **proxy_args):
+    server_port, proxy_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    stats = ProxyStats()
+
+    async def handle(reader, writer):
+        if wrap:
+            reader = wrap(reader)
+        await proxy(reader, writer, "localhost", server_port, stats=stats, **proxy_args)
+
+    echo_server = await asyncio.start_server(echo, port=server_port)
+    proxy_server = await asyncio.start_server(handle, port=proxy_port)
+
+    reader, writer = await asyncio.open_connection(port=proxy_port)
+
+    data = b'some test stringi\n' * 10000
+    writer.write(data)
+    assert data == await reader.readexactly(len(data))
+
+    writer.close()
+    proxy_server.close()
+    echo_server.close()
+
+    return stats, len(data)
+
+@pytest.mark.asyncio
+async def test_stream(unused_tcp_port_factory):
+    stats, length = await proxied_echo(unused_tcp_port_factory)
+
+    assert stats.stream_bytes == length * 2
+    assert stats.splice_bytes == 0
+    assert stats.upstream_bytes == stats.downstream_bytes == length
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not hasattr(os, "splice"), reason="requires os.splice()")
+async def test_splice(unused_tcp_port_factory):
+    stats, length = await proxied_echo(unused_tcp_port_factory, splice=True)
+
+    assert stats.stream_bytes + stats.splice_bytes == length * 2
+    assert stats.splice_bytes > 0
+    assert stats.upstream_bytes == stats.downstream_bytes == length
+
+@pytest.mark.asyncio
+async def test_buffer_limits(unused_tcp_port_factory):
+    stats, length = await proxied_echo(unused_tcp_port_factory,
+            buffer_min=16, buffer_max=1 << 20,
+            write_buffer_high=1024, write_buffer_low=256)
+
+    assert stats.stream_bytes == length * 2
+
+@pytest.mark.asyncio
+async def test_protocol_engine(unused_tcp_port_factory):
+    stats, length = await proxied_echo(unused_tcp_port_factory,
+            engine="protocol", write_buffer_high=1024)
+
+    assert stats.stream_bytes == length * 2
+    assert stats.upstream_bytes == stats.downstream_bytes == length
+
+class OldTransport:
+    """Resumes like a transport before Python 3.7, which has no is_reading()"""
+
+    def __init__(self):
+        self.paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        if not self.paused:
+            raise RuntimeError("Not paused")
+        self.paused = False
+
+def test_resume_reading():
+    transport = OldTransport()
+    _resume_reading(transport)
+
+    transport.pause_reading()
+    _resume_reading(transport)
+    assert not transport.paused
+
+@pytest.mark.asyncio
+async def test_opaque_reader(unused_tcp_port_factory):
+    # Falls back to streams, as what was buffered can not be taken over
+    stats, length = await proxied_echo(unused_tcp_port_factory,
+            wrap=OpaqueReader, engine="protocol", splice=True)
+
+    assert stats.stream_bytes == length * 2
+    assert stats.splice_bytes == 0
+
+@pytest.mark.asyncio
+async def test_replay_rewind():
+    stream = asyncio.StreamReader()
+    stream.feed_data(b"hello world")
+    reader = ReplayReader(stream, limit=8)
+
+    assert await reader.readexactly(5) == b"hello"
+    reader.rewind()
+    assert await reader.read(3) == b"hel"
+    assert await reader.readexactly(4) == b"lo w"
+    # Only up to the limit is read, so it can all be replayed
+    assert await reader.read() == b"o"
+    assert await reader.read() == b""
+    assert reader.data == b"hello wo"
+
+@pytest.mark.asyncio
+async def test_splice_failure(monkeypatch):
+    cancelled_open = []
+
+    async def splice_pipe(src, dst, stats, upstream=True):
+        if upstream:
+            raise ConnectionResetError()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Cancelled while the descriptors are still open
+            cancelled_open.append(src.fileno() != -1 and dst.fileno() != -1)
+            raise
+
+    monkeypatch.setattr(proxy_module, "splice_pipe", splice_pipe)
+
+    socks = socket.socketpair() + socket.socketpair()
+    client_reader, client_writer = await asyncio.open_connection(sock=socks[0])
+    remote_reader, remote_writer = await asyncio.open_connection(sock=socks[2])
+
+    with pytest.raises(ConnectionResetError):
+        await splice_proxy(client_reader, client_writer,
+                remote_reader, remote_writer, ProxyStats())
+    assert cancelled_open == [True]
+
+    client_writer.close()
+    for sock in socks[1::2]:
+        sock.close()
@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+
+from zeroscale.status import Status
+from zeroscale.upstream import Upstream
+
+@pytest.mark.asyncio
+async def test_retry(unused_tcp_port):
+    upstream = Upstream("localhost", unused_tcp_port, connect_retries=5)
+
+    async def bind_later():
+        await asyncio.sleep(.3)
+        return await asyncio.start_server(lambda reader, writer: None, port=unused_tcp_port)
+
+    server_task = asyncio.ensure_future(bind_later())
+    reader, writer = await upstream.dial()
+    writer.close()
+    (await server_task).close()
+
+@pytest.mark.asyncio
+async def test_no_retry(unused_tcp_port):
+    upstream = Upstream("localhost", unused_tcp_port)
+
+    with pytest.raises(OSError):
+        await upstream.dial()
+
+@pytest.mark.asyncio
+async def test_pool(unused_tcp_port):
+    accepted = []
+    server = await asyncio.start_server(
+            lambda reader, writer: accepted.append(writer), port=unused_tcp_port)
+    upstream = Upstream("localhost", unused_tcp_port, pool_size=2)
+
+    upstream.status_changed(Status.running)
+    await upstream.fill_task
+    assert len(upstream.pool) == 2
+
+    reader, writer = await upstream.open_connection()
+    await upstream.fill_task
+    assert len(upstream.pool) == 2
+    assert len(accepted) == 3
+
+    upstream.status_changed(Status.stopped)
+    assert upstream.pool == []
+
+    writer.close()
+    server.close()
@@ -0,0 +1,221 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from zeroscale.base_server import BaseServer
+from zeroscale.limits import ClientLimits
+from zeroscale.status import Status
+from zeroscale.workers import Channel, Coordinator, RemoteServer, WorkerZeroScale, follow_status
+from zeroscale.zeroscale import ZeroScale
+
+class StubServer(BaseServer):
+    """Starts right away when asked to"""
+
+    def __init__(self):
+        self.status = Status.stopped
+
+    async def start(self):
+        self.status = Status.running
+
+    async def stop(self):
+        self.status = Status.stopped
+
+    async def pause(self):
+        self.status = Status.paused
+
+    async def unpause(self):
+        self.status = Status.running
+
+    def close(self):
+        pass
+
+async def channel_pair():
+    coordinator_sock, worker_sock = socket.socketpair()
+    coordinator, worker = Channel(coordinator_sock), Channel(worker_sock)
+    await worker.connect()
+    return coordinator, worker
+
+async def receive(channel, count):
+    messages = []
+    async for message in channel.receive():
+        messages.append(message)
+        if len(messages) == count:
+            return messages
+
+def make_zeroscale(**options):
+    # A long idle time, so counting clients never stops the server
+    return ZeroScale(StubServer(), 0, 0, method_pause=False, server_idle_shutdown=60, **options)
+
+@pytest.mark.asyncio
+async def test_channel():
+    coordinator, worker = await channel_pair()
+    await coordinator.connect()
+
+    worker.send(1, "opened")
+    coordinator.send(0, "status", "running")
+    assert await receive(coordinator, 1) == [(1, "opened", None)]
+    assert await receive(worker, 1) == [(0, "status", "running")]
+
+    # Ends once the other side is gone
+    worker.writer.close()
+    assert await receive(coordinator, 1) is None
+
+@pytest.mark.asyncio
+async def test_coordinator_counts():
+    zeroscales = [make_zeroscale(), make_zeroscale()]
+    (first, first_worker), (second, second_worker) = (
+            await channel_pair(), await channel_pair())
+    coordinator = Coordinator(zeroscales, [first, second])
+    await coordinator.setup()
+
+    first_worker.send(0, "opened")
+    first_worker.send(0, "opened")
+    second_worker.send(0, "opened")
+    second_worker.send(1, "opened")
+    first_worker.send(0, "closed")
+    await asyncio.sleep(.1)
+
+    assert zeroscales[0].live_connections == 2
+    assert zeroscales[1].live_connections == 1
+    assert coordinator.open_connections == [[1, 0], [1, 1]]
+
+    # A dead worker's clients are gone with it
+    second_worker.writer.close()
+    await asyncio.sleep(.1)
+    assert zeroscales[0].live_connections == 1
+    assert zeroscales[1].live_connections == 0
+    assert coordinator.open_connections == [[1, 0], [0, 0]]
+
+    for zeroscale in zeroscales:
+        zeroscale.close()
+    first_worker.writer.close()
+    await asyncio.gather(*coordinator.tasks)
+
+@pytest.mark.asyncio
+async def test_status_fan_out():
+    zeroscale = make_zeroscale()
+    channels = [await channel_pair(), await channel_pair()]
+    coordinator = Coordinator([zeroscale], [channel for channel, _ in channels])
+    await coordinator.setup()
+
+    remotes = [RemoteServer(zeroscale.server, 0, worker) for _, worker in channels]
+    followers = [
+        asyncio.ensure_future(follow_status([SimpleNamespace(server=remote)], worker))
+        for remote, (_, worker) in zip(remotes, channels)
+    ]
+
+    # A worker asks the coordinator to start the server, and every worker
+    # hears it is running
+    await asyncio.wait_for(remotes[0].start(), timeout=1)
+    await asyncio.wait_for(remotes[1].wait_for_status(Status.running), timeout=1)
+    assert zeroscale.server.status is Status.running
+
+    zeroscale.close()
+    for channel, worker in channels:
+        channel.writer.close()
+        worker.writer.close()
+    await asyncio.gather(*followers, *coordinator.tasks)
+
+@pytest.mark.asyncio
+async def test_worker_metrics():
+    zeroscale = make_zeroscale()
+    coordinator_channel, worker_channel = await channel_pair()
+    coordinator = Coordinator([zeroscale], [coordinator_channel])
+    await coordinator.setup()
+    worker = WorkerZeroScale(zeroscale, 0, worker_channel, 0)
+    follower = asyncio.ensure_future(follow_status([worker], worker_channel))
+
+    worker.stats.upstream_bytes += 10
+    worker.stats.downstream_bytes += 20
+    worker.metrics.rejected_clients += 1
+    worker.metrics.limited_clients["rate"] += 2
+    worker.metrics.upstream_connect.observe(.5)
+    worker.report_metrics()
+    await asyncio.sleep(.1)
+
+    assert zeroscale.stats.upstream_bytes == 10
+    assert zeroscale.stats.downstream_bytes == 20
+    assert zeroscale.metrics.rejected_clients == 1
+    assert zeroscale.metrics.limited_clients["rate"] == 2
+    assert zeroscale.metrics.upstream_connect.count == 1
+    assert zeroscale.metrics.upstream_connect.sum == .5
+
+    # Unpausing for a worker's client is timed by the coordinator
+    await zeroscale.server.pause()
+    await asyncio.sleep(.1)
+    assert worker.server.status is Status.paused
+    await asyncio.wait_for(worker.unpause(), timeout=1)
+    assert zeroscale.metrics.unpause.count == 1
+
+    # Only what was added since is reported again
+    worker.stats.upstream_bytes += 5
+    worker.report_metrics()
+    await asyncio.sleep(.1)
+    assert zeroscale.stats.upstream_bytes == 15
+    assert zeroscale.stats.downstream_bytes == 20
+
+    zeroscale.close()
+    coordinator_channel.writer.close()
+    worker_channel.writer.close()
+    await asyncio.gather(follower, *coordinator.tasks)
+
+@pytest.mark.asyncio
+async def test_reload():
+    zeroscale = make_zeroscale()
+    coordinator_channel, worker_channel = await channel_pair()
+    coordinator = Coordinator([zeroscale], [coordinator_channel])
+    await coordinator.setup()
+    worker = WorkerZeroScale(zeroscale, 0, worker_channel, 0)
+
+    reloads = []
+    follower = asyncio.ensure_future(
+            follow_status([worker], worker_channel, lambda: reloads.append(True)))
+
+    coordinator.reload_workers()
+    await asyncio.sleep(.1)
+    assert reloads == [True]
+
+    # Workers leave predictions to the coordinator
+    await worker.reconfigure(server_idle_shutdown=30, prewarm_history="history.json")
+    assert worker.server_idle_shutdown == 30
+    assert worker.prewarmer is None
+
+    zeroscale.close()
+    coordinator_channel.writer.close()
+    worker_channel.writer.close()
+    await asyncio.gather(follower, *coordinator.tasks)
+
+@pytest.mark.asyncio
+async def test_limits_across_workers():
+    zeroscale = make_zeroscale(limits=ClientLimits(max_connections=1, start_rate=1))
+    channels = [await channel_pair(), await channel_pair()]
+    coordinator = Coordinator([zeroscale], [channel for channel, _ in channels])
+    await coordinator.setup()
+
+    workers = [WorkerZeroScale(zeroscale, 0, worker, index)
+            for index, (_, worker) in enumerate(channels)]
+    followers = [asyncio.ensure_future(follow_status([worker], worker.channel))
+            for worker in workers]
+
+    # One client at a time, whichever worker it came to
+    assert await asyncio.wait_for(workers[0].admit("10.0.0.1"), timeout=1) is None
+    assert await asyncio.wait_for(workers[1].admit("10.0.0.2"), timeout=1) == "connections"
+    workers[0].client_done()
+    assert await asyncio.wait_for(workers[1].admit("10.0.0.2"), timeout=1) is None
+
+    # A dead worker's clients are gone with it
+    channels[1][1].writer.close()
+    await asyncio.sleep(.1)
+    assert zeroscale.active_clients == 0
+
+    # One start per source, whichever worker it came to
+    assert await asyncio.wait_for(workers[0].allow_start("10.0.0.1"), timeout=1)
+    assert not await zeroscale.allow_start("10.0.0.1")
+
+    zeroscale.close()
+    for channel, worker in channels:
+        channel.writer.close()
+        worker.writer.close()
+    await asyncio.gather(*followers, *coordinator.tasks)
@@ -0,0 +1,239 @@
+import asyncio
+import socket
+
+import pytest
+
+from zeroscale.base_server import BaseServer
+from zeroscale.status import Status
+from zeroscale.zeroscale import ZeroScale, start_servers
+
+async def echo(reader, writer):
+    while True:
+        data = await reader.read(8192)
+        if not data:
+            break
+        writer.write(data)
+    writer.close()
+
+class SlowServer(BaseServer):
+    """Takes a moment to start, and checks clients by reading a few bytes"""
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        self.status = Status.stopped
+
+    async def start(self):
+        if self.status is not Status.stopped:
+            return
+        self.status = Status.starting
+        await asyncio.sleep(self.start_time)
+        self.status = Status.running
+
+    async def stop(self):
+        self.status = Status.stopped
+
+    def close(self):
+        pass
+
+    async def is_valid_connection(self, client_reader):
+        return await client_reader.read(5) == b"hello"
+
+    def fake_status(self):
+        return b"starting"
+
+async def hold(unused_tcp_port_factory, start_time, hold_timeout):
+    server_port, listen_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    zeroscale = ZeroScale(SlowServer(start_time), listen_port, server_port,
+            method_pause=False, hold_clients=True, hold_timeout=hold_timeout)
+
+    echo_server = await asyncio.start_server(echo, port=server_port)
+    proxy_server = await zeroscale.serve()
+
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"hello world")
+    response = await reader.read(11)
+
+    writer.close()
+    # Let the proxied connection close, and schedule its stop
+    await asyncio.sleep(.1)
+    zeroscale.close()
+    proxy_server.close()
+    echo_server.close()
+
+    return response
+
+@pytest.mark.asyncio
+async def test_hold_clients(unused_tcp_port_factory):
+    assert await hold(unused_tcp_port_factory, .1, 5) == b"hello world"
+
+@pytest.mark.asyncio
+async def test_hold_timeout(unused_tcp_port_factory):
+    assert await hold(unused_tcp_port_factory, 5, .1) == b"starting"
+
+class AnsweringServer(SlowServer):
+    """Paused, and answers clients that only say "ping" itself"""
+
+    def __init__(self):
+        super().__init__(0)
+        self.status = Status.paused
+
+    async def unpause(self):
+        self.status = Status.running
+
+    async def answer_client(self, client_reader, client_writer):
+        if await client_reader.readexactly(4) != b"ping":
+            return False
+        client_writer.write(b"pong")
+        return True
+
+@pytest.mark.asyncio
+async def test_answer_client(unused_tcp_port_factory):
+    server_port, listen_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    server = AnsweringServer()
+    zeroscale = ZeroScale(server, listen_port, server_port, server_idle_shutdown=60)
+
+    echo_server = await asyncio.start_server(echo, port=server_port)
+    proxy_server = await zeroscale.serve()
+
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"ping")
+    assert await reader.read() == b"pong"
+    assert server.status is Status.paused
+    assert zeroscale.metrics.answered_clients == 1
+
+    # What the plugin read is replayed to the server
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"hello world")
+    assert await reader.readexactly(11) == b"hello world"
+    assert server.status is Status.running
+
+    writer.close()
+    await asyncio.sleep(.1)
+    zeroscale.close()
+    proxy_server.close()
+    echo_server.close()
+
+@pytest.mark.asyncio
+async def test_validate_all(unused_tcp_port_factory):
+    server_port, listen_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    server = SlowServer(0)
+    server.status = Status.running
+    zeroscale = ZeroScale(server, listen_port, server_port,
+            server_idle_shutdown=60, validate_all=True)
+
+    echo_server = await asyncio.start_server(echo, port=server_port)
+    proxy_server = await zeroscale.serve()
+
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"howdy world")
+    assert await reader.read() == b""
+    assert zeroscale.metrics.rejected_clients == 1
+
+    # The checked bytes still reach the server
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"hello world")
+    assert await reader.readexactly(11) == b"hello world"
+
+    writer.close()
+    await asyncio.sleep(.1)
+    zeroscale.close()
+    proxy_server.close()
+    echo_server.close()
+
+async def shout(reader, writer):
+    while True:
+        data = await reader.read(8192)
+        if not data:
+            break
+        writer.write(data.upper())
+    writer.close()
+
+@pytest.mark.asyncio
+async def test_reconfigure(unused_tcp_port_factory):
+    echo_port, shout_port, listen_port, new_listen_port = (
+            unused_tcp_port_factory() for _ in range(4))
+    server = SlowServer(0)
+    server.status = Status.running
+    zeroscale = ZeroScale(server, listen_port, echo_port,
+            method_pause=False, server_idle_shutdown=60)
+
+    echo_server = await asyncio.start_server(echo, port=echo_port)
+    shout_server = await asyncio.start_server(shout, port=shout_port)
+    await zeroscale.serve()
+
+    reader, writer = await asyncio.open_connection(port=listen_port)
+    writer.write(b"hello")
+    assert await reader.readexactly(5) == b"hello"
+
+    await zeroscale.reconfigure(listen_port=new_listen_port, server_port=shout_port)
+
+    # Proxied clients keep their server
+    writer.write(b"world")
+    assert await reader.readexactly(5) == b"world"
+
+    # New ones go to the new server, through the new port
+    with pytest.raises(OSError):
+        await asyncio.open_connection(port=listen_port)
+    new_reader, new_writer = await asyncio.open_connection(port=new_listen_port)
+    new_writer.write(b"hello")
+    assert await new_reader.readexactly(5) == b"HELLO"
+
+    writer.close()
+    new_writer.close()
+    await asyncio.sleep(.1)
+    assert zeroscale.kill_task and not zeroscale.kill_task.done()
+
+    # The scheduled stop is moved to the new idle time
+    await zeroscale.reconfigure(server_idle_shutdown=.2)
+    await asyncio.sleep(.3)
+    assert server.status is Status.stopped
+
+    zeroscale.close()
+    zeroscale.proxy_server.close()
+    echo_server.close()
+    shout_server.close()
+
+@pytest.mark.asyncio
+async def test_reconfigure_method(unused_tcp_port_factory):
+    server = AnsweringServer()
+    zeroscale = ZeroScale(server, unused_tcp_port_factory(), unused_tcp_port_factory())
+
+    # A paused server would never be unpaused by the stop method
+    with pytest.raises(ValueError):
+        await zeroscale.reconfigure(method_pause=False, server_idle_shutdown=1)
+    assert zeroscale.method_pause
+    assert zeroscale.server_idle_shutdown == 15
+
+    await zeroscale.reconfigure(method_pause=True, server_idle_shutdown=1)
+    assert zeroscale.server_idle_shutdown == 1
+
+class ClosingServer(SlowServer):
+    def __init__(self):
+        super().__init__(0)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def test_port_in_use(unused_tcp_port_factory):
+    taken = socket.socket()
+    taken.bind(("", unused_tcp_port_factory()))
+    taken.listen()
+
+    servers = [ClosingServer(), ClosingServer()]
+    zeroscales = [
+        ZeroScale(servers[0], unused_tcp_port_factory(), 0),
+        ZeroScale(servers[1], taken.getsockname()[1], 0),
+    ]
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        with pytest.raises(OSError):
+            start_servers(zeroscales)
+    finally:
+        taken.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+    # Nothing started, and everything closed again
+    assert [server.status for server in servers] == [Status.stopped, Status.stopped]
+    assert [server.closed for server in servers] == [True, True]
@@ -2,13 +2,16 @@
 
 import argparse
 import asyncio
+import functools
 import logging
 import sys
-from importlib import import_module
 
-from .docker import DockerProxyServer
-from .parser import add_common_options
-from .zeroscale import ZeroScale
+from .config import load_entries, reload_entries
+from .event_loop import install_event_loop
+from .parser import RELOADABLE_OPTIONS, add_common_options, set_fake_status, zeroscale_options
+from .plugins import load_plugin
+from .workers import start_workers
+from .zeroscale import ZeroScale, start_servers
 
 logger = logging.getLogger(__name__)
 
@@ -16,12 +19,14 @@ logger = logging.getLogger(__name__)
 def main(*argv):
     """Load arguments and start a Zeroscale proxy server"""
 
-    parser = argparse.ArgumentParser(description="Scale a container to zero.")
+    parser = argparse.ArgumentParser(description="Scale a container to zero.",
+            fromfile_prefix_chars="@")
     add_common_options(parser)
 
     parser.add_argument(
         "container_id",
         type=str,
+        nargs="?",
         help="ID or name of the Docker container to control. Must already exist. Will also try to connect to this container as the server to proxy unless server_host is set.",
     )
     parser.add_argument(
@@ -36,35 +41,86 @@ def main(*argv):
             level=args.log_level,
             format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 
+    install_event_loop(args.event_loop)
+
+    entries = load_entries(parser, args)
+
+    for name, entry in entries:
+        if not entry.container_id:
+            parser.error("container_id is required%s" % (
+                " in section [%s]" % name if name else " unless --config is set"))
+
+    # Imported once needed, as the Docker SDK is slow to import
+    import docker
+
+    # One client for all the containers managed by this process
+    docker_client = docker.from_env()
+
+    try:
+        zeroscales = []
+        for name, entry in entries:
+            zeroscale = create_zeroscale(entry, docker_client, name)
+            if not zeroscale:
+                return 1
+            zeroscales.append(zeroscale)
+
+        async def reload(zeroscales):
+            nonlocal entries
+            entries = reload_entries(parser, *argv, entries=entries,
+                    reloadable=RELOADABLE_OPTIONS)
+            for (name, entry), zeroscale in zip(entries, zeroscales):
+                await zeroscale.reconfigure(**container_options(entry))
+
+        if args.workers:
+            start_workers(zeroscales, args.workers, args.metrics_port, reload)
+        else:
+            start_servers(zeroscales, metrics_port=args.metrics_port,
+                    reload=functools.partial(reload, zeroscales))
+    finally:
+        docker_client.close()
+
+def create_zeroscale(args, docker_client, name=None):
+    """Wrap a container, and optionally a plugin, in a ZeroScale proxy server"""
+
+    from .docker import DockerProxyServer
+
     wrapped_server = None
     if args.plugin:
         try:
-            plugin = import_module("." + args.plugin, package="zeroscale.plugins")
-        except (ModuleNotFoundError, ImportError):
+            plugin = load_plugin(args.plugin)
+        except ImportError:
             logger.exception("Could not load plugin '%s'", args.plugin)
-            return 1
+            return None
 
         wrapped_server = plugin.Server(
             *args.plugin_argument
         )
+        set_fake_status(wrapped_server, args)
+
+    server = DockerProxyServer(args.container_id, wrapped_server, docker_client)
+
+    if name:
+        server.set_log_context(name)
 
-    server = DockerProxyServer(args.container_id, wrapped_server)
+    if args.memory_reclaim != "off":
+        server.set_memory_reclaim(args.memory_reclaim, args.memory_keep)
+
+    if args.checkpoint_dir:
+        server.set_checkpoint_dir(args.checkpoint_dir)
 
     if args.disable_exit_stop:
         async def no_stop():
             pass
         server.stop = no_stop
 
-    ZeroScale(
-        server=server,
-        listen_port=args.listen_port,
-        server_host=args.server_host or args.container_id,
-        server_port=args.server_port or args.listen_port,
-        method_pause=not args.method_stop,
-        server_idle_shutdown=args.idle_shutdown,
-        server_shutdown_timeout=args.shutdown_timeout,
-        ignore_bad_clients=args.ignore_bad_clients
-    ).start_server()
+    return ZeroScale(server=server, name=name, **container_options(args))
+
+def container_options(args):
+    """ZeroScale() arguments for a container, connecting to it by default"""
+
+    options = zeroscale_options(args)
+    options["server_host"] = args.server_host or args.container_id
+    return options
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
@@ -1,13 +1,18 @@
 #!/usr/bin/env python
 
 import argparse
+import functools
 import logging
 import signal
 import sys
-from importlib import import_module
 
-from .parser import add_common_options
-from .zeroscale import ZeroScale
+from .config import load_entries, reload_entries
+from .event_loop import install_event_loop
+from .parser import RELOADABLE_OPTIONS, add_common_options, set_fake_status, zeroscale_options
+from .plugins import load_plugin
+from .plugins.generic import PAUSE_METHODS
+from .workers import start_workers
+from .zeroscale import ZeroScale, start_servers
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +27,8 @@ def parse_signal(signal):
 def main(*argv):
     """Load arguments and start a Zeroscale proxy server"""
 
-    parser = argparse.ArgumentParser(description="Scale a server to zero.")
+    parser = argparse.ArgumentParser(description="Scale a server to zero.",
+            fromfile_prefix_chars="@")
     add_common_options(parser)
 
     parser.add_argument(
@@ -41,6 +47,15 @@ def main(*argv):
         type=int,
         help="Signal to send to the server process to unpause it. In int form. Default 18 (SIGCONT)",
     )
+    parser.add_argument(
+        "--pause_method",
+        choices=PAUSE_METHODS,
+        default="signal",
+        help="""How to pause the server process. 'signal' sends pause_signal
+                to it, 'cgroup' freezes it and everything it started in a
+                cgroup v2 of its own, falling back to sending pause_signal to
+                its whole process group. Default signal.""",
+    )
     parser.add_argument(
         "--stop_signal",
         type=int,
@@ -56,14 +71,47 @@ def main(*argv):
             level=args.log_level,
             format='%(asctime)s:%(levelname)s:%(name)s:%(message)s')
 
+    install_event_loop(args.event_loop)
+
+    entries = load_entries(parser, args)
+    zeroscales = [create_zeroscale(entry, name) for name, entry in entries]
+
+    async def reload(zeroscales):
+        nonlocal entries
+        entries = reload_entries(parser, *argv, entries=entries,
+                reloadable=RELOADABLE_OPTIONS + ("plugin_argument",))
+        for (name, entry), zeroscale in zip(entries, zeroscales):
+            # Run by the next start, a running server is left be
+            if hasattr(zeroscale.server, "set_server_args"):
+                zeroscale.server.set_server_args(*entry.plugin_argument)
+            await zeroscale.reconfigure(**zeroscale_options(entry))
+
+    if args.workers:
+        start_workers(zeroscales, args.workers, args.metrics_port, reload)
+    else:
+        start_servers(zeroscales, metrics_port=args.metrics_port,
+                reload=functools.partial(reload, zeroscales))
+
+def create_zeroscale(args, name=None):
+    """Load the plugin server and wrap it in a ZeroScale proxy server"""
+
     try:
-        plugin = import_module("." + args.plugin, package="zeroscale.plugins")
-    except (ModuleNotFoundError, ImportError):
+        plugin = load_plugin(args.plugin)
+    except ImportError:
         logger.exception("Could not load plugin '%s'", args.plugin)
         raise
 
     server = plugin.Server(*args.plugin_argument)
+    set_fake_status(server, args)
+
+    if args.method == "checkpoint" and not args.method_stop \
+            and not getattr(server, "checkpoint_supported", True):
+        logger.warning("The %s plugin talks to its server through pipes, which "
+                "CRIU can not restore, so it will be paused instead of checkpointed",
+                args.plugin)
 
+    if name:
+        server.set_log_context(name)
     if args.working_directory:
         server.set_working_directory(args.working_directory)
     if args.pause_signal:
@@ -72,17 +120,14 @@ def main(*argv):
         server.set_unpause_signal(parse_signal(args.unpause_signal))
     if args.stop_signal:
         server.set_stop_signal(parse_signal(args.stop_signal))
+    if args.pause_method != "signal":
+        server.set_pause_method(args.pause_method)
+    if args.memory_reclaim != "off":
+        server.set_memory_reclaim(args.memory_reclaim, args.memory_keep)
+    if args.checkpoint_dir:
+        server.set_checkpoint_dir(args.checkpoint_dir)
 
-    ZeroScale(
-        server=server,
-        listen_port=args.listen_port,
-        server_host=args.server_host,
-        server_port=args.server_port or args.listen_port,
-        method_pause=not args.method_stop,
-        server_idle_shutdown=args.idle_shutdown,
-        server_shutdown_timeout=args.shutdown_timeout,
-        ignore_bad_clients=args.ignore_bad_clients
-    ).start_server()
+    return ZeroScale(server=server, name=name, **zeroscale_options(args))
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv[1:]))
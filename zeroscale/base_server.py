@@ -1,12 +1,104 @@
 import asyncio
 import logging
 
+from .lifecycle import Lifecycle
 from .status import Status
 
 logger = logging.getLogger(__name__)
 
 
 class BaseServer:
+    logger = logger
+
+    _status = None
+    _status_listeners = ()
+    _lifecycle = None
+
+    # Memory reclaimed from the server while paused, in bytes, and what
+    # faulting it back in cost right after unpausing: major page faults and
+    # seconds stalled on memory
+    reclaimed_bytes = 0
+    refault_major_faults = 0
+    refault_stall_seconds = 0.
+    _refaults = None
+
+    # Seconds between calls of query_status() while the server is running,
+    # or None for plugins that do not keep its status
+    status_query_interval = None
+
+    @property
+    def lifecycle(self) -> Lifecycle:
+        """Serializes and coalesces the transitions of this server"""
+
+        if self._lifecycle is None:
+            self._lifecycle = Lifecycle(self)
+        return self._lifecycle
+
+    @property
+    def status(self) -> Status:
+        return self._status
+
+    @status.setter
+    def status(self, status: Status):
+        self._status = status
+        for listener in self._status_listeners:
+            listener(status)
+
+    def add_status_listener(self, listener):
+        """Call listener(status) every time the status is set"""
+
+        self._status_listeners = self._status_listeners + (listener,)
+
+    def remove_status_listener(self, listener):
+        self._status_listeners = tuple(
+            other for other in self._status_listeners if other != listener
+        )
+
+    async def wait_for_status(self, *statuses: Status) -> Status:
+        """Wait until the status is set to one of these statuses"""
+
+        while self.status not in statuses:
+            future = asyncio.get_event_loop().create_future()
+
+            def wake(status):
+                if status in statuses and not future.done():
+                    future.set_result(status)
+
+            self.add_status_listener(wake)
+            try:
+                await future
+            finally:
+                self.remove_status_listener(wake)
+
+        return self.status
+
+    def measure_refaults(self, reclaimer, cgroup):
+        """Count what faulting reclaimed memory back in costs, in the
+            background, once the server has been unpaused"""
+
+        async def measure():
+            faults, stall = await reclaimer.measure(cgroup, self.logger)
+            self.refault_major_faults += faults
+            if stall is not None:
+                self.refault_stall_seconds += stall
+
+        self.cancel_refaults()
+        self._refaults = asyncio.ensure_future(measure())
+
+    def cancel_refaults(self):
+        if self._refaults:
+            self._refaults.cancel()
+            self._refaults = None
+
+    def set_log_context(self, name: str):
+        """Log under a child logger with this name, to tell servers apart"""
+
+        self.logger = type(self).logger.getChild(name)
+
+    async def open(self):
+        """Prepare anything that needs the event loop, before serving"""
+
+        pass
 
     async def start(self):
         raise NotImplementedError
@@ -20,11 +112,33 @@ class BaseServer:
     async def unpause(self):
         raise NotImplementedError
 
+    async def checkpoint(self):
+        """Save the server to disk and end it, to be restored by unpause()
+
+        Like pause(), it leaves the server paused. Servers that cannot be
+        checkpointed just pause."""
+
+        await self.pause()
+
     def close(self):
         raise NotImplementedError
 
     async def is_valid_connection(self, client_reader):
         return True
 
+    async def query_status(self, server_reader, server_writer):
+        """Ask the running server for its status, over a connection of its own,
+            to answer clients with while it is not running"""
+
+        pass
+
+    async def answer_client(self, client_reader, client_writer) -> bool:
+        """Answer a client without waking the server, if all it wants is
+            something known without it, returning True if it was answered
+
+        What is read is replayed to the server if it was not."""
+
+        return False
+
     def fake_status(self) -> bytes:
         return b"Server starting up..."
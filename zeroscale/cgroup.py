@@ -0,0 +1,319 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+# Seconds to wait for the kernel to report a freeze or thaw as done
+FREEZE_TIMEOUT = 5
+# Seconds between checks of cgroup.events while waiting
+POLL_INTERVAL = .005
+
+# Ways to push out the memory of a paused server
+RECLAIM_POLICIES = ("off", "reclaim", "high")
+
+MIB = 1 << 20
+
+# Seconds after an unpause over which the cost of faulting reclaimed memory
+# back in is measured
+REFAULT_WINDOW = 5
+
+# Leaf cgroup that the processes of zeroscale's own cgroup are moved into, so
+# controllers can be enabled for the cgroups of servers next to it
+LEAF_NAME = "zeroscale-supervisor"
+
+logger = logging.getLogger(__name__)
+
+_names = itertools.count()
+
+
+def cgroup_root() -> str:
+    """Where the cgroup v2 hierarchy is mounted, or None if it is not"""
+
+    try:
+        with open("/proc/self/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "cgroup2":
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def current_cgroup(pid="self") -> str:
+    """Path of a process's cgroup v2, relative to the root"""
+
+    with open("/proc/%s/cgroup" % pid) as cgroups:
+        for line in cgroups:
+            if line.startswith("0::"):
+                return line[3:].strip()
+    raise OSError("Not in a cgroup v2 hierarchy")
+
+
+def own_cgroup() -> str:
+    """Path of the cgroup this process was started in, relative to the root,
+        even once moved into its leaf"""
+
+    path = current_cgroup()
+    if os.path.basename(path) == LEAF_NAME:
+        path = os.path.dirname(path)
+    return path
+
+
+class Cgroup:
+    """A cgroup v2 of its own for a server's process tree
+
+    Freezing it stops every process in it, however many there are and
+    whatever signals they ignore."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def of_process(cls, pid: int):
+        """The cgroup a process is in, like the main process of a container"""
+
+        root = cgroup_root()
+        if root is None:
+            raise OSError("cgroup v2 is not mounted")
+        return cls(os.path.join(root, current_cgroup(pid).lstrip("/")))
+
+    @classmethod
+    def create(cls, name: str = "zeroscale", memory: bool = False):
+        """Create a new cgroup under this process's own one
+
+        With memory, the memory controller is enabled for it if possible."""
+
+        root = cgroup_root()
+        if root is None:
+            raise OSError("cgroup v2 is not mounted")
+
+        own = own_cgroup()
+        parent = cls(os.path.join(root, own.lstrip("/")))
+        if memory:
+            try:
+                parent.enable_controller("memory", is_root=own == "/")
+            except OSError as e:
+                logger.warning("Could not enable the memory controller for %s: %s", parent.path, e)
+
+        path = parent.file("%s-%i-%i" % (name, os.getpid(), next(_names)))
+        os.mkdir(path)
+
+        cgroup = cls(path)
+        if not os.path.exists(cgroup.file("cgroup.freeze")):
+            cgroup.remove()
+            raise OSError("cgroup freezer not supported, needs Linux 5.2 or later")
+
+        return cgroup
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def read(self, name: str) -> str:
+        with open(self.file(name)) as control:
+            return control.read().strip()
+
+    def write(self, name: str, value: str):
+        with open(self.file(name), "w") as control:
+            control.write(value)
+
+    def enable_controller(self, controller: str, is_root: bool = False):
+        """Enable a controller for the children of this cgroup
+
+        Apart from the root, a cgroup v2 with controllers enabled for its
+        children can not have processes of its own, like a systemd service's
+        does. So they are first moved into a leaf child, LEAF_NAME."""
+
+        if controller in self.read("cgroup.subtree_control").split():
+            return
+        if controller not in self.read("cgroup.controllers").split():
+            raise OSError("%s controller not delegated to %s" % (controller, self.path))
+
+        if not is_root:
+            leaf = Cgroup(self.file(LEAF_NAME))
+            os.makedirs(leaf.path, exist_ok=True)
+            for pid in self.read("cgroup.procs").split():
+                try:
+                    leaf.write("cgroup.procs", pid)
+                except ProcessLookupError:
+                    # Exited in the meantime
+                    pass
+
+        self.write("cgroup.subtree_control", "+" + controller)
+
+    def join(self):
+        """Move the calling process into the cgroup, to use as a preexec_fn"""
+
+        self.write("cgroup.procs", str(os.getpid()))
+
+    def events(self) -> dict:
+        with open(self.file("cgroup.events")) as events:
+            return dict(line.split() for line in events if line.strip())
+
+    def is_frozen(self) -> bool:
+        return self.events().get("frozen") == "1"
+
+    async def set_frozen(self, frozen: bool, timeout: float = FREEZE_TIMEOUT) -> float:
+        """Freeze or thaw, returning the seconds until the kernel reported it done"""
+
+        start = time.monotonic()
+        self.write("cgroup.freeze", "1" if frozen else "0")
+
+        while self.is_frozen() is not frozen:
+            if time.monotonic() - start > timeout:
+                raise TimeoutError("cgroup %s not %s after %i seconds" % (
+                    self.path, "frozen" if frozen else "thawed", timeout))
+            await asyncio.sleep(POLL_INTERVAL)
+
+        return time.monotonic() - start
+
+    async def freeze(self, timeout: float = FREEZE_TIMEOUT) -> float:
+        return await self.set_frozen(True, timeout)
+
+    async def thaw(self, timeout: float = FREEZE_TIMEOUT) -> float:
+        return await self.set_frozen(False, timeout)
+
+    def kill(self) -> bool:
+        """Kill every process in the cgroup, if the kernel supports it"""
+
+        try:
+            self.write("cgroup.kill", "1")
+            return True
+        except OSError:
+            return False
+
+    def memory_current(self) -> int:
+        return int(self.read("memory.current"))
+
+    def major_faults(self) -> int:
+        for line in self.read("memory.stat").splitlines():
+            key, value = line.split()
+            if key == "pgmajfault":
+                return int(value)
+        return 0
+
+    def memory_stall(self) -> float:
+        """Seconds that some process in the cgroup spent stalled on memory,
+            from memory.pressure"""
+
+        for line in self.read("memory.pressure").splitlines():
+            kind, *fields = line.split()
+            if kind == "some":
+                return int(dict(field.split("=") for field in fields)["total"]) / 1e6
+        return 0.
+
+    def reclaim(self, amount: int):
+        """Ask the kernel to reclaim this many bytes, blocking until it is done"""
+
+        try:
+            self.write("memory.reclaim", str(amount))
+        except BlockingIOError:
+            # Less than the full amount could be reclaimed
+            pass
+
+    async def wait_empty(self, timeout: float = FREEZE_TIMEOUT):
+        """Wait for every process in the cgroup to be gone"""
+
+        start = time.monotonic()
+        while self.events().get("populated") == "1":
+            if time.monotonic() - start > timeout:
+                raise TimeoutError("cgroup %s still has processes" % self.path)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def remove(self):
+        """Remove the cgroup, which only works once it is empty"""
+
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            logger.debug("Could not remove cgroup %s", self.path, exc_info=True)
+
+
+class MemoryReclaimer:
+    """Pushes the memory of a paused server's cgroup out, and lets it back in
+        once unpaused
+
+    'reclaim' asks the kernel once, through memory.reclaim, to reclaim all but
+    keep bytes. 'high' lowers memory.high to keep bytes until unpaused, which
+    also keeps the memory from coming back. Either makes the next unpause
+    slower, as the memory is faulted back in, and measure() tells how much."""
+
+    def __init__(self, policy: str, keep: int = 0):
+        self.policy = policy
+        self.keep = keep
+        self.saved_high = None
+        self.faults = None
+        self.stall = None
+
+    async def reclaim(self, cgroup: Cgroup, log=logger) -> int:
+        """Reclaim memory of a paused cgroup, returning the bytes reclaimed"""
+
+        loop = asyncio.get_event_loop()
+
+        try:
+            before = cgroup.memory_current()
+            start = time.monotonic()
+
+            if self.policy == "reclaim":
+                await loop.run_in_executor(None, cgroup.reclaim, max(0, before - self.keep))
+            else:
+                self.saved_high = cgroup.read("memory.high")
+                # Lowering it reclaims right away, in the writing thread
+                await loop.run_in_executor(None, cgroup.write, "memory.high", str(self.keep))
+
+            reclaimed = max(0, before - cgroup.memory_current())
+        except OSError as e:
+            log.warning("Could not reclaim memory of cgroup %s: %s", cgroup.path, e)
+            return 0
+
+        log.info("Reclaimed %.1f of %.1f MiB in %.2f seconds",
+                reclaimed / MIB, before / MIB, time.monotonic() - start)
+        return reclaimed
+
+    def restore(self, cgroup: Cgroup, log=logger):
+        """Undo any limits, before the cgroup is unpaused"""
+
+        self.faults = None
+        try:
+            if self.saved_high is not None:
+                cgroup.write("memory.high", self.saved_high)
+                self.saved_high = None
+            self.faults = cgroup.major_faults()
+        except OSError as e:
+            log.warning("Could not restore memory limits of cgroup %s: %s", cgroup.path, e)
+
+        try:
+            self.stall = cgroup.memory_stall()
+        except OSError:
+            # The kernel was built without pressure stall information
+            self.stall = None
+
+    async def measure(self, cgroup: Cgroup, log=logger, window: float = REFAULT_WINDOW):
+        """Measure what faulting the memory back in costs over the window after
+            the cgroup was unpaused, returning the major page faults taken and
+            the seconds its processes stalled on memory
+
+        The stall is time the server lost waiting for its memory, which its
+        clients see as latency. Without pressure stall information, it is None."""
+
+        faults, stall = self.faults, self.stall
+        if faults is None:
+            return 0, None
+        await asyncio.sleep(window)
+
+        try:
+            faults = cgroup.major_faults() - faults
+            if stall is not None:
+                stall = cgroup.memory_stall() - stall
+        except OSError as e:
+            log.warning("Could not measure memory faults of cgroup %s: %s", cgroup.path, e)
+            return 0, None
+
+        if stall is None:
+            log.info("%i major page faults in the %i seconds after unpausing",
+                    faults, window)
+        else:
+            log.info("%i major page faults and %.1f ms stalled on memory in the "
+                    "%i seconds after unpausing", faults, stall * 1000, window)
+        return faults, stall
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import tempfile
+
+# Ways to scale a server down once it is idle
+METHODS = ("pause", "stop", "checkpoint")
+
+# Seconds between checks of whether a restored process is still alive
+POLL_INTERVAL = .1
+
+MIB = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def directory_size(path: str) -> int:
+    """Total size of the files under a directory, in bytes"""
+
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+class CheckpointStats:
+    """Counts of checkpoints and restores, to log how reliable they are"""
+
+    def __init__(self):
+        self.checkpoints = 0
+        self.checkpoint_failures = 0
+        self.restores = 0
+        self.restore_failures = 0
+
+    def log_checkpoint(self, log, seconds: float, size: int = None):
+        self.checkpoints += 1
+        log.info("Checkpointed in %.2f seconds, to %s (%i of %i checkpoints succeeded)",
+                seconds, "%.1f MiB" % (size / MIB) if size is not None else "an image of unknown size",
+                self.checkpoints, self.checkpoints + self.checkpoint_failures)
+
+    def log_checkpoint_failure(self, log, error):
+        self.checkpoint_failures += 1
+        log.warning("Checkpoint failed, pausing instead (%i of %i checkpoints succeeded): %s",
+                self.checkpoints, self.checkpoints + self.checkpoint_failures, error)
+
+    def log_restore(self, log, seconds: float):
+        self.restores += 1
+        log.info("Restored in %.2f seconds (%i of %i restores succeeded)",
+                seconds, self.restores, self.restores + self.restore_failures)
+
+    def log_restore_failure(self, log, error):
+        self.restore_failures += 1
+        log.warning("Restore failed, starting from scratch (%i of %i restores succeeded): %s",
+                self.restores, self.restores + self.restore_failures, error)
+
+
+class RestoredProcess:
+    """Stand-in for the asyncio Process of a server restored by CRIU
+
+    The restored process is no longer a child of this one, so it can only be
+    signalled, and waited for by checking if it still exists."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+        self.stdin = None
+        self.stdout = None
+
+    def send_signal(self, sig):
+        os.kill(self.pid, sig)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self) -> int:
+        while self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                # The real exit code went to whoever reaped it
+                self.returncode = 0
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        return self.returncode
+
+
+async def criu(*args: str):
+    """Run CRIU, raising CheckpointError with its output if it fails"""
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "criu", *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except OSError as e:
+        raise CheckpointError("Could not run criu: %s" % e) from e
+
+    output, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise CheckpointError("criu %s failed: %s" % (
+            args[0], output.decode(errors="replace").strip().splitlines()[-1:]))
+
+
+class CriuImage:
+    """A CRIU checkpoint of a process tree, in a directory of its own"""
+
+    # Options for both dumping and restoring
+    OPTIONS = ("--shell-job", "--tcp-established", "--ext-unix-sk", "--file-locks")
+
+    def __init__(self, checkpoint_dir: str = None):
+        self.checkpoint_dir = checkpoint_dir
+        self.path = None
+
+    async def dump(self, pid: int) -> int:
+        """Checkpoint the process tree, which ends it, returning the image size"""
+
+        if self.checkpoint_dir:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="zeroscale-", dir=self.checkpoint_dir)
+
+        try:
+            await criu("dump", "--tree", str(pid), "--images-dir", self.path, *self.OPTIONS)
+        except CheckpointError:
+            self.remove()
+            raise
+
+        return directory_size(self.path)
+
+    async def restore(self) -> int:
+        """Restore the process tree, returning the pid of its root"""
+
+        pidfile = os.path.join(self.path, "restored.pid")
+        try:
+            await criu("restore", "--images-dir", self.path, "--restore-detached",
+                    "--pidfile", pidfile, *self.OPTIONS)
+            with open(pidfile) as restored:
+                return int(restored.read())
+        finally:
+            self.remove()
+
+    def remove(self):
+        if self.path:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
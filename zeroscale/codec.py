@@ -0,0 +1,132 @@
+import asyncio
+
+# Data types and packet framing of the Minecraft protocol
+# See https://wiki.vg/Protocol#Data_types
+
+ENCODING = "utf-8"
+
+# Bytes read from a stream at once while waiting for a whole packet
+READ_SIZE = 4096
+
+
+def _encode_var(value: int, bits: int) -> bytes:
+    value &= (1 << bits) - 1
+    data = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if not value:
+            data.append(byte)
+            return bytes(data)
+        data.append(byte | 0x80)
+
+
+def _decode_var(data: bytes, offset: int, bits: int):
+    value = 0
+    for shift in range(0, bits + 6, 7):
+        if offset >= len(data):
+            raise IndexError("Cut short")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            # Two's complement
+            if value >= 1 << (bits - 1):
+                value -= 1 << bits
+            return value, offset
+    raise ValueError("Longer than %i bytes" % ((bits + 6) // 7))
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a signed 32 bit integer as a VarInt"""
+
+    return _encode_var(value, 32)
+
+
+def decode_varint(data: bytes, offset: int = 0):
+    """Decode a VarInt at offset, returning it and the offset after it
+
+    Raises IndexError if data ends before it does, and ValueError if it is
+    longer than 5 bytes."""
+
+    return _decode_var(data, offset, 32)
+
+
+def encode_varlong(value: int) -> bytes:
+    """Encode a signed 64 bit integer as a VarLong"""
+
+    return _encode_var(value, 64)
+
+
+def decode_varlong(data: bytes, offset: int = 0):
+    """Decode a VarLong at offset, like decode_varint()"""
+
+    return _decode_var(data, offset, 64)
+
+
+def encode_string(value: str) -> bytes:
+    """Encode a string, prefixed with its length in bytes as a VarInt"""
+
+    data = value.encode(ENCODING)
+    return encode_varint(len(data)) + data
+
+
+def decode_string(data: bytes, offset: int = 0):
+    """Decode a string at offset, returning it and the offset after it"""
+
+    length, offset = decode_varint(data, offset)
+    if length < 0 or offset + length > len(data):
+        raise IndexError("String cut short")
+    return data[offset:offset + length].decode(ENCODING), offset + length
+
+
+def encode_packet(packet_id: int, payload: bytes = b"") -> bytes:
+    """Frame a packet, prefixed with its length and ID as VarInts"""
+
+    body = encode_varint(packet_id) + payload
+    return encode_varint(len(body)) + body
+
+
+class PacketReader:
+    """Reads whole packets from a stream, as few reads at a time as it takes
+
+    Bytes are read in chunks, so a handshake usually takes a single read,
+    and whatever comes after a packet is kept for the next one."""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.buffer = bytearray()
+
+    async def _fill(self):
+        data = await self.reader.read(READ_SIZE)
+        if not data:
+            raise asyncio.IncompleteReadError(bytes(self.buffer), None)
+        self.buffer.extend(data)
+
+    async def read_packet(self, max_length: int):
+        """Read a packet, returning its ID and payload
+
+        Raises ValueError for a packet over max_length bytes or one that is
+        not framed right, and IncompleteReadError if the stream ends first."""
+
+        while True:
+            try:
+                length, offset = decode_varint(self.buffer)
+                break
+            except IndexError:
+                await self._fill()
+
+        if not 0 < length <= max_length:
+            raise ValueError("Packet length %i out of range" % length)
+
+        while len(self.buffer) < offset + length:
+            await self._fill()
+
+        body = bytes(self.buffer[offset:offset + length])
+        del self.buffer[:offset + length]
+
+        try:
+            packet_id, start = decode_varint(body)
+        except IndexError:
+            raise ValueError("Packet ID cut short")
+        return packet_id, body[start:]
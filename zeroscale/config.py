@@ -0,0 +1,98 @@
+import argparse
+import configparser
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Options that apply to the whole process, not to a single server
+GLOBAL_OPTIONS = ("config", "help", "list_plugins", "info", "debug", "event_loop",
+        "workers", "metrics_port")
+
+
+def load_config(parser, path: str):
+    """Read a config file of servers to manage, returning (name, args) pairs
+
+    Each section of the INI file is one server. Keys are the long names of the
+    command line options, and values are parsed by the same parser that parses
+    the command line. Flags take a boolean, and options that can be given
+    multiple times take one value per line."""
+
+    config = configparser.ConfigParser(interpolation=None)
+    with open(path) as config_file:
+        config.read_file(config_file)
+
+    options = {}
+    for action in parser._actions:
+        if not action.option_strings:
+            options[action.dest] = action
+        for option in action.option_strings:
+            if option.startswith("--"):
+                options[option[2:]] = action
+
+    entries = []
+    for name in config.sections():
+        argv = []
+        positionals = []
+
+        for key, value in config.items(name):
+            action = options.get(key)
+            if action is None or key in GLOBAL_OPTIONS:
+                raise ValueError("Unknown option '%s' in section [%s] of %s" % (key, name, path))
+
+            if not action.option_strings:
+                positionals.append(value)
+            elif action.nargs == 0:
+                if config.getboolean(name, key):
+                    argv.append("--" + key)
+            elif isinstance(action, argparse._AppendAction):
+                argv.extend("--%s=%s" % (key, line) for line in value.splitlines() if line)
+            else:
+                argv.append("--%s=%s" % (key, value))
+
+        logger.debug("Loaded server [%s] from %s", name, path)
+        entries.append((name, parser.parse_args(argv + positionals)))
+
+    return entries
+
+
+def load_entries(parser, args):
+    """(name, args) pairs of the servers to manage, from the config file if
+        there is one, or the command line otherwise"""
+
+    if args.config:
+        return load_config(parser, args.config)
+    return [(None, args)]
+
+
+def reload_entries(parser, argv=None, entries=(), reloadable=()):
+    """Parse the command line and config file again, for a reload
+
+    Returns new (name, args) pairs for the servers in entries, matched by
+    name. Changed options that are not in reloadable keep their old values,
+    and are logged as needing a restart, as are added and removed servers."""
+
+    try:
+        new_entries = dict(load_entries(parser, parser.parse_args(argv)))
+    except SystemExit:
+        # What was wrong is already printed by the parser
+        raise ValueError("Invalid options")
+
+    reloaded = []
+    for name, args in entries:
+        new_args = new_entries.pop(name, None)
+        if new_args is None:
+            logger.warning("Server [%s] was removed, restart to stop it", name)
+            reloaded.append((name, args))
+            continue
+
+        for key, value in sorted(vars(new_args).items()):
+            if key not in reloadable and value != getattr(args, key, None):
+                logger.warning("Option '%s'%s changed, restart to apply it",
+                        key, " of [%s]" % name if name else "")
+                setattr(new_args, key, getattr(args, key, None))
+        reloaded.append((name, new_args))
+
+    for name in new_entries:
+        logger.warning("Server [%s] was added, restart to start it", name)
+
+    return reloaded
@@ -1,9 +1,19 @@
 import asyncio
+import concurrent.futures
 import docker
+import functools
+import itertools
 import logging
+import os
+import threading
+import time
+import weakref
 
 from .status import Status
 from .base_server import BaseServer
+from .cgroup import Cgroup, MemoryReclaimer
+from .checkpoint import CheckpointStats, directory_size
+from .lifecycle import transition
 
 STATUS_MAP = {
     'created': Status.starting,
@@ -15,42 +25,368 @@ STATUS_MAP = {
     'running': Status.running,
 }
 
+# Container events that change the status, and what they change it to
+EVENT_STATUS_MAP = {
+    'die': Status.stopped,
+    'pause': Status.paused,
+    'unpause': Status.running,
+}
+
+# Threads for blocking Docker API calls, shared by every container
+EXECUTOR_THREADS = 4
+
+# Where Docker keeps checkpoints without a checkpoint directory
+DOCKER_CHECKPOINTS = "/var/lib/docker/containers/%s/checkpoints"
+
+# Seconds between health checks while the events stream is down
+POLL_INTERVAL = .5
+# Seconds to wait before following the events stream again after it drops
+RECONNECT_DELAY = 5
+
 logger = logging.getLogger(__name__)
 
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=EXECUTOR_THREADS)
+
+
+class DockerEvents:
+    """Follows the Docker events stream in a thread, for the containers of
+        every server sharing a Docker client"""
+
+    _by_client = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_client(cls, docker_client):
+        if docker_client not in cls._by_client:
+            cls._by_client[docker_client] = cls(docker_client)
+        return cls._by_client[docker_client]
+
+    def __init__(self, docker_client):
+        self.docker_client = docker_client
+        self.servers = []
+        self.alive = False
+        self.loop = None
+        self.stream = None
+        self.thread = None
+        self.refollow = False
+
+    def watch(self, server):
+        """Start passing the events of a server's container to it"""
+
+        self.servers.append(server)
+        self.loop = asyncio.get_event_loop()
+
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._follow, name="docker-events", daemon=True)
+            self.thread.start()
+        else:
+            # Follow again, filtered to include the new container
+            self._refollow()
+
+    def unwatch(self, server):
+        if server in self.servers:
+            self.servers.remove(server)
+            self._refollow()
+
+    def _refollow(self):
+        self.refollow = True
+        if self.stream is not None:
+            self.stream.close()
+
+    def _follow(self):
+        while self.servers:
+            self.refollow = False
+            try:
+                self.stream = self.docker_client.events(decode=True, filters={
+                    'type': 'container',
+                    'container': [server.container_id for server in self.servers],
+                })
+                self._post(self._set_alive, True)
+                for event in self.stream:
+                    self._post(self._dispatch, event)
+            except Exception:
+                logger.debug("Docker events stream failed", exc_info=True)
+            finally:
+                if not self.refollow:
+                    self._post(self._set_alive, False)
+
+            self.stream = None
+            if not self.refollow:
+                time.sleep(RECONNECT_DELAY)
+
+        self.thread = None
+
+    def _post(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The event loop is already closed
+            pass
+
+    def _set_alive(self, alive: bool):
+        if alive == self.alive:
+            return
+
+        self.alive = alive
+        if alive:
+            logger.debug("Following Docker events")
+            # Catch up on anything missed while not following, apart from
+            # a start in progress, which sets its own status once healthy
+            for server in self.servers:
+                if server.status is not Status.starting:
+                    asyncio.ensure_future(server.resync())
+        else:
+            logger.warning("Lost the Docker events stream, polling instead")
+
+        for server in self.servers:
+            server.wake_waiters()
+
+    def _dispatch(self, event):
+        actor = event.get('Actor', {})
+        name = actor.get('Attributes', {}).get('name')
+
+        for server in self.servers:
+            if server.is_container(actor.get('ID'), name):
+                server.container_event(event.get('Action') or event.get('status', ''))
+
 
 class DockerProxyServer(BaseServer):
     """Docker container interface"""
+    logger = logger
+
     def __init__(self,
             container_id: str,
             wrapped_class: BaseServer = None,
+            docker_client: docker.DockerClient = None,
         ):
 
         self.container_id = container_id
         self.wrapped_class = wrapped_class
 
-        self.docker_client = docker.from_env()
+        # A client passed in is shared with other servers, so is not ours to close
+        self.owns_client = docker_client is None
+        self.docker_client = docker_client or docker.from_env()
+
+        # Fetched once, then reused for every call until invalidated
+        self.container = None
         self.status = self.get_container_status()
 
+        self.events = DockerEvents.for_client(self.docker_client)
+        self.healthy = None
+        self.waiters = []
+        self.reclaimer = None
+        self.cgroup = None
+        self.checkpoint_dir = None
+        # The name of the checkpoint while the container is checkpointed
+        self.checkpoint_name = None
+        self.checkpoint_names = itertools.count()
+        self.checkpoint_stats = CheckpointStats()
+
     def get_container(self):
+        """Return the cached container handle, fetching it if needed"""
+
+        if self.container is None:
+            try:
+                self.container = self.docker_client.containers.get(self.container_id)
+            except docker.errors.NotFound:
+                self.logger.critical("Can not manage container that does not exist!")
+                raise
+
+        return self.container
+
+    def invalidate_container(self):
+        """Drop the cached container handle, so the next use fetches it again"""
+
+        self.container = None
+
+    def refresh_container(self):
+        """Reload the state of the container from Docker"""
+
+        if self.container is None:
+            return self.get_container()
+
+        try:
+            self.container.reload()
+        except docker.errors.NotFound:
+            # Replaced by a new container with the same name
+            self.invalidate_container()
+            self.get_container()
+
+        return self.container
+
+    def container_call(self, method: str):
+        """Call a method of the cached container handle, fetching it again
+            once if the container was replaced since"""
+
+        try:
+            return getattr(self.get_container(), method)()
+        except docker.errors.NotFound:
+            self.invalidate_container()
+            return getattr(self.get_container(), method)()
+
+    async def run(self, func, *args):
+        """Run a blocking Docker call in the executor, off the event loop"""
+
+        return await asyncio.get_event_loop().run_in_executor(
+            executor, functools.partial(func, *args))
+
+    async def refresh_status(self):
+        status = await self.run(self.get_container_status)
+        if status is Status.stopped and self.checkpoint_name:
+            # Exited for the checkpoint, to be restored by unpause()
+            status = Status.paused
+        self.status = status
+
+    @transition()
+    async def resync(self):
+        """Refresh the status between transitions, so it does not overwrite
+            the one a pause or start in progress is about to set"""
+
+        if self.status is Status.starting:
+            return
         try:
-            return self.docker_client.containers.get(self.container_id)
+            await self.recover_status()
+        except docker.errors.DockerException as e:
+            self.logger.warning("Could not refresh the container status: %s", e)
+
+    async def recover_status(self):
+        """Refresh the status after a failed call, as stopped if the
+            container is gone"""
+
+        try:
+            await self.refresh_status()
         except docker.errors.NotFound:
-            logger.critical("Can not manage container that does not exist!")
-            raise
+            self.status = Status.stopped
 
     def get_container_status(self):
-        container = self.get_container()
-        logger.debug("Container status: '%s'", container.status)
+        container = self.refresh_container()
+        self.logger.debug("Container status: '%s'", container.status)
         return STATUS_MAP.get(container.status)
 
+    def has_healthcheck(self) -> bool:
+        # Only from the cache, as this is called on the event loop
+        if self.container is None:
+            return False
+        return 'Healthcheck' in self.container.attrs.get('Config', {})
+
     def get_container_healthy(self):
-        container = self.get_container()
+        container = self.refresh_container()
         try:
             return container.attrs['State']['Health']['Status'] == 'healthy'
         except KeyError:
             # The container doesn't have a health check, so have to pass it
             return True
 
+    def set_memory_reclaim(self, policy: str, keep: int = 0):
+        """Reclaim memory of the paused container, through its cgroup on this host"""
+
+        self.reclaimer = MemoryReclaimer(policy, keep)
+
+    def get_container_cgroup(self) -> Cgroup:
+        """The cgroup of the container, found from its main process"""
+
+        container = self.refresh_container()
+        return Cgroup.of_process(container.attrs['State']['Pid'])
+
+    def set_checkpoint_dir(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+
+    # docker-py has no checkpoint calls, so these go through its request helpers
+
+    def create_checkpoint(self, name: str):
+        """Checkpoint the container, which leaves it exited"""
+
+        api = self.docker_client.api
+        data = {'CheckpointID': name, 'Exit': True}
+        if self.checkpoint_dir:
+            data['CheckpointDir'] = self.checkpoint_dir
+        api._raise_for_status(api._post_json(
+            api._url("/containers/{0}/checkpoints", self.get_container().id), data=data))
+
+    def start_from_checkpoint(self, name: str):
+        api = self.docker_client.api
+        params = {'checkpoint': name}
+        if self.checkpoint_dir:
+            params['checkpoint-dir'] = self.checkpoint_dir
+        api._raise_for_status(api._post(
+            api._url("/containers/{0}/start", self.get_container().id), params=params))
+
+    def remove_checkpoint(self, name: str):
+        api = self.docker_client.api
+        params = {'dir': self.checkpoint_dir} if self.checkpoint_dir else {}
+        api._raise_for_status(api._delete(
+            api._url("/containers/{0}/checkpoints/{1}", self.get_container().id, name),
+            params=params))
+
+    def discard_checkpoint(self):
+        """Remove the checkpoint the container would be restored from, so it
+            is started from scratch instead"""
+
+        name, self.checkpoint_name = self.checkpoint_name, None
+        if name is None:
+            return
+        try:
+            self.remove_checkpoint(name)
+        except docker.errors.DockerException:
+            self.logger.warning("Could not remove checkpoint %s", name, exc_info=True)
+
+    def checkpoint_size(self, name: str) -> int:
+        """Size of a checkpoint, if it is on this host and readable"""
+
+        path = os.path.join(
+            self.checkpoint_dir or DOCKER_CHECKPOINTS % self.get_container().id, name)
+        return directory_size(path) if os.path.isdir(path) else None
+
+    def is_container(self, container_id: str, name: str) -> bool:
+        if self.container_id in (container_id, name):
+            return True
+        return self.container is not None and self.container.id == container_id
+
+    def container_event(self, action: str):
+        """Update the status from an event of the container"""
+
+        self.logger.debug("Container event: '%s'", action)
+
+        if action.startswith('health_status:'):
+            self.healthy = action.endswith(' healthy')
+            if self.healthy and self.status is Status.starting:
+                self.status = Status.running
+        elif action == 'start':
+            self.healthy = not self.has_healthcheck()
+            # Started by something else than start() or restore()
+            if self.status not in (Status.starting, Status.running):
+                self.status = Status.running if self.healthy else Status.starting
+        elif action == 'die' and self.checkpoint_name:
+            # Exited for the checkpoint, to be restored by unpause()
+            pass
+        elif action in EVENT_STATUS_MAP:
+            self.status = EVENT_STATUS_MAP[action]
+
+        self.wake_waiters()
+
+    def wake_waiters(self):
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait_for_event(self, timeout: float = None):
+        """Wait for the next container event, or for timeout seconds"""
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def open(self):
+        self.events.watch(self)
+
+        if self.wrapped_class:
+            await self.wrapped_class.open()
+
+    @transition()
     async def start(self):
         """Start the Docker container"""
 
@@ -58,70 +394,179 @@ class DockerProxyServer(BaseServer):
             return
 
         self.status = Status.starting
-        logger.info("Starting container")
-        container = self.get_container()
-        container.start()
+        self.logger.info("Starting container")
+        await self.run(self.container_call, "start")
         await self.await_container_healthy()
         self.status = Status.running
-        logger.info("Container running")
+        self.logger.info("Container running")
 
     async def await_container_healthy(self):
         """Wait for the container to be healthy. A container without a health check
            passes immediately"""
 
-        logger.debug("Waiting for container healthy status")
-        while not self.get_container_healthy():
-            await asyncio.sleep(.5)
+        self.logger.debug("Waiting for container healthy status")
+        self.healthy = await self.run(self.get_container_healthy)
+
+        while not self.healthy:
+            if self.events.alive:
+                await self.wait_for_event()
+            else:
+                await self.wait_for_event(POLL_INTERVAL)
+                if not self.events.alive:
+                    self.healthy = await self.run(self.get_container_healthy)
 
+    @transition("start")
     async def stop(self):
         """Stop the Docker container"""
 
-        if self.status not in (Status.running, Status.paused):
-            return False
+        if self.status not in (Status.starting, Status.running, Status.paused):
+            return
 
-        logger.info("Stopping container")
-        self.status = Status.running
-        container = self.get_container()
-        container.stop()
+        self.logger.info("Stopping container")
+        self.status = Status.stopping
+        await self.run(self.container_call, "stop")
+        # Started from scratch next time, not from the checkpoint
+        await self.run(self.discard_checkpoint)
+        self.status = Status.stopped
+        self.logger.info("Container stopped")
 
+    @transition()
     async def pause(self):
         """Pause the Docker container"""
 
         if self.status not in (Status.starting, Status.running):
             return
 
-        logger.info("Pausing container")
+        self.logger.info("Pausing container")
         self.status = Status.paused
-        container = self.get_container()
 
         try:
-            container.pause()
+            await self.run(self.container_call, "pause")
         except docker.errors.APIError:
-            logger.warn("Container failed to pause")
+            self.logger.warning("Container failed to pause")
+            await self.recover_status()
+            return
+
+        if self.reclaimer:
+            try:
+                self.cgroup = await self.run(self.get_container_cgroup)
+            except (OSError, KeyError) as e:
+                self.logger.warning("Could not find the cgroup of the container: %s", e)
+                return
+            self.reclaimed_bytes += await self.reclaimer.reclaim(self.cgroup, self.logger)
 
+    @transition()
     async def unpause(self):
         """Unpause the Docker container"""
 
         if self.status is not Status.paused:
             return
 
-        logger.info("Unpausing container")
-        self.status = Status.running
-        container = self.get_container()
+        if self.checkpoint_name:
+            await self.restore()
+            return
+
+        self.logger.info("Unpausing container")
+
+        if self.reclaimer and self.cgroup:
+            self.reclaimer.restore(self.cgroup, self.logger)
+
+        try:
+            await self.run(self.container_call, "unpause")
+            # Only now, as clients that see running are proxied straight away
+            self.status = Status.running
+            if self.reclaimer and self.cgroup:
+                self.measure_refaults(self.reclaimer, self.cgroup)
+        except docker.errors.APIError:
+            self.logger.warning("Container failed to unpause")
+            await self.recover_status()
+
+    @transition()
+    async def checkpoint(self):
+        """Checkpoint the Docker container, or pause it if that fails"""
+
+        if self.status is not Status.running:
+            return
+
+        self.logger.info("Checkpointing container")
+        self.status = Status.paused
+
+        name = "zeroscale-%i" % next(self.checkpoint_names)
+        self.checkpoint_name = name
+        start = time.monotonic()
+
+        try:
+            await self.run(self.create_checkpoint, name)
+        except docker.errors.APIError as e:
+            self.checkpoint_name = None
+            self.checkpoint_stats.log_checkpoint_failure(self.logger, e)
+            try:
+                await self.run(self.container_call, "pause")
+            except docker.errors.APIError:
+                self.logger.warning("Container failed to pause")
+                await self.recover_status()
+            return
+
+        seconds = time.monotonic() - start
+        size = await self.run(self.checkpoint_size, name)
+        self.checkpoint_stats.log_checkpoint(self.logger, seconds, size)
+
+    async def restore(self):
+        """Start the container from its checkpoint, or from scratch if that fails"""
+
+        name, self.checkpoint_name = self.checkpoint_name, None
+        self.logger.info("Restoring container")
+        start = time.monotonic()
 
         try:
-            container.unpause()
+            await self.run(self.start_from_checkpoint, name)
+        except docker.errors.APIError as e:
+            self.checkpoint_stats.log_restore_failure(self.logger, e)
+            # Left for a client to start it over
+            await self.recover_status()
+        else:
+            self.checkpoint_stats.log_restore(self.logger, time.monotonic() - start)
+            # Restored exactly as it was, so already healthy
+            self.status = Status.running
+
+        try:
+            await self.run(self.remove_checkpoint, name)
         except docker.errors.APIError:
-            logger.warn("Container failed to unpause")
+            self.logger.debug("Could not remove checkpoint %s", name, exc_info=True)
+
+    def set_log_context(self, name: str):
+        super().set_log_context(name)
+        if self.wrapped_class:
+            self.wrapped_class.set_log_context(name)
 
     def close(self):
-        self.docker_client.close()
+        self.cancel_refaults()
+        self.events.unwatch(self)
+        # Nothing would restore it once this process is gone
+        self.discard_checkpoint()
+        if self.owns_client:
+            self.docker_client.close()
 
     async def is_valid_connection(self, client_reader):
         if self.wrapped_class:
             return await self.wrapped_class.is_valid_connection(client_reader)
         else:
-            return super().is_valid_connection(client_reader)
+            return await super().is_valid_connection(client_reader)
+
+    @property
+    def status_query_interval(self):
+        if self.wrapped_class:
+            return self.wrapped_class.status_query_interval
+        return None
+
+    async def query_status(self, server_reader, server_writer):
+        if self.wrapped_class:
+            await self.wrapped_class.query_status(server_reader, server_writer)
+
+    async def answer_client(self, client_reader, client_writer) -> bool:
+        if self.wrapped_class:
+            return await self.wrapped_class.answer_client(client_reader, client_writer)
+        return False
 
     def fake_status(self) -> bytes:
         if self.wrapped_class:
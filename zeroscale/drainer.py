@@ -0,0 +1,58 @@
+import asyncio
+import collections
+import logging
+
+# Last lines of output kept for diagnostics
+TAIL_LINES = 200
+
+logger = logging.getLogger(__name__)
+
+
+class OutputDrainer:
+    """Reads the output of a server process for as long as it runs
+
+    Every line is checked for a bytes pattern, as is, until it matches and
+    ready is set to True. After that, lines are only kept in a bounded ring
+    buffer, so the process can never block on a full pipe. If the output ends
+    without a match, ready is set to False."""
+
+    def __init__(self, stream, ready_pattern, tail_lines: int = TAIL_LINES):
+        self.stream = stream
+        self.ready_pattern = ready_pattern
+        self.lines = collections.deque(maxlen=tail_lines)
+        self.ready = asyncio.get_event_loop().create_future()
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        pattern = self.ready_pattern
+
+        try:
+            while True:
+                try:
+                    line = await self.stream.readline()
+                except ValueError:
+                    # Longer than the stream's limit, and already thrown away
+                    continue
+
+                if not line:
+                    return
+                self.lines.append(line)
+
+                if pattern is not None and pattern.search(line):
+                    pattern = None
+                    if not self.ready.done():
+                        self.ready.set_result(True)
+        finally:
+            if not self.ready.done():
+                self.ready.set_result(False)
+
+    def tail(self, encoding: str = "utf-8"):
+        """The last lines of output, decoded"""
+
+        return [line.decode(encoding, errors="replace").rstrip() for line in self.lines]
+
+    async def wait_closed(self):
+        await self.task
+
+    def close(self):
+        self.task.cancel()
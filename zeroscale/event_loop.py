@@ -0,0 +1,24 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOPS = ("asyncio", "uvloop", "auto")
+
+
+def install_event_loop(name: str = "auto") -> str:
+    """Install the event loop policy for the process, and return the name of
+        the loop that will be used. 'auto' uses uvloop if it is installed."""
+
+    if name == "asyncio":
+        return name
+
+    try:
+        import uvloop
+    except ImportError:
+        if name == "uvloop":
+            logger.warning("uvloop is not installed, falling back to asyncio")
+        return "asyncio"
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import functools
+import logging
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Transitions kept in a server's history
+HISTORY_LENGTH = 100
+
+Transition = collections.namedtuple(
+    "Transition", ("name", "before", "after", "seconds", "callers")
+)
+
+
+class Lifecycle:
+    """Runs the start, stop, pause and unpause transitions of a server
+
+    Transitions run one at a time, so each one sees the status the last one
+    left. A transition requested while the same one is already queued or
+    running, with no other one requested since, is not run again: the caller
+    waits for the one in flight. Callers of a transition that another one
+    preempts wait for that one instead."""
+
+    def __init__(self, server):
+        self.server = server
+        self.lock = asyncio.Lock()
+        # In flight transition futures by name, and how many callers wait on each
+        self.pending = {}
+        self.latest = None
+        self.callers = {}
+        # The transition that preempted each cancelled one
+        self.preempted_by = weakref.WeakKeyDictionary()
+        self.history = collections.deque(maxlen=HISTORY_LENGTH)
+
+    async def run(self, name: str, transition, preempts=()):
+        """Run the transition coroutine function, or wait for the one in flight
+
+        Any in flight transitions named in preempts are cancelled first, like
+        a start that would otherwise keep a stop waiting for it to finish."""
+
+        preempted = []
+        for other in preempts:
+            if other in self.pending:
+                self.server.logger.debug("Cancelling %s for %s", other, name)
+                self.pending[other].cancel()
+                preempted.append(self.pending[other])
+
+        future = self.pending.get(name)
+        if future is None or future is not self.latest:
+            callers = [0]
+            future = asyncio.ensure_future(self._run(name, transition, callers))
+            self.pending[name] = future
+            self.callers[future] = callers
+            self.latest = future
+            future.add_done_callback(lambda _: self._done(name, future))
+
+        for other in preempted:
+            self.preempted_by[other] = future
+
+        self.callers[future][0] += 1
+        while True:
+            try:
+                # A caller giving up must not cancel it for every other caller
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Unless it was the caller that was cancelled, wait for what
+                # preempted the transition, so the caller sees where it left
+                # the server instead of an error
+                if not future.cancelled() or future not in self.preempted_by:
+                    raise
+                future = self.preempted_by[future]
+
+    def _done(self, name: str, future):
+        del self.callers[future]
+        if self.pending.get(name) is future:
+            del self.pending[name]
+
+    async def _run(self, name: str, transition, callers):
+        async with self.lock:
+            before = self.server.status
+            start = time.monotonic()
+
+            try:
+                return await transition()
+            finally:
+                record = Transition(name, before, self.server.status,
+                        time.monotonic() - start, callers[0])
+                self.history.append(record)
+                self.server.logger.debug("%s: %s -> %s in %.3f seconds, for %i callers",
+                        name, getattr(before, "name", before),
+                        getattr(record.after, "name", record.after),
+                        record.seconds, record.callers)
+
+
+def transition(*preempts: str):
+    """Decorate a server's start(), stop(), pause() or unpause() to run it
+        through the server's Lifecycle, cancelling the named transitions"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self):
+            return await self.lifecycle.run(
+                method.__name__, functools.partial(method, self), preempts)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,112 @@
+import ipaddress
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reasons a client can be turned away for
+LIMITS = ("rate", "connections", "start")
+
+# Most source addresses to keep a bucket for, before forgetting idle ones
+MAX_SOURCES = 65536
+
+HOUR = 3600
+
+
+class TokenBucket:
+    """Allows a burst of events, then a steady rate of them"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """A token bucket for each source address"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.buckets = {}
+
+    def allow(self, source, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            if len(self.buckets) >= MAX_SOURCES:
+                self.prune(now)
+            bucket = self.buckets[source] = TokenBucket(self.burst, now)
+
+        return bucket.take(self.rate, self.burst, now)
+
+    def prune(self, now: float):
+        """Forget the buckets that have filled up again, as a new one is the same"""
+
+        full = self.burst / self.rate
+        self.buckets = {
+            source: bucket for source, bucket in self.buckets.items()
+            if now - bucket.updated < full
+        }
+        if len(self.buckets) >= MAX_SOURCES:
+            logger.warning("Over %i sources are being rate limited, forgetting them all", MAX_SOURCES)
+            self.buckets = {}
+
+
+class ClientLimits:
+    """Limits on clients of a server: how often each source can connect, how
+        many can be connected at once, and how often each untrusted source can
+        start the server"""
+
+    def __init__(self,
+            rate: float = 0,
+            burst: int = 10,
+            max_connections: int = 0,
+            start_rate: float = 0,
+            trusted_networks=(),
+        ):
+        # What the limits were made from, to tell if new ones differ
+        self.settings = (rate, burst, max_connections, start_rate, tuple(trusted_networks))
+        self.max_connections = max_connections
+        self.rate = RateLimiter(rate, burst) if rate else None
+        # Each source is allowed one start, then start_rate more per hour
+        self.start = RateLimiter(start_rate / HOUR, 1) if start_rate else None
+        self.trusted_networks = [
+            ipaddress.ip_network(network, strict=False) for network in trusted_networks
+        ]
+
+    def admit(self, source, active: int):
+        """Check a new client, returning the limit it hit, or None if there is none"""
+
+        if self.max_connections and active >= self.max_connections:
+            return "connections"
+        if self.rate and not self.rate.allow(source):
+            return "rate"
+        return None
+
+    def is_trusted(self, source) -> bool:
+        try:
+            address = ipaddress.ip_address(source)
+        except ValueError:
+            # Not an IP address, like a Unix socket
+            return True
+        return any(address in network for network in self.trusted_networks)
+
+    def allow_start(self, source) -> bool:
+        """Check if a client from this source may start the server"""
+
+        if not self.start or self.is_trusted(source):
+            return True
+        return self.start.allow(source)
@@ -0,0 +1,211 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from .limits import LIMITS
+from .status import Status
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts of observed values in fixed buckets, like a Prometheus histogram
+
+    Counts are kept per bucket, and only made cumulative when rendered, so
+    observing a value does not allocate anything."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ServerMetrics:
+    """Metrics of a single server, other than those kept in its ProxyStats
+
+    Time in each status and cold starts are followed with a status listener,
+    timing every change from starting to running."""
+
+    def __init__(self, server):
+        self.rejected_clients = 0
+        self.answered_clients = 0
+        self.limited_clients = dict.fromkeys(LIMITS, 0)
+        self.cold_start = Histogram()
+        self.unpause = Histogram()
+        self.upstream_connect = Histogram()
+
+        self.status_seconds = dict.fromkeys(Status, 0.)
+        self.status = server.status
+        self.since = time.monotonic()
+        server.add_status_listener(self.status_changed)
+
+    def status_changed(self, status: Status):
+        now = time.monotonic()
+
+        if self.status is Status.starting and status is Status.running:
+            self.cold_start.observe(now - self.since)
+
+        if self.status is not None:
+            self.status_seconds[self.status] += now - self.since
+        self.status = status
+        self.since = now
+
+    def current_status_seconds(self):
+        """Time in each status, including the time so far in the current one"""
+
+        seconds = dict(self.status_seconds)
+        if self.status is not None:
+            seconds[self.status] += time.monotonic() - self.since
+        return seconds
+
+
+def _labels(**labels) -> str:
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+def _family(lines, name, kind, help_text):
+    lines.append("# HELP %s %s" % (name, help_text))
+    lines.append("# TYPE %s %s" % (name, kind))
+
+
+def _histogram(lines, name, histogram, **labels):
+    total = 0
+    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        total += count
+        lines.append("%s_bucket%s %i" % (name, _labels(le=bound, **labels), total))
+    lines.append("%s_sum%s %r" % (name, _labels(**labels), histogram.sum))
+    lines.append("%s_count%s %i" % (name, _labels(**labels), histogram.count))
+
+
+def render(zeroscales) -> bytes:
+    """All metrics of these servers, in the Prometheus text format"""
+
+    servers = [
+        (zeroscale.name or str(zeroscale.listen_port), zeroscale)
+        for zeroscale in zeroscales
+    ]
+    lines = []
+
+    _family(lines, "zeroscale_live_connections", "gauge",
+            "Clients currently being proxied.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_live_connections%s %i" % (
+            _labels(server=server), zeroscale.live_connections))
+
+    _family(lines, "zeroscale_proxied_bytes_total", "counter",
+            "Bytes proxied, upstream from clients or downstream to them.")
+    for server, zeroscale in servers:
+        for direction, count in (
+                ("upstream", zeroscale.stats.upstream_bytes),
+                ("downstream", zeroscale.stats.downstream_bytes)):
+            lines.append("zeroscale_proxied_bytes_total%s %i" % (
+                _labels(server=server, direction=direction), count))
+
+    _family(lines, "zeroscale_status_seconds_total", "counter",
+            "Time the server has spent in each status.")
+    for server, zeroscale in servers:
+        for status, seconds in zeroscale.metrics.current_status_seconds().items():
+            lines.append("zeroscale_status_seconds_total%s %r" % (
+                _labels(server=server, status=status.name), seconds))
+
+    _family(lines, "zeroscale_rejected_clients_total", "counter",
+            "Clients that failed the plugin's connection check.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_rejected_clients_total%s %i" % (
+            _labels(server=server), zeroscale.metrics.rejected_clients))
+
+    _family(lines, "zeroscale_answered_clients_total", "counter",
+            "Clients the plugin answered itself, without waking the server.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_answered_clients_total%s %i" % (
+            _labels(server=server), zeroscale.metrics.answered_clients))
+
+    _family(lines, "zeroscale_limited_clients_total", "counter",
+            "Clients turned away for going over a limit.")
+    for server, zeroscale in servers:
+        for limit, count in zeroscale.metrics.limited_clients.items():
+            lines.append("zeroscale_limited_clients_total%s %i" % (
+                _labels(server=server, limit=limit), count))
+
+    _family(lines, "zeroscale_reclaimed_bytes_total", "counter",
+            "Memory reclaimed from the server while paused.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_reclaimed_bytes_total%s %i" % (
+            _labels(server=server), zeroscale.server.reclaimed_bytes))
+
+    _family(lines, "zeroscale_refault_major_faults_total", "counter",
+            "Major page faults taken right after unpausing the server with memory reclaimed.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_refault_major_faults_total%s %i" % (
+            _labels(server=server), zeroscale.server.refault_major_faults))
+
+    _family(lines, "zeroscale_refault_stall_seconds_total", "counter",
+            "Time the server stalled on memory right after being unpaused with memory reclaimed.")
+    for server, zeroscale in servers:
+        lines.append("zeroscale_refault_stall_seconds_total%s %r" % (
+            _labels(server=server), zeroscale.server.refault_stall_seconds))
+
+    for name, attribute, help_text in (
+            ("zeroscale_cold_start_seconds", "cold_start",
+                "Time from starting the server until it is running."),
+            ("zeroscale_unpause_seconds", "unpause",
+                "Time taken to unpause the server for a client."),
+            ("zeroscale_upstream_connect_seconds", "upstream_connect",
+                "Time taken to connect to the server for a client.")):
+        _family(lines, name, "histogram", help_text)
+        for server, zeroscale in servers:
+            _histogram(lines, name, getattr(zeroscale.metrics, attribute), server=server)
+
+    lines.append("")
+    return "\n".join(lines).encode()
+
+
+async def serve_metrics(zeroscales, port: int):
+    """Serve the metrics of these servers over HTTP on /metrics"""
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            method, path = request.split(b" ", 2)[:2]
+
+            if method == b"GET" and path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", render(zeroscales)
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write((
+                "HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %i\r\n"
+                "Connection: close\r\n\r\n" % (status, CONTENT_TYPE, len(body))
+            ).encode() + body)
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, asyncio.TimeoutError):
+            logger.debug("Bad metrics request", exc_info=True)
+        finally:
+            writer.close()
+
+    metrics_server = await asyncio.start_server(handle, port=port)
+
+    for sock in metrics_server.sockets:
+        logger.info("Serving metrics on %s", sock.getsockname())
+
+    return metrics_server
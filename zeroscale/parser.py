@@ -1,9 +1,38 @@
+import argparse
 import logging
 
+from .cgroup import RECLAIM_POLICIES
+from .checkpoint import METHODS
+from .event_loop import EVENT_LOOPS
+from .limits import ClientLimits
+from .plugins import available_plugins
+from .proxy import ENGINES
+
 logger = logging.getLogger(__name__)
 
 
+class ListPluginsAction(argparse.Action):
+    """Print the name of every plugin and where it comes from, then exit"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        for name, source in available_plugins().items():
+            print("%s\t%s" % (name, source))
+        parser.exit()
+
+
 def add_common_options(parser):
+    parser.add_argument(
+        "--config",
+        "-c",
+        type=str,
+        help="""INI file describing several servers to manage from this one
+                process. Each section is a server, with keys named like the
+                long options here. All other options are ignored, apart from
+                logging and event loop ones.""",
+    )
     parser.add_argument(
         "--listen_port",
         "-p",
@@ -27,7 +56,14 @@ def add_common_options(parser):
         "--plugin",
         type=str,
         default="generic",
-        help="Package name of the server plugin. Must be in plugins dir. Defaults to the generic provider.",
+        help="""Name of the server plugin, either a module in the plugins dir
+                or one installed in the zeroscale.plugins entry point group.
+                Defaults to the generic provider.""",
+    )
+    parser.add_argument(
+        "--list_plugins",
+        action=ListPluginsAction,
+        help="List the available plugins and exit.",
     )
     parser.add_argument(
         "--method_stop",
@@ -35,6 +71,18 @@ def add_common_options(parser):
         action="store_true",
         help="Instead of pausing the process, stop it completely. This isn't recommended since extra startup time will be needed.",
     )
+    parser.add_argument(
+        "--method",
+        choices=METHODS,
+        default="pause",
+        help="""How to scale the server down once idle. 'checkpoint' saves it
+                to disk with CRIU, or docker checkpoint for containers, and
+                restores it for the next client, pausing instead if it cannot
+                be saved and starting from scratch if it cannot be restored.
+                Servers the minecraft and terraria plugins run themselves are
+                always paused, as CRIU cannot restore their pipes. method_stop is the same as 'stop'.
+                Default pause.""",
+    )
     parser.add_argument(
         "--idle_shutdown",
         "-t",
@@ -67,6 +115,219 @@ def add_common_options(parser):
                 This is implemented by each server plugin. The default plugin
                 has no check.""",
     )
+    parser.add_argument(
+        "--validate_all",
+        action="store_true",
+        help="""Check every client connection, not only those that would start
+                or unpause the server, closing the bad ones. What the check
+                reads is forwarded to the server, so clients see no
+                difference.""",
+    )
+    parser.add_argument(
+        "--fake_motd",
+        type=str,
+        help="Message of the fake status shown while the server starts up. Minecraft plugin only.",
+    )
+    parser.add_argument(
+        "--fake_favicon",
+        type=str,
+        help="64x64 PNG image for the fake status. Minecraft plugin only.",
+    )
+    parser.add_argument(
+        "--fake_player",
+        type=str,
+        action="append",
+        default=[],
+        help="Name to list as a player in the fake status. Can be called multiple times. Minecraft plugin only.",
+    )
+    parser.add_argument(
+        "--hold_clients",
+        action="store_true",
+        help="""Instead of sending the fake status to clients connecting while
+                the server starts, keep them connected until it is running,
+                then proxy them as normal.""",
+    )
+    parser.add_argument(
+        "--hold_timeout",
+        type=int,
+        default=60,
+        help="Time in seconds to hold a client for the server to start, before sending the fake status instead. Default 60.",
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=float,
+        default=0,
+        help="Most new connections per second from a single address. Default 0, for no limit.",
+    )
+    parser.add_argument(
+        "--rate_burst",
+        type=int,
+        default=10,
+        help="Connections a single address can make at once before rate_limit applies. Default 10.",
+    )
+    parser.add_argument(
+        "--max_connections",
+        type=int,
+        default=0,
+        help="Most clients connected at once. Default 0, for no limit.",
+    )
+    parser.add_argument(
+        "--start_limit",
+        type=float,
+        default=0,
+        help="""Most times per hour a single untrusted address can start the
+                server, after the first. Default 0, for no limit.""",
+    )
+    parser.add_argument(
+        "--trusted_network",
+        type=str,
+        action="append",
+        default=[],
+        help="""Network in CIDR form whose addresses are not held to
+                start_limit. Can be called multiple times.""",
+    )
+    parser.add_argument(
+        "--dns_ttl",
+        type=float,
+        default=30,
+        help="Time in seconds to reuse the looked up address of server_host for. Default 30.",
+    )
+    parser.add_argument(
+        "--connect_timeout",
+        type=float,
+        default=20,
+        help="Time in seconds to wait for each connection to the server to open. Default 20.",
+    )
+    parser.add_argument(
+        "--connect_retries",
+        type=int,
+        default=0,
+        help="""Times to retry a failed connection to the server, waiting
+                longer each time, like while it is still binding its port.
+                Default 0.""",
+    )
+    parser.add_argument(
+        "--upstream_pool",
+        type=int,
+        default=0,
+        help="""Connections to the server to keep open ahead of clients while
+                it is running or paused, so they are proxied without waiting
+                for one. Default 0.""",
+    )
+    parser.add_argument(
+        "--proxy_engine",
+        choices=ENGINES,
+        default="stream",
+        help="""How proxied connections are forwarded. 'stream' copies with a
+                pair of coroutines per connection, 'protocol' forwards straight
+                between paired transports without them. Default stream.""",
+    )
+    parser.add_argument(
+        "--splice",
+        action="store_true",
+        help="""Forward proxied bytes inside the kernel with splice(), instead
+                of copying them through Python. Only available on Linux with
+                Python 3.10 or later, and only with the stream engine; falls
+                back to normal copying otherwise.""",
+    )
+    parser.add_argument(
+        "--buffer_min",
+        type=int,
+        default=2048,
+        help="Smallest read size in bytes when proxying. Default 2048.",
+    )
+    parser.add_argument(
+        "--buffer_max",
+        type=int,
+        default=65536,
+        help="Largest read size in bytes when proxying. Reads grow towards this while they keep filling the buffer. Default 65536.",
+    )
+    parser.add_argument(
+        "--write_buffer_high",
+        type=int,
+        help="High-water mark in bytes of each connection's write buffer. Writes are only waited on above this. Default 65536.",
+    )
+    parser.add_argument(
+        "--write_buffer_low",
+        type=int,
+        help="Low-water mark in bytes of each connection's write buffer. Default a quarter of write_buffer_high.",
+    )
+    parser.add_argument(
+        "--prewarm_history",
+        type=str,
+        help="""File to keep a history of when clients connect in. Enables
+                starting or unpausing the server ahead of hours of the week
+                that clients usually come in, and keeping it up longer in
+                them.""",
+    )
+    parser.add_argument(
+        "--prewarm_threshold",
+        type=float,
+        default=.5,
+        help="Share of past weeks with clients in an hour for it to count as busy. Default 0.5.",
+    )
+    parser.add_argument(
+        "--prewarm_lead",
+        type=int,
+        default=600,
+        help="Time in seconds before a busy hour to bring the server up. Default 600.",
+    )
+    parser.add_argument(
+        "--prewarm_idle_shutdown",
+        type=int,
+        default=900,
+        help="Time in seconds after last client disconnects to shutdown the server in a busy hour. Default 900.",
+    )
+    parser.add_argument(
+        "--prewarm_dry_run",
+        action="store_true",
+        help="Only log what pre-warming would do, and how well its predictions hit.",
+    )
+    parser.add_argument(
+        "--memory_reclaim",
+        choices=RECLAIM_POLICIES,
+        default="off",
+        help="""How to push out the memory of a paused server, through its
+                cgroup v2. 'reclaim' asks the kernel to reclaim it once,
+                'high' lowers memory.high until unpaused. Either makes
+                unpausing slower. Needs the cgroup pause method for plugin
+                processes, with the memory controller delegated to
+                zeroscale's cgroup. Default off.""",
+    )
+    parser.add_argument(
+        "--memory_keep",
+        type=int,
+        default=0,
+        help="Bytes of memory to leave a paused server with memory_reclaim. Default 0.",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        help="""Directory to save checkpoints in, with the checkpoint method.
+                Defaults to the temporary directory, or Docker's own one for
+                containers.""",
+    )
+    parser.add_argument(
+        "--event_loop",
+        choices=EVENT_LOOPS,
+        default="auto",
+        help="Event loop to run on. 'auto' uses uvloop if it is installed, otherwise asyncio. Default auto.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="""Number of worker processes to fork, which all listen on the
+                same port with SO_REUSEPORT and proxy clients in parallel. This
+                process then only manages the server. Default 0, which proxies
+                in this process. Linux only.""",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="""Port to serve metrics on, in the Prometheus text format at
+                /metrics. Disabled by default.""",
+    )
     parser.add_argument(
         "--info",
         "-i",
@@ -86,3 +347,69 @@ def add_common_options(parser):
     )
 
     return parser
+
+
+def set_fake_status(server, args):
+    """Customize the fake status of a plugin server with the options above"""
+
+    if not (args.fake_motd or args.fake_favicon or args.fake_player):
+        return
+
+    if hasattr(server, "set_fake_status"):
+        server.set_fake_status(args.fake_motd, args.fake_favicon, args.fake_player)
+    else:
+        logger.warning("Plugin '%s' has no fake status to customize", args.plugin)
+
+
+# Options that zeroscale_options() turns into ZeroScale() arguments, which can
+# all be changed while it runs. The method is not one of them, as the server
+# would be left paused or stopped in a way the new one does not undo
+RELOADABLE_OPTIONS = (
+    "listen_port", "server_host", "server_port", "idle_shutdown", "shutdown_timeout", "ignore_bad_clients", "validate_all",
+    "proxy_engine", "splice", "buffer_min", "buffer_max", "write_buffer_high",
+    "write_buffer_low", "prewarm_history", "prewarm_threshold", "prewarm_lead",
+    "prewarm_idle_shutdown", "prewarm_dry_run", "hold_clients", "hold_timeout",
+    "dns_ttl", "connect_timeout", "connect_retries", "upstream_pool",
+    "rate_limit", "rate_burst", "max_connections", "start_limit",
+    "trusted_network",
+)
+
+
+def zeroscale_options(args):
+    """Keyword arguments for ZeroScale() from the options added above"""
+
+    return dict(
+        listen_port=args.listen_port,
+        server_host=args.server_host,
+        server_port=args.server_port or args.listen_port,
+        method_pause=not args.method_stop and args.method != "stop",
+        method_checkpoint=not args.method_stop and args.method == "checkpoint",
+        server_idle_shutdown=args.idle_shutdown,
+        server_shutdown_timeout=args.shutdown_timeout,
+        ignore_bad_clients=args.ignore_bad_clients,
+        validate_all=args.validate_all,
+        proxy_engine=args.proxy_engine,
+        splice=args.splice,
+        buffer_min=args.buffer_min,
+        buffer_max=args.buffer_max,
+        write_buffer_high=args.write_buffer_high,
+        write_buffer_low=args.write_buffer_low,
+        prewarm_history=args.prewarm_history,
+        prewarm_threshold=args.prewarm_threshold,
+        prewarm_lead=args.prewarm_lead,
+        prewarm_idle_shutdown=args.prewarm_idle_shutdown,
+        prewarm_dry_run=args.prewarm_dry_run,
+        hold_clients=args.hold_clients,
+        hold_timeout=args.hold_timeout,
+        dns_ttl=args.dns_ttl,
+        connect_timeout=args.connect_timeout,
+        connect_retries=args.connect_retries,
+        upstream_pool=args.upstream_pool,
+        limits=ClientLimits(
+            rate=args.rate_limit,
+            burst=args.rate_burst,
+            max_connections=args.max_connections,
+            start_rate=args.start_limit,
+            trusted_networks=args.trusted_network,
+        ),
+    )
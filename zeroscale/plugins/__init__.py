@@ -0,0 +1,59 @@
+import logging
+import pkgutil
+from importlib import import_module
+
+# Entry point group that other packages register their plugins in, each one
+# naming a module with a Server class, like the plugins in this package
+ENTRY_POINT_GROUP = "zeroscale.plugins"
+
+logger = logging.getLogger(__name__)
+
+
+def _entry_points():
+    # Only looked up when a plugin is not found here, as it is slow to import
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+
+    try:
+        return entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Before Python 3.10, every group comes back in a dict
+        return entry_points().get(ENTRY_POINT_GROUP, [])
+
+
+def builtin_plugins():
+    """Names of the plugins in this package, without importing them"""
+
+    return sorted(module.name for module in pkgutil.iter_modules(__path__))
+
+
+def available_plugins():
+    """Map the name of every plugin to where it comes from
+
+    Plugins in this package come first, and hide any installed plugin of the
+    same name."""
+
+    plugins = {}
+    for entry_point in _entry_points():
+        plugins[entry_point.name] = entry_point.value
+    for name in builtin_plugins():
+        plugins[name] = __name__ + "." + name
+    return dict(sorted(plugins.items()))
+
+
+def load_plugin(name: str):
+    """Import a plugin module by name, from this package or an entry point
+
+    Raises ImportError if there is no plugin of that name."""
+
+    if name in builtin_plugins():
+        return import_module("." + name, package=__name__)
+
+    for entry_point in _entry_points():
+        if entry_point.name == name:
+            logger.debug("Loading plugin '%s' from %s", name, entry_point.value)
+            return entry_point.load()
+
+    raise ImportError("No plugin named '%s'" % name)
@@ -1,14 +1,27 @@
 import asyncio
 import logging
+import os
+import subprocess
+import time
 from signal import Signals
 
+from zeroscale.cgroup import Cgroup, MemoryReclaimer
+from zeroscale.checkpoint import CheckpointError, CheckpointStats, CriuImage, RestoredProcess
+from zeroscale.lifecycle import transition
 from zeroscale.status import Status
 from zeroscale.base_server import BaseServer
 
+PAUSE_METHODS = ("signal", "cgroup")
+
 logger = logging.getLogger(__name__)
 
 
 class Server(BaseServer):
+    logger = logger
+    # If checkpoints of the process can be restored, which they can not
+    # with pipes to zeroscale
+    checkpoint_supported = True
+
     def __init__(self, *server_args):
         if not server_args:
             raise ValueError("Need a server command to run")
@@ -22,6 +35,25 @@ class Server(BaseServer):
         self.stop_signal = Signals.SIGINT
         self.pause_signal = Signals.SIGTSTP
         self.unpause_signal = Signals.SIGCONT
+        self.pause_method = "signal"
+        self.cgroup = None
+        # How the process was paused, to undo the same way
+        self.paused_by = None
+        self.reclaimer = None
+        self.checkpoint_dir = None
+        # The CRIU image of the process while it is checkpointed
+        self.image = None
+        self.checkpoint_stats = CheckpointStats()
+
+    def set_server_args(self, *server_args):
+        """Change the command run by the next start, leaving a running
+            process be"""
+
+        if not server_args:
+            raise ValueError("Need a server command to run")
+
+        self.server_command = server_args
+        self.name = server_args[0]
 
     def set_working_directory(self, working_directory: str):
         self.working_directory = working_directory
@@ -35,50 +67,217 @@ class Server(BaseServer):
     def set_unpause_signal(self, signal: Signals):
         self.unpause_signal = signal
 
+    def set_pause_method(self, pause_method: str):
+        self.pause_method = pause_method
+
+    def set_memory_reclaim(self, policy: str, keep: int = 0):
+        """Reclaim memory of the paused process, which needs the cgroup pause method"""
+
+        if self.pause_method != "cgroup":
+            self.logger.warning("Memory can only be reclaimed with the cgroup pause method")
+            return
+        self.reclaimer = MemoryReclaimer(policy, keep)
+
+    def set_checkpoint_dir(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+
+    async def spawn(self, **kwargs):
+        """Start the server process
+
+        With the cgroup pause method, it is started in a cgroup and process
+        group of its own, so the whole tree can be paused."""
+
+        if self.pause_method != "cgroup":
+            return await asyncio.create_subprocess_exec(
+                *self.server_command, cwd=self.working_directory, **kwargs
+            )
+
+        try:
+            self.cgroup = Cgroup.create(memory=self.reclaimer is not None)
+        except OSError as e:
+            self.logger.warning("Could not create a cgroup, pausing with signals to the process group: %s", e)
+            self.cgroup = None
+
+        try:
+            return await asyncio.create_subprocess_exec(
+                *self.server_command, cwd=self.working_directory,
+                start_new_session=True,
+                preexec_fn=self.cgroup.join if self.cgroup else None,
+                **kwargs
+            )
+        except subprocess.SubprocessError as e:
+            self.logger.warning("Could not join the cgroup, pausing with signals to the process group: %s", e)
+            self.cgroup.remove()
+            self.cgroup = None
+            return await asyncio.create_subprocess_exec(
+                *self.server_command, cwd=self.working_directory,
+                start_new_session=True, **kwargs
+            )
+
+    async def pause_process(self):
+        """Pause the process with the configured method"""
+
+        if self.pause_method == "signal":
+            self.proc.send_signal(self.pause_signal)
+            self.paused_by = "signal"
+            return
+
+        if self.cgroup:
+            try:
+                seconds = await self.cgroup.freeze()
+                self.logger.info("Froze %s server in %.1f ms", self.name, seconds * 1000)
+                self.paused_by = "cgroup"
+            except (OSError, TimeoutError) as e:
+                self.logger.warning("Could not freeze cgroup, signalling the process group: %s", e)
+                try:
+                    await self.cgroup.thaw()
+                except (OSError, TimeoutError) as e:
+                    self.logger.warning("Could not thaw cgroup after failing to freeze it: %s", e)
+
+        if self.paused_by != "cgroup":
+            os.killpg(self.proc.pid, self.pause_signal)
+            self.paused_by = "group"
+
+        if self.reclaimer and self.cgroup:
+            self.reclaimed_bytes += await self.reclaimer.reclaim(self.cgroup, self.logger)
+
+    async def unpause_process(self):
+        """Unpause the process the same way it was paused"""
+
+        if self.reclaimer and self.cgroup:
+            self.reclaimer.restore(self.cgroup, self.logger)
+
+        if self.paused_by == "cgroup":
+            seconds = await self.cgroup.thaw()
+            self.logger.info("Thawed %s server in %.1f ms", self.name, seconds * 1000)
+        elif self.paused_by == "group":
+            os.killpg(self.proc.pid, self.unpause_signal)
+        else:
+            self.proc.send_signal(self.unpause_signal)
+        self.paused_by = None
+
+        if self.reclaimer and self.cgroup:
+            self.measure_refaults(self.reclaimer, self.cgroup)
+
+    async def restore(self) -> bool:
+        """Restore the checkpointed process, or leave the server stopped if it fails"""
+
+        image, self.image = self.image, None
+        start = time.monotonic()
+
+        try:
+            self.proc = RestoredProcess(await image.restore())
+        except (CheckpointError, OSError, ValueError) as e:
+            self.checkpoint_stats.log_restore_failure(self.logger, e)
+            self.proc = None
+            self.status = Status.stopped
+            return False
+
+        self.checkpoint_stats.log_restore(self.logger, time.monotonic() - start)
+        return True
+
+    async def remove_cgroup(self):
+        """Kill anything left in the cgroup once the server exited, and remove it"""
+
+        if not self.cgroup:
+            return
+
+        self.cgroup.kill()
+        try:
+            await self.cgroup.wait_empty()
+        except (OSError, TimeoutError):
+            self.logger.warning("Processes left in cgroup %s", self.cgroup.path)
+        self.cgroup.remove()
+        self.cgroup = None
+
+    @transition()
     async def start(self):
         if self.status is not Status.stopped:
             return
 
-        logger.info("Starting %s server", self.name)
+        self.logger.info("Starting %s server", self.name)
         self.status = Status.starting
 
-        self.proc = await asyncio.create_subprocess_exec(
-            *self.server_command, cwd=self.working_directory
-        )
+        self.proc = await self.spawn()
 
-        logger.info("%s server online", self.name)
+        self.logger.info("%s server online", self.name)
         self.status = Status.running
 
+    @transition()
     async def stop(self):
         if self.status is not Status.running:
             return
 
-        logger.info("Stopping %s server", self.name)
+        self.logger.info("Stopping %s server", self.name)
         self.status = Status.stopping
 
         self.proc.send_signal(self.stop_signal)
         await self.proc.wait()
+        await self.remove_cgroup()
 
-        logger.info("%s server offline", self.name)
+        self.logger.info("%s server offline", self.name)
         self.status = Status.stopped
 
+    @transition()
     async def pause(self):
         if self.status is not Status.running:
             return
 
-        logger.info("Pausing %s server", self.name)
+        self.logger.info("Pausing %s server", self.name)
         self.status = Status.paused
-        self.proc.send_signal(self.pause_signal)
+        await self.pause_process()
 
+    @transition()
     async def unpause(self):
         if self.status is not Status.paused:
             return
 
-        logger.info("Unpausing %s server", self.name)
+        if self.image:
+            self.logger.info("Restoring %s server", self.name)
+            if not await self.restore():
+                return
+        else:
+            self.logger.info("Unpausing %s server", self.name)
+            await self.unpause_process()
         self.status = Status.running
-        self.proc.send_signal(self.unpause_signal)
+
+    @transition()
+    async def checkpoint(self):
+        """Checkpoint the process with CRIU, or pause it if that fails"""
+
+        if self.status is not Status.running:
+            return
+
+        self.logger.info("Checkpointing %s server", self.name)
+        self.status = Status.paused
+
+        if self.proc.stdin or self.proc.stdout:
+            self.logger.warning("%s server has pipes to zeroscale, which CRIU cannot restore, pausing instead",
+                    self.name)
+            await self.pause_process()
+            return
+
+        image = CriuImage(self.checkpoint_dir)
+        start = time.monotonic()
+        try:
+            size = await image.dump(self.proc.pid)
+        except CheckpointError as e:
+            self.checkpoint_stats.log_checkpoint_failure(self.logger, e)
+            await self.pause_process()
+            return
+
+        self.checkpoint_stats.log_checkpoint(self.logger, time.monotonic() - start, size)
+        await self.proc.wait()
+        await self.remove_cgroup()
+        self.image = image
 
     def close(self):
+        self.cancel_refaults()
+        if self.image:
+            self.image.remove()
+        if self.cgroup:
+            # Everything the server started, not just the process itself
+            self.cgroup.kill()
         if self.proc:
             try:
                 self.proc.kill()
@@ -1,137 +1,233 @@
 import asyncio
+import base64
 import json
 import logging
 import re
 
+from zeroscale.codec import (
+    PacketReader, decode_string, decode_varint, encode_packet, encode_string, encode_varint)
+from zeroscale.drainer import OutputDrainer
+from zeroscale.lifecycle import transition
 from zeroscale.status import Status
 from .generic import Server as GenericServer
 
 ENCODING = "utf-8"
+DEFAULT_COMMAND = ("java", "-jar", "server.jar", "nogui")
 READY_PATTERN = re.compile(
-    "\\[Server thread/INFO\\].*: Done \\([0-9.]*s\\)", re.IGNORECASE
+    rb"\[Server thread/INFO\].*: Done \([0-9.]*s\)", re.IGNORECASE
 )
 
+# Seconds between status queries of the running server
+STATUS_QUERY_INTERVAL = 30
+# Seconds to wait for each packet from a client
+PACKET_TIMEOUT = 5
+# Longest packets read, well over the longest handshake and status response
+MAX_HANDSHAKE = 1024
+MAX_STATUS = 1 << 20
+
+# Packet IDs, see https://wiki.vg/Protocol
+HANDSHAKE = 0x00
+STATUS_REQUEST = 0x00
+STATUS_RESPONSE = 0x00
+PING = 0x01
+# Next states a handshake asks for
+STATE_STATUS = 1
+STATE_LOGIN = 2
+
+FAKE_MOTD = "Server starting up..."
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Players in a status sample need an ID, but these are not real players
+NO_UUID = "00000000-0000-0000-0000-000000000000"
+
 logger = logging.getLogger(__name__)
 
 
+def parse_handshake(payload: bytes):
+    """Split a handshake payload into protocol version, address, port and
+        next state"""
+
+    protocol, offset = decode_varint(payload)
+    address, offset = decode_string(payload, offset)
+    if offset + 2 > len(payload):
+        raise IndexError("Handshake cut short")
+    port = int.from_bytes(payload[offset:offset + 2], byteorder="big")
+    next_state, _ = decode_varint(payload, offset + 2)
+    return protocol, address, port, next_state
+
+
 class Server(GenericServer):
-    """Minecraft server wrapper"""
+    """Minecraft server wrapper
+
+    Status pings are answered with the last status of the real server, so
+    only players logging in wake it."""
+    logger = logger
+    status_query_interval = STATUS_QUERY_INTERVAL
+    # Stopped through the console on stdin
+    checkpoint_supported = False
+
     def __init__(self, *server_args):
         super().__init__(server_args)
 
-        if not server_args:
-            self.server_command = ("java", "-jar", "server.jar", "nogui")
-        else:
-            self.server_command = server_args
-
+        self.set_server_args(*server_args)
         self.name = "Minecraft"
 
         self.fake_status_bytes = self._compile_fake_status_bytes()
-        self.startup_task = None
+        self.drainer = None
+        # The last status response packet of the real server, as it sent it
+        self.status_response = None
+
+    def set_server_args(self, *server_args):
+        """Change the command run by the next start"""
 
+        self.server_command = server_args or DEFAULT_COMMAND
+
+    @transition()
     async def start(self):
         """Start the Minecraft server"""
 
         if self.status is not Status.stopped:
             return
 
-        logger.info("Starting Minecraft server")
+        self.logger.info("Starting Minecraft server")
         self.status = Status.starting
 
-        self.proc = await asyncio.create_subprocess_exec(
-            *self.server_command,
+        self.proc = await self.spawn(
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
-            cwd=self.working_directory,
         )
 
-        self.startup_task = asyncio.ensure_future(self.await_server_ready())
-        await self.startup_task
-
-    async def await_server_ready(self):
-        """Wait for the Minecraft server to be ready to accept connections"""
+        # Read for as long as it runs, so it never blocks writing output
+        self.drainer = OutputDrainer(self.proc.stdout, READY_PATTERN)
 
-        while not self.proc.stdout.at_eof():
-            line = await self.proc.stdout.readline()
-            if READY_PATTERN.search(line.decode(ENCODING)):
-                logger.info("Minecraft server online")
-                self.status = Status.running
-                return
+        # Shielded, so a stop cancelling this start leaves the drainer be
+        if await asyncio.shield(self.drainer.ready):
+            self.logger.info("Minecraft server online")
+            self.status = Status.running
+        else:
+            self.logger.error("Minecraft server exited before it was ready, last output:\n%s",
+                    "\n".join(self.drainer.tail(ENCODING)))
+            self.status = Status.stopped
 
+    @transition("start")
     async def stop(self):
         """Stop the Minecraft server"""
 
         # Stop if running or still starting up
-        if self.status is Status.starting:
-            # If we communicate() with the server before it is running,
-            # The readline() from the start watcher will conflict
-            # Do we need to check if the cancel is done?
-            self.startup_task.cancel()
-        elif self.status is not Status.running:
+        if self.status not in (Status.starting, Status.running):
             return
 
-        logger.info("Stopping Minecraft server")
+        self.logger.info("Stopping Minecraft server")
         self.status = Status.stopping
         self.proc.stdin.write("/stop\n".encode(ENCODING))
 
-        # Wait for shutdown
-        # This needs to be communicate() and not wait() to avoid
-        # blocking on filled stdout pipe
-        # If the server runs long enough, can it actually fill the pipe
-        # enough to block?
-        await self.proc.communicate()
-        logger.info("Minecraft server offline")
+        # The drainer keeps reading output, so this can not block on a full pipe
+        await self.proc.wait()
+        await self.drainer.wait_closed()
+        await self.remove_cgroup()
+        self.logger.info("Minecraft server offline")
         self.status = Status.stopped
 
     async def is_valid_connection(self, client_reader):
-        """Check the packet to see if the client is valid
+        """Check that the client sends a handshake for the status or login
             See https://wiki.vg/Server_List_Ping
             Only compatable with 1.7 and later"""
 
-        num_bytes = await asyncio.wait_for(client_reader.read(1), timeout=5)
+        try:
+            packet_id, payload = await asyncio.wait_for(
+                PacketReader(client_reader).read_packet(MAX_HANDSHAKE), timeout=PACKET_TIMEOUT)
+            return packet_id == HANDSHAKE \
+                and parse_handshake(payload)[3] in (STATE_STATUS, STATE_LOGIN)
+        except (ValueError, IndexError):
+            return False
+
+    async def query_status(self, server_reader, server_writer):
+        """Ask the real server for its status, like a client would"""
 
-        # Number of bytes doesn't include the byte count itself
-        # Assume that the client will send us less than 128 bytes
-        num_bytes = min(int.from_bytes(num_bytes, byteorder="big"), 127)
+        host, port = server_writer.get_extra_info("peername")[:2]
+        server_writer.write(encode_packet(HANDSHAKE,
+            encode_varint(-1) + encode_string(host)
+            + port.to_bytes(2, byteorder="big") + encode_varint(STATE_STATUS)))
+        server_writer.write(encode_packet(STATUS_REQUEST))
 
-        payload = await asyncio.wait_for(client_reader.read(num_bytes), timeout=5)
+        packet_id, payload = await PacketReader(server_reader).read_packet(MAX_STATUS)
+        if packet_id != STATUS_RESPONSE:
+            raise ValueError("Unexpected packet %#x instead of the status" % packet_id)
 
-        # Check if packet type is ping
-        if len(payload) == 0 or payload[0] != 0x00:
+        self.status_response = encode_packet(STATUS_RESPONSE, payload)
+        self.logger.debug("Cached server status of %i bytes", len(self.status_response))
+
+    async def answer_client(self, client_reader, client_writer) -> bool:
+        """Answer status pings with the last status of the real server, if
+            there is one, and their pings with pongs"""
+
+        if self.status_response is None:
             return False
 
-        # The last byte should be status enum
-        return payload[-1] == 0x01
+        packets = PacketReader(client_reader)
+        try:
+            packet_id, payload = await asyncio.wait_for(
+                packets.read_packet(MAX_HANDSHAKE), timeout=PACKET_TIMEOUT)
+            if packet_id != HANDSHAKE or parse_handshake(payload)[3] != STATE_STATUS:
+                return False
+        except (ValueError, IndexError):
+            return False
+
+        while True:
+            try:
+                packet_id, payload = await asyncio.wait_for(
+                    packets.read_packet(MAX_HANDSHAKE), timeout=PACKET_TIMEOUT)
+            except (ValueError, asyncio.IncompleteReadError):
+                # Done, or not speaking the protocol any more
+                return True
+
+            if packet_id == STATUS_REQUEST:
+                client_writer.write(self.status_response)
+            elif packet_id == PING:
+                # Sent straight back, for the client to time the round trip
+                client_writer.write(encode_packet(PING, payload))
+                return True
+            else:
+                return True
 
     def fake_status(self) -> bytes:
         """Return the JSON data with the starting up message"""
 
         return self.fake_status_bytes
 
+    def set_fake_status(self, motd: str = None, favicon: str = None, players=()):
+        """Customize the status shown while the server starts up
+
+        favicon is the path of a 64x64 PNG image, and players are names to
+        list in the player sample."""
+
+        favicon_data = None
+        if favicon:
+            with open(favicon, "rb") as favicon_file:
+                favicon_data = favicon_file.read()
+            if not favicon_data.startswith(PNG_SIGNATURE):
+                raise ValueError("Favicon %s is not a PNG image" % favicon)
+
+        self.fake_status_bytes = self._compile_fake_status_bytes(
+            motd or FAKE_MOTD, favicon_data, players)
+
     @staticmethod
-    def _compile_fake_status_bytes() -> bytes:
+    def _compile_fake_status_bytes(motd: str = FAKE_MOTD, favicon: bytes = None,
+            players=()) -> bytes:
         """Build the JSON data to send to a client to show it's starting up
             See https://wiki.vg/Server_List_Ping
             Only compatable with 1.7 and later"""
 
-        json_data = json.dumps(
-            {
-                "description": {"text": "Server starting up..."},
-                "players": {"max": 0, "online": 0},
-                "version": {"name": "loading", "protocol": 0},
-            },
-            separators=(",", ":"),
-        ).encode(ENCODING)
-
-        data = bytearray()
-        # Total packet length
-        # Does not work if above 0x7f, the last bit is used for showing if
-        # there are following bytes
-        data.extend((len(json_data) + 2).to_bytes(1, byteorder="big"))
-        # Ping enum
-        data.extend(b"\x00")
-        # Payload length
-        data.extend(len(json_data).to_bytes(1, byteorder="big"))
-        data.extend(json_data)
-
-        return data
+        status = {
+            "description": {"text": motd},
+            "players": {"max": 0, "online": 0},
+            "version": {"name": "loading", "protocol": 0},
+        }
+        if players:
+            status["players"]["sample"] = [
+                {"name": name, "id": NO_UUID} for name in players
+            ]
+        if favicon:
+            status["favicon"] = "data:image/png;base64," + base64.b64encode(favicon).decode("ascii")
+
+        return encode_packet(STATUS_RESPONSE,
+                encode_string(json.dumps(status, separators=(",", ":"))))
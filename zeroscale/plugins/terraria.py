@@ -2,15 +2,18 @@ import asyncio
 import logging
 import re
 
+from zeroscale.drainer import OutputDrainer
+from zeroscale.lifecycle import transition
 from zeroscale.status import Status
 from .generic import Server as GenericServer
 
 ENCODING = "utf-8"
+DEFAULT_COMMAND = ("TerrariaServer.bin.x86_64",)
 CONNECT_PATTERN = re.compile(
     "Terraria", re.IGNORECASE
 )
 READY_PATTERN = re.compile(
-    "Server started", re.IGNORECASE
+    rb"^Server started", re.IGNORECASE
 )
 
 logger = logging.getLogger(__name__)
@@ -18,71 +21,68 @@ logger = logging.getLogger(__name__)
 
 class Server(GenericServer):
     """Terraria server wrapper"""
+    logger = logger
+    # Stopped through the console on stdin
+    checkpoint_supported = False
+
     def __init__(self, *server_args):
         super().__init__(server_args)
 
-        if not server_args:
-            self.server_command = ("TerrariaServer.bin.x86_64")
-        else:
-            self.server_command = server_args
-
+        self.set_server_args(*server_args)
         self.name = "Terraria"
 
         self.fake_status_bytes = self._compile_fake_status_bytes()
-        self.startup_task = None
+        self.drainer = None
+
+    def set_server_args(self, *server_args):
+        """Change the command run by the next start"""
 
+        self.server_command = server_args or DEFAULT_COMMAND
+
+    @transition()
     async def start(self):
         """Start the Terraria server"""
 
         if self.status is not Status.stopped:
             return
 
-        logger.info("Starting Terraria server")
+        self.logger.info("Starting Terraria server")
         self.status = Status.starting
 
-        self.proc = await asyncio.create_subprocess_exec(
-            *self.server_command,
+        self.proc = await self.spawn(
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
-            cwd=self.working_directory,
         )
 
-        self.startup_task = asyncio.ensure_future(self.await_server_ready())
-        await self.startup_task
-
-    async def await_server_ready(self):
-        """Wait for the Terraria server to be ready to accept connections"""
+        # Read for as long as it runs, so it never blocks writing output
+        self.drainer = OutputDrainer(self.proc.stdout, READY_PATTERN)
 
-        while not self.proc.stdout.at_eof():
-            line = await self.proc.stdout.readline()
-            if READY_PATTERN.match(line.decode(ENCODING)):
-                logger.info("Terraria server online")
-                self.status = Status.running
-                return
+        # Shielded, so a stop cancelling this start leaves the drainer be
+        if await asyncio.shield(self.drainer.ready):
+            self.logger.info("Terraria server online")
+            self.status = Status.running
+        else:
+            self.logger.error("Terraria server exited before it was ready, last output:\n%s",
+                    "\n".join(self.drainer.tail(ENCODING)))
+            self.status = Status.stopped
 
+    @transition("start")
     async def stop(self):
         """Stop the Terraria server"""
 
         # Stop if running or still starting up
-        if self.status is Status.starting:
-            # If we communicate() with the server before it is running,
-            # The readline() from the start watcher will conflict
-            # Do we need to check if the cancel is done?
-            self.startup_task.cancel()
-        elif self.status is not Status.running:
+        if self.status not in (Status.starting, Status.running):
             return
 
-        logger.info("Stopping Terraria server")
+        self.logger.info("Stopping Terraria server")
         self.status = Status.stopping
         self.proc.stdin.write("exit\n".encode(ENCODING))
 
-        # Wait for shutdown
-        # This needs to be communicate() and not wait() to avoid
-        # blocking on filled stdout pipe
-        # If the server runs long enough, can it actually fill the pipe
-        # enough to block?
-        await self.proc.communicate()
-        logger.info("Terraria server offline")
+        # The drainer keeps reading output, so this can not block on a full pipe
+        await self.proc.wait()
+        await self.drainer.wait_closed()
+        await self.remove_cgroup()
+        self.logger.info("Terraria server offline")
         self.status = Status.stopped
 
     async def is_valid_connection(self, client_reader):
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+from .status import Status
+
+HOUR = 3600
+HOURS_PER_WEEK = 7 * 24
+
+# Seconds between checks of whether to pre-warm the server
+CHECK_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def hour_of_week(hour: int) -> int:
+    """Bucket of an hour since the epoch, 0 being Monday midnight local time"""
+
+    local = time.localtime(hour * HOUR)
+    return local.tm_wday * 24 + local.tm_hour
+
+
+def local_week(hour: int) -> int:
+    """Week of an hour since the epoch, each starting Monday midnight local
+        time like hour_of_week()"""
+
+    local = time.localtime(hour * HOUR)
+    days = (hour * HOUR + local.tm_gmtoff) // (24 * HOUR)
+    # The epoch was a Thursday
+    return (days + 3) // 7
+
+
+class ArrivalHistory:
+    """Hours in which clients arrived, kept for a number of weeks in a file
+
+    Only whether any client arrived in an hour is kept, which is all that is
+    needed to learn how likely an arrival is in each hour of the week."""
+
+    def __init__(self, path: str, weeks: int = 8):
+        self.path = path
+        self.weeks = weeks
+        self.hours = set()
+        self.dirty = False
+
+        # Only imported with a history to keep, to start up faster without one
+        import json
+        try:
+            with open(path) as history_file:
+                self.hours = set(json.load(history_file)["hours"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring unreadable arrival history %s", path)
+
+    def record(self, now: float = None):
+        if now is None:
+            now = time.time()
+        hour = int(now // HOUR)
+        if hour not in self.hours:
+            self.hours.add(hour)
+            self.dirty = True
+
+    def prune(self, now: float = None):
+        if now is None:
+            now = time.time()
+        oldest = int(now // HOUR) - self.weeks * HOURS_PER_WEEK
+        self.hours = {hour for hour in self.hours if hour > oldest}
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        import json
+
+        self.prune()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as history_file:
+            json.dump({"hours": sorted(self.hours)}, history_file)
+        os.replace(temporary, self.path)
+        self.dirty = False
+
+    def probabilities(self, now: float = None, exclude_week: int = None):
+        """Chance of at least one arrival in each hour of the week, from the
+            share of the weeks so far that had one
+
+        exclude_week is a local_week() to leave out."""
+
+        if now is None:
+            now = time.time()
+        now_hour = int(now // HOUR)
+        hours = [
+            hour for hour in self.hours
+            if exclude_week is None or local_week(hour) != exclude_week
+        ]
+
+        counts = [0] * HOURS_PER_WEEK
+        if not hours:
+            return counts
+
+        for hour in hours:
+            counts[hour_of_week(hour)] += 1
+
+        weeks = math.ceil((now_hour - min(hours) + 1) / HOURS_PER_WEEK)
+        weeks = max(1, min(self.weeks, weeks) - (exclude_week is not None))
+
+        return [min(1, count / weeks) for count in counts]
+
+    def backtest(self, threshold: float, now: float = None):
+        """Predict every past week from all the other weeks, returning the
+            number of (hits, false alarms, misses) by hour"""
+
+        hits = false_alarms = misses = 0
+        if now is None:
+            now = time.time()
+        now_hour = int(now // HOUR)
+        if not self.hours:
+            return hits, false_alarms, misses
+
+        weeks = {local_week(hour) for hour in self.hours}
+        predictions = {}
+
+        # From a week before the first arrival, to cover all of its week
+        for hour in range(min(self.hours) - HOURS_PER_WEEK, now_hour + 1):
+            week = local_week(hour)
+            if week not in weeks:
+                continue
+            if week not in predictions:
+                predictions[week] = self.probabilities(now, exclude_week=week)
+
+            busy = predictions[week][hour_of_week(hour)] >= threshold
+            arrived = hour in self.hours
+            if busy and arrived:
+                hits += 1
+            elif busy:
+                false_alarms += 1
+            elif arrived:
+                misses += 1
+
+        return hits, false_alarms, misses
+
+
+def report(name: str, hits: int, false_alarms: int, misses: int):
+    predicted = hits + false_alarms
+    arrived = hits + misses
+    logger.info("%s: %i of %i predicted busy hours had clients (%.0f%%), "
+            "covering %i of %i hours with clients (%.0f%%)", name,
+            hits, predicted, 100 * hits / predicted if predicted else 0,
+            hits, arrived, 100 * hits / arrived if arrived else 0)
+
+
+class Prewarmer:
+    """Starts or unpauses a server ahead of predicted demand, and keeps it up
+        longer in hours that are likely to be busy"""
+
+    def __init__(self,
+            zeroscale,
+            history_path: str,
+            threshold: float = .5,
+            lead: int = 600,
+            busy_idle_shutdown: int = 900,
+            dry_run: bool = False,
+        ):
+        self.zeroscale = zeroscale
+        self.history = ArrivalHistory(history_path)
+        self.threshold = threshold
+        self.lead = lead
+        self.busy_idle_shutdown = busy_idle_shutdown
+        self.dry_run = dry_run
+
+        self.task = None
+        # Running prediction results, counted by hour
+        self.results = [0, 0, 0]
+        self.hour = None
+        self.predicted_busy = False
+        self.prewarmed_hour = None
+
+    def arrival(self):
+        self.history.record()
+
+    def likely_busy(self, now: float = None) -> bool:
+        """If clients are likely now, or within the lead time"""
+
+        if now is None:
+            now = time.time()
+        probabilities = self.history.probabilities(now)
+
+        return max(
+            probabilities[hour_of_week(int(now // HOUR))],
+            probabilities[hour_of_week(int((now + self.lead) // HOUR))],
+        ) >= self.threshold
+
+    def idle_shutdown(self, default: int) -> int:
+        """Idle timeout to use for stopping the server now"""
+
+        if not self.likely_busy():
+            return default
+
+        if self.dry_run:
+            logger.info("Would keep the server up for %i seconds in a busy hour",
+                    self.busy_idle_shutdown)
+            return default
+
+        return max(default, self.busy_idle_shutdown)
+
+    def start(self):
+        if self.dry_run:
+            report("Backtest", *self.history.backtest(self.threshold))
+        self.task = asyncio.ensure_future(self.run())
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+        self.history.save()
+
+    def score_hour(self, now: float):
+        """Count how the prediction for the hour that just ended turned out"""
+
+        hour = int(now // HOUR)
+        if hour == self.hour:
+            return
+
+        if self.hour is not None:
+            arrived = self.hour in self.history.hours
+            if self.predicted_busy and arrived:
+                self.results[0] += 1
+            elif self.predicted_busy:
+                self.results[1] += 1
+            elif arrived:
+                self.results[2] += 1
+            if self.dry_run:
+                report("Predictions", *self.results)
+
+        self.hour = hour
+        self.predicted_busy = self.history.probabilities(now)[
+            hour_of_week(hour)] >= self.threshold
+
+    async def run(self):
+        while True:
+            now = time.time()
+            self.score_hour(now)
+            self.history.save()
+
+            if self.likely_busy(now) and self.zeroscale.live_connections <= 0 \
+                    and self.zeroscale.server.status in (Status.stopped, Status.paused) \
+                    and self.prewarmed_hour != self.hour:
+                # Once an hour at most, so it can still be stopped when idle
+                self.prewarmed_hour = self.hour
+                if self.dry_run:
+                    logger.info("Would pre-warm %s server for predicted clients",
+                            self.zeroscale.server.status.name)
+                else:
+                    logger.info("Pre-warming %s server for predicted clients",
+                            self.zeroscale.server.status.name)
+                    await self.zeroscale.prewarm()
+
+            await asyncio.sleep(CHECK_INTERVAL)
@@ -1,27 +1,381 @@
 import asyncio
 import logging
+import os
+import socket
+
+from .upstream import Upstream
 
 logger = logging.getLogger(__name__)
 
+# Bytes moved per splice() call, the default Linux pipe capacity
+SPLICE_SIZE = 65536
+
+ENGINES = ("stream", "protocol")
+
+
+class ProxyStats:
+    """Byte counters for proxied traffic, split by data path and by direction"""
+
+    __slots__ = ("stream_bytes", "splice_bytes", "upstream_bytes", "downstream_bytes")
+
+    def __init__(self):
+        self.stream_bytes = 0
+        self.splice_bytes = 0
+        # From clients to the server, and back
+        self.upstream_bytes = 0
+        self.downstream_bytes = 0
+
+
+async def pipe(reader, writer, stats=None, buffer_min=2048, buffer_max=65536,
+        upstream=True):
+    """Copy from reader to writer, adapting the read size to the traffic
+
+    The read size doubles while reads keep filling it, up to buffer_max, and
+    halves while they come back less than half full, down to buffer_min.
+    Writes are left to coalesce in the transport, and drain() is only awaited
+    once its high-water mark is crossed."""
+
+    read_size = buffer_min
+    transport = writer.transport
+    high_water = transport.get_write_buffer_limits()[1]
 
-async def pipe(reader, writer):
     try:
         while not reader.at_eof():
-            writer.write(await reader.read(2048))
-            await writer.drain()
+            data = await reader.read(read_size)
+            writer.write(data)
+            if stats is not None:
+                stats.stream_bytes += len(data)
+                if upstream:
+                    stats.upstream_bytes += len(data)
+                else:
+                    stats.downstream_bytes += len(data)
+
+            if len(data) >= read_size:
+                read_size = min(read_size * 2, buffer_max)
+            elif len(data) < read_size // 2:
+                read_size = max(read_size // 2, buffer_min)
+
+            if transport.get_write_buffer_size() > high_water:
+                await writer.drain()
     finally:
         writer.close()
 
 
-async def proxy(client_reader, client_writer, server_host, server_port):
+def splice_supported(*writers) -> bool:
+    """Check if os.splice() can be used between the sockets of these streams"""
+
+    if not hasattr(os, "splice"):
+        return False
+
+    for writer in writers:
+        if writer.get_extra_info("socket") is None:
+            return False
+        if writer.get_extra_info("sslcontext") is not None:
+            return False
+
+    return True
+
+
+async def _wait_fd(add, remove, fd):
+    """Wait for a file descriptor to become readable or writable"""
+
+    future = asyncio.get_event_loop().create_future()
+    add(fd, lambda: future.done() or future.set_result(None))
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+def _can_take_buffered(reader) -> bool:
+    """If _take_buffered() works on this reader"""
+
+    return isinstance(getattr(reader, "_buffer", None), bytearray)
+
+
+def _take_buffered(reader) -> bytes:
+    """Pull everything a StreamReader has already buffered, without awaiting
+
+    StreamReader has no public way to do this, as read() waits for more data
+    once the buffer is empty, so this relies on asyncio's own StreamReader
+    keeping it in a bytearray _buffer. Check _can_take_buffered() first, as
+    other readers may not."""
+
+    data = bytes(reader._buffer)
+    reader._buffer.clear()
+    return data
+
+
+class ReplayReader:
+    """Stream reader wrapper that keeps a copy of what is read through it
+
+    At most limit bytes are read through it, after which reads return b"" as
+    if the stream had ended, so the copy can always be replayed whole. Once
+    rewound, the copy is read again before the rest of the stream."""
+
+    def __init__(self, reader, limit: int = 4096):
+        self.reader = reader
+        self.limit = limit
+        self.data = bytearray()
+        self.position = 0
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    def rewind(self):
+        """Read what was already read again, for another look at it"""
+
+        self.position = 0
+
+    def _buffered(self, n: int) -> bytes:
+        end = len(self.data) if n < 0 else self.position + n
+        data = bytes(self.data[self.position:end])
+        self.position += len(data)
+        return data
+
+    async def read(self, n: int = -1) -> bytes:
+        if self.position < len(self.data):
+            return self._buffered(n)
+
+        room = self.limit - len(self.data)
+        if n < 0 or n > room:
+            n = room
+        if n == 0:
+            return b""
+
+        data = await self.reader.read(n)
+        self.data.extend(data)
+        self.position = len(self.data)
+        return data
+
+    async def readexactly(self, n: int) -> bytes:
+        buffered = self._buffered(n)
+        n -= len(buffered)
+        if n == 0:
+            return buffered
+
+        if n > self.limit - len(self.data):
+            raise asyncio.IncompleteReadError(buffered, len(buffered) + n)
+
+        data = await self.reader.readexactly(n)
+        self.data.extend(data)
+        self.position = len(self.data)
+        return buffered + data
+
+
+async def splice_pipe(src, dst, stats, upstream=True):
+    """Move bytes from one socket to another inside the kernel, through a pipe"""
+
+    loop = asyncio.get_event_loop()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    pipe_read, pipe_write = os.pipe()
+
+    try:
+        while True:
+            try:
+                count = os.splice(src.fileno(), pipe_write, SPLICE_SIZE, flags=flags)
+            except BlockingIOError:
+                await _wait_fd(loop.add_reader, loop.remove_reader, src.fileno())
+                continue
+
+            if count == 0:
+                return
+            stats.splice_bytes += count
+            if upstream:
+                stats.upstream_bytes += count
+            else:
+                stats.downstream_bytes += count
+
+            while count:
+                try:
+                    count -= os.splice(pipe_read, dst.fileno(), count, flags=flags)
+                except BlockingIOError:
+                    await _wait_fd(loop.add_writer, loop.remove_writer, dst.fileno())
+    finally:
+        os.close(pipe_read)
+        os.close(pipe_write)
+        try:
+            dst.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+async def splice_proxy(client_reader, client_writer, remote_reader, remote_writer, stats):
+    """Hand both connections over from their transports to splice_pipe()"""
+
+    for reader, writer, peer, upstream in (
+            (client_reader, client_writer, remote_writer, True),
+            (remote_reader, remote_writer, client_writer, False)):
+        writer.transport.pause_reading()
+        # Anything read before the switch still has to go out first
+        data = _take_buffered(reader)
+        peer.write(data)
+        stats.stream_bytes += len(data)
+        if upstream:
+            stats.upstream_bytes += len(data)
+        else:
+            stats.downstream_bytes += len(data)
+
+    for writer in (client_writer, remote_writer):
+        # Wait for the transport's own write buffer to be empty
+        writer.transport.set_write_buffer_limits(0)
+        await writer.drain()
+
+    # Duplicate the descriptors, as the event loop only allows a single
+    # registration per descriptor, and the transports still own theirs
+    client_sock, remote_sock = (
+        socket.socket(fileno=os.dup(writer.get_extra_info("socket").fileno()))
+        for writer in (client_writer, remote_writer)
+    )
+
+    pipes = [
+        asyncio.ensure_future(splice_pipe(client_sock, remote_sock, stats, upstream=True)),
+        asyncio.ensure_future(splice_pipe(remote_sock, client_sock, stats, upstream=False)),
+    ]
+    try:
+        await asyncio.gather(*pipes)
+    finally:
+        # If one failed, the other has to be done with the descriptors
+        # before they are closed, and maybe reused
+        for pipe in pipes:
+            pipe.cancel()
+        await asyncio.gather(*pipes, return_exceptions=True)
+        client_sock.close()
+        remote_sock.close()
+        remote_writer.close()
+
+
+def _resume_reading(transport):
+    """Resume reading from a transport, whether or not it was paused"""
+
+    try:
+        transport.resume_reading()
+    except RuntimeError:
+        # Before Python 3.7, resuming a transport that is not paused raises,
+        # and there is no is_reading() to check first
+        pass
+
+
+class ForwardProtocol(asyncio.Protocol):
+    """Protocol that writes everything it receives straight into a peer transport
+
+    Backpressure is handled by the transport this protocol is attached to:
+    once its write buffer crosses the high-water mark, reading from the peer
+    that is filling it is paused until it drains again."""
+
+    def __init__(self, peer, stats, upstream=True):
+        self.peer = peer
+        self.stats = stats
+        self.upstream = upstream
+        self.transport = None
+        self.closed = asyncio.get_event_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.peer.write(data)
+        self.stats.stream_bytes += len(data)
+        if self.upstream:
+            self.stats.upstream_bytes += len(data)
+        else:
+            self.stats.downstream_bytes += len(data)
+
+    def eof_received(self):
+        self.peer.close()
+
+    def connection_lost(self, exc):
+        self.peer.close()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def pause_writing(self):
+        self.peer.pause_reading()
+
+    def resume_writing(self):
+        if not self.peer.is_closing():
+            _resume_reading(self.peer)
+
+
+async def protocol_proxy(client_reader, client_writer, remote_reader, remote_writer, stats):
+    """Proxy by moving both transports over to a pair of ForwardProtocols"""
+
+    client_transport = client_writer.transport
+    remote_transport = remote_writer.transport
+    client_protocol = ForwardProtocol(remote_transport, stats, upstream=True)
+    remote_protocol = ForwardProtocol(client_transport, stats, upstream=False)
+
+    # The remote one first, so closing it from the client side is seen
+    for reader, transport, protocol in (
+            (remote_reader, remote_transport, remote_protocol),
+            (client_reader, client_transport, client_protocol)):
+        protocol.connection_made(transport)
+        # Anything read before the switch still has to go out first
+        protocol.data_received(_take_buffered(reader))
+
+        if reader.at_eof() or transport.is_closing():
+            protocol.connection_lost(None)
+        else:
+            transport.set_protocol(protocol)
+            # The stream may have paused it, with its buffer full
+            _resume_reading(transport)
+
     try:
-        remote_reader, remote_writer = await asyncio.wait_for(
-            asyncio.open_connection(host=server_host, port=server_port), timeout=20
-        )
-        await asyncio.gather(
-            pipe(client_reader, remote_writer),
-            pipe(remote_reader, client_writer)
-        )
+        await remote_protocol.closed
+    finally:
+        remote_transport.close()
+
+
+async def proxy(client_reader, client_writer, server_host, server_port,
+        stats=None, splice=False, buffer_min=2048, buffer_max=65536,
+        write_buffer_high=None, write_buffer_low=None, engine="stream",
+        connect_latency=None, initial_data=b"", upstream=None):
+    """Proxy a client to the server until either side closes
+
+    initial_data is sent to the server first, for bytes that were already
+    read from the client before proxying. The connection to the server is
+    opened through upstream if given, or straight to server_host otherwise."""
+
+    if stats is None:
+        stats = ProxyStats()
+    if upstream is None:
+        upstream = Upstream(server_host, server_port)
+
+    try:
+        loop = asyncio.get_event_loop()
+        connect_start = loop.time()
+        remote_reader, remote_writer = await upstream.open_connection()
+        if connect_latency is not None:
+            connect_latency.observe(loop.time() - connect_start)
+
+        if initial_data:
+            remote_writer.write(initial_data)
+            stats.stream_bytes += len(initial_data)
+            stats.upstream_bytes += len(initial_data)
+
+        for writer in (client_writer, remote_writer):
+            writer.transport.set_write_buffer_limits(
+                    high=write_buffer_high, low=write_buffer_low)
+
+        # Moving off the streams needs what they already buffered
+        switchable = _can_take_buffered(client_reader) and _can_take_buffered(remote_reader)
+        if (engine == "protocol" or splice) and not switchable:
+            logger.debug("Can not take buffered data from %s, proxying through streams",
+                    type(client_reader).__name__)
+
+        if engine == "protocol" and switchable:
+            await protocol_proxy(client_reader, client_writer,
+                    remote_reader, remote_writer, stats)
+        elif splice and switchable and splice_supported(client_writer, remote_writer):
+            await splice_proxy(client_reader, client_writer,
+                    remote_reader, remote_writer, stats)
+        else:
+            await asyncio.gather(
+                pipe(client_reader, remote_writer, stats, buffer_min, buffer_max,
+                        upstream=True),
+                pipe(remote_reader, client_writer, stats, buffer_min, buffer_max,
+                        upstream=False)
+            )
     except (ConnectionError, IOError, EOFError) as e:
         logger.debug("Connection from %s lost", client_writer.get_extra_info('peername'), exc_info=e)
     finally:
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import socket
+import time
+
+from .status import Status
+
+# Seconds before retrying a failed connection, doubling every retry
+RETRY_DELAY = .25
+RETRY_DELAY_MAX = 4
+
+# Seconds a warm connection is kept while the server is running, before the
+# server might time it out for not sending anything
+POOL_MAX_AGE = 10
+
+logger = logging.getLogger(__name__)
+
+
+class Upstream:
+    """Opens connections to the real server for proxied clients
+
+    The address of the server is looked up once per dns_ttl seconds, instead
+    of for every client. Connections that fail, like while the server is still
+    binding its port, are retried with backoff. Optionally, a few connections
+    are opened ahead of time, so a client can be proxied without waiting."""
+
+    def __init__(self,
+            host: str,
+            port: int,
+            dns_ttl: float = 30,
+            connect_timeout: float = 20,
+            connect_retries: int = 0,
+            pool_size: int = 0,
+        ):
+        self.host = host
+        self.port = port
+        self.dns_ttl = dns_ttl
+        self.connect_timeout = connect_timeout
+        self.connect_retries = connect_retries
+        self.pool_size = pool_size
+
+        self.addresses = None
+        self.resolved = 0
+        # Warm connections, as (reader, writer, opened) tuples
+        self.pool = []
+        self.fill_task = None
+        self.status = None
+
+    def invalidate(self):
+        """Look up the address again for the next connection"""
+
+        self.addresses = None
+
+    async def resolve(self):
+        """Addresses of the server, from the cache if it is recent enough"""
+
+        if self.addresses is None or time.monotonic() - self.resolved > self.dns_ttl:
+            infos = await asyncio.get_event_loop().getaddrinfo(
+                self.host, self.port, type=socket.SOCK_STREAM)
+            self.addresses = [info[4][:2] for info in infos]
+            self.resolved = time.monotonic()
+            logger.debug("Resolved %s to %s", self.host, self.addresses)
+
+        return self.addresses
+
+    async def dial(self):
+        """Open a new connection, retrying with backoff"""
+
+        delay = RETRY_DELAY
+        for attempt in range(self.connect_retries + 1):
+            try:
+                return await asyncio.wait_for(self._dial_once(), timeout=self.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt == self.connect_retries:
+                    raise
+                logger.debug("Connecting to %s:%s failed, retrying in %.2f seconds",
+                        self.host, self.port, delay, exc_info=e)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_DELAY_MAX)
+
+    async def _dial_once(self):
+        error = None
+        for host, port in await self.resolve():
+            try:
+                return await asyncio.open_connection(host=host, port=port)
+            except ConnectionRefusedError as e:
+                # The server is not listening yet, so the address is still fine
+                error = e
+            except OSError as e:
+                error = e
+                self.invalidate()
+
+        raise error or OSError("No addresses found for %s" % self.host)
+
+    async def open_connection(self):
+        """A connection to the server, warm from the pool if there is one"""
+
+        while self.pool:
+            reader, writer, opened = self.pool.pop()
+            self.refill()
+            if writer.transport.is_closing() or reader.at_eof() \
+                    or time.monotonic() - opened > POOL_MAX_AGE:
+                writer.close()
+                continue
+
+            logger.debug("Using a warm connection")
+            return reader, writer
+
+        return await self.dial()
+
+    def follow(self, server):
+        """Keep the pool filled while the server is running or paused
+
+        A paused server's kernel still accepts connections on its behalf, and
+        the server only sees them once unpaused, so they are warm by then."""
+
+        if self.pool_size:
+            server.add_status_listener(self.status_changed)
+            self.status_changed(server.status)
+
+    def unfollow(self, server):
+        """Stop keeping the pool filled, once replaced by another upstream"""
+
+        server.remove_status_listener(self.status_changed)
+
+    def status_changed(self, status: Status):
+        if status is self.status:
+            return
+        self.status = status
+
+        if status is Status.running:
+            # Only now could the server start timing out idle connections
+            now = time.monotonic()
+            self.pool = [(reader, writer, now) for reader, writer, _ in self.pool]
+            self.refill()
+        elif status is Status.paused:
+            # The server may already have seen these, so replace them with
+            # ones it will only see once unpaused
+            self.close()
+            self.refill()
+        else:
+            if status is Status.starting:
+                # Possibly a new container, with a new address
+                self.invalidate()
+            self.close()
+
+    def refill(self):
+        if self.status not in (Status.running, Status.paused):
+            return
+        if len(self.pool) < self.pool_size and not (self.fill_task and not self.fill_task.done()):
+            self.fill_task = asyncio.ensure_future(self.fill())
+
+    async def fill(self):
+        while len(self.pool) < self.pool_size and self.status in (Status.running, Status.paused):
+            try:
+                reader, writer = await self.dial()
+            except (OSError, asyncio.TimeoutError):
+                logger.debug("Could not open a warm connection", exc_info=True)
+                return
+            self.pool.append((reader, writer, time.monotonic()))
+
+    def close(self):
+        if self.fill_task:
+            self.fill_task.cancel()
+        for _, writer, _ in self.pool:
+            writer.close()
+        self.pool = []
+
+
+class StatusPoller:
+    """Calls the server's query_status() every status_query_interval seconds
+        while it is running, so the plugin can answer clients while it is not"""
+
+    def __init__(self, server, upstream: Upstream):
+        self.server = server
+        self.upstream = upstream
+        self.task = None
+
+    def follow(self):
+        if self.server.status_query_interval:
+            self.server.add_status_listener(self.status_changed)
+            self.status_changed(self.server.status)
+
+    def status_changed(self, status: Status):
+        if status is Status.running:
+            if not (self.task and not self.task.done()):
+                self.task = asyncio.ensure_future(self.run())
+        else:
+            # The status was only worth keeping from a running server
+            self.close()
+
+    async def run(self):
+        interval = self.server.status_query_interval
+
+        while True:
+            try:
+                reader, writer = await self.upstream.dial()
+                try:
+                    await asyncio.wait_for(
+                        self.server.query_status(reader, writer), timeout=interval)
+                finally:
+                    writer.close()
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                logger.debug("Could not query the server status", exc_info=True)
+
+            await asyncio.sleep(interval)
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
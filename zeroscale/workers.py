@@ -0,0 +1,459 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import signal
+import socket
+
+from .base_server import BaseServer
+from .metrics import ServerMetrics
+from .proxy import ProxyStats
+from .status import Status
+from .upstream import StatusPoller
+from .zeroscale import PREWARM_OPTIONS, ZeroScale, run_reload, start_servers
+
+# Seconds between reports of a worker's counters to the coordinator
+REPORT_INTERVAL = 1
+
+logger = logging.getLogger(__name__)
+
+
+def metric_counts(zeroscale) -> dict:
+    """Counters of a server's metrics that the workers add to, by name"""
+
+    counts = {
+        "upstream_bytes": zeroscale.stats.upstream_bytes,
+        "downstream_bytes": zeroscale.stats.downstream_bytes,
+        "rejected_clients": zeroscale.metrics.rejected_clients,
+        "answered_clients": zeroscale.metrics.answered_clients,
+    }
+    for limit, count in zeroscale.metrics.limited_clients.items():
+        counts["limited_" + limit] = count
+    return counts
+
+
+def add_count(zeroscale, name: str, count: int):
+    """Add to one of the counters named by metric_counts()"""
+
+    if name.startswith("limited_"):
+        zeroscale.metrics.limited_clients[name[len("limited_"):]] += count
+    elif name.endswith("_bytes"):
+        setattr(zeroscale.stats, name, getattr(zeroscale.stats, name) + count)
+    else:
+        setattr(zeroscale.metrics, name, getattr(zeroscale.metrics, name) + count)
+
+
+class ForwardedHistogram:
+    """Stands in for a Histogram in a worker, sending every value to the
+        coordinator to observe instead"""
+
+    def __init__(self, channel, index: int, command: str):
+        self.channel = channel
+        self.index = index
+        self.command = command
+
+    def observe(self, value: float):
+        self.channel.send(self.index, self.command, repr(value))
+
+
+class RemoteServer(BaseServer):
+    """Stand-in for a server owned by the coordinator process
+
+    Status is mirrored from the coordinator, and start() and unpause() ask the
+    coordinator to do the real work, then wait for it to report running.
+    Client checks are still answered by the wrapped server, in this process."""
+
+    def __init__(self, server: BaseServer, index: int, channel):
+        self.server = server
+        self.index = index
+        self.channel = channel
+        self.status = server.status
+
+    async def start(self):
+        if self.status is not Status.stopped:
+            return
+
+        self.channel.send(self.index, "start")
+        await self.wait_for_status(Status.running)
+
+    async def stop(self):
+        pass
+
+    async def pause(self):
+        pass
+
+    async def unpause(self):
+        if self.status is not Status.paused:
+            return
+
+        self.channel.send(self.index, "unpause")
+        # Stopped if it was checkpointed and could not be restored
+        await self.wait_for_status(Status.running, Status.stopped)
+
+    async def checkpoint(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def is_valid_connection(self, client_reader):
+        return await self.server.is_valid_connection(client_reader)
+
+    @property
+    def status_query_interval(self):
+        return self.server.status_query_interval
+
+    async def query_status(self, server_reader, server_writer):
+        await self.server.query_status(server_reader, server_writer)
+
+    async def answer_client(self, client_reader, client_writer) -> bool:
+        return await self.server.answer_client(client_reader, client_writer)
+
+    def fake_status(self) -> bytes:
+        return self.server.fake_status()
+
+
+class WorkerZeroScale(ZeroScale):
+    """ZeroScale proxy server in a worker process
+
+    Accepts and proxies clients on a SO_REUSEPORT listener shared with the
+    other workers, while reporting connections to the coordinator, which
+    decides when to stop the server. Clients are admitted by the coordinator,
+    so limits hold across all workers. Its metrics are reported to the
+    coordinator too, which serves them."""
+
+    def __init__(self, zeroscale: ZeroScale, index: int, channel, worker: int):
+        self.__dict__.update(zeroscale.__dict__)
+
+        self.server = RemoteServer(zeroscale.server, index, channel)
+        self.index = index
+        self.channel = channel
+        self.reuse_port = True
+        self.live_connections = 0
+        self.kill_task = None
+        # Predictions are made from the coordinator's view of all clients
+        self.prewarmer = None
+        # Counted from zero, for the coordinator to add up
+        self.stats = ProxyStats()
+        self.metrics = ServerMetrics(self.server)
+        self.metrics.upstream_connect = ForwardedHistogram(channel, index, "connect")
+        self.reported = metric_counts(self)
+        # Each worker keeps the status for its own clients
+        self.status_poller = StatusPoller(self.server, self.upstream)
+        self.logger = zeroscale.logger.getChild("worker%i" % worker)
+
+    def connection_opened(self):
+        self.live_connections += 1
+        self.channel.send(self.index, "opened")
+
+    def connection_closed(self):
+        self.live_connections -= 1
+        self.channel.send(self.index, "closed")
+
+    async def start_then_schedule_stop(self):
+        # The coordinator schedules the stop
+        await self.server.start()
+
+    def schedule_stop(self):
+        pass
+
+    async def admit(self, source) -> str:
+        answer = self.channel.request(self.index, "admit", source or "-")
+        try:
+            limit = await asyncio.shield(answer)
+        except asyncio.CancelledError:
+            # Counted by the coordinator once admitted, so let it know when
+            # the answer comes
+            def done(answer):
+                if not answer.cancelled() and answer.result() == "-":
+                    self.client_done()
+            answer.add_done_callback(done)
+            raise
+        return None if limit == "-" else limit
+
+    def client_done(self):
+        self.channel.send(self.index, "done")
+
+    async def allow_start(self, source) -> bool:
+        return await self.channel.request(self.index, "allow_start", source or "-") == "1"
+
+    async def unpause(self):
+        # Timed by the coordinator, which does the unpausing
+        await self.server.unpause()
+
+    async def reconfigure(self, **options):
+        # Predictions are made by the coordinator
+        for key in PREWARM_OPTIONS:
+            options.pop(key, None)
+        await super().reconfigure(**options)
+
+    def report_metrics(self):
+        """Send the coordinator what was added to each counter since the
+            last report"""
+
+        for name, count in metric_counts(self).items():
+            if count != self.reported[name]:
+                self.channel.send(self.index, "count", "%s=%i" % (name, count - self.reported[name]))
+                self.reported[name] = count
+
+    async def serve(self, listen: bool = True):
+        self.status_poller.follow()
+        if not self.proxy_server:
+            self.proxy_server = await self.listen(self.listen_port)
+        return self.proxy_server
+
+    async def shutdown(self):
+        pass
+
+    def close(self):
+        self.status_poller.close()
+        self.logger.info("Proxied %i bytes through streams, %i bytes through splice",
+                self.stats.stream_bytes, self.stats.splice_bytes)
+
+
+class Channel:
+    """Line based messages over a socket between a worker and the coordinator
+
+    Each message is the index of the server it is about, then the message.
+    Requests are answered in the order they were sent."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.reader = None
+        self.writer = None
+        # Futures of the requests still waiting for an answer, oldest first
+        self.requests = collections.deque()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
+
+    def send(self, index: int, *message: str):
+        self.writer.write(("%i %s\n" % (index, " ".join(message))).encode())
+
+    def request(self, index: int, *message: str) -> asyncio.Future:
+        """Send a message for the other side to answer, returning a future
+            of the answer"""
+
+        future = asyncio.get_event_loop().create_future()
+        self.requests.append(future)
+        self.send(index, *message)
+        return future
+
+    def answered(self, answer: str):
+        future = self.requests.popleft()
+        if not future.cancelled():
+            future.set_result(answer)
+
+    async def receive(self):
+        """Yield (index, command, argument) for each message, until closed"""
+
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            index, command, *argument = line.decode().split()
+            yield int(index), command, argument[0] if argument else None
+
+
+async def follow_status(workers, channel: Channel, reload=None):
+    """Mirror the status of every server as the coordinator reports it,
+        until the coordinator is gone
+
+    reload is called when the coordinator asks for one, if given."""
+
+    async for index, command, argument in channel.receive():
+        if command == "status":
+            workers[index].server.status = Status[argument]
+        elif command == "answer":
+            channel.answered(argument)
+        elif command == "reload" and reload:
+            reload()
+
+
+def run_worker(zeroscales, channel: Channel, worker: int, reload=None):
+    """Proxy clients for every server, in a forked worker process
+
+    reload is an optional coroutine function taking the servers to
+    reconfigure, run whenever the coordinator reloads."""
+
+    workers = [
+        WorkerZeroScale(zeroscale, index, channel, worker)
+        for index, zeroscale in enumerate(zeroscales)
+    ]
+    reload_lock = None
+
+    def reload_workers():
+        asyncio.ensure_future(run_reload(functools.partial(reload, workers), reload_lock))
+
+    async def follow_coordinator():
+        await follow_status(workers, channel, reload_workers if reload else None)
+
+        logger.warning("Worker %i lost the coordinator, exiting", worker)
+        asyncio.get_event_loop().stop()
+
+    async def report_metrics():
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            for zeroscale in workers:
+                zeroscale.report_metrics()
+
+    async def setup():
+        nonlocal reload_lock
+        reload_lock = asyncio.Lock()
+        await channel.connect()
+        asyncio.ensure_future(follow_coordinator())
+        asyncio.ensure_future(report_metrics())
+
+    if hasattr(signal, "SIGHUP"):
+        # Reloads come from the coordinator, once it reloaded itself
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    start_servers(workers, setup=setup)
+
+
+class Coordinator:
+    """Owns the lifecycle of every server, counting clients of all workers"""
+
+    def __init__(self, zeroscales, channels):
+        self.zeroscales = zeroscales
+        self.channels = channels
+        # Connections each worker still has open, per server
+        self.open_connections = [[0] * len(zeroscales) for _ in channels]
+        # Clients each worker was admitted and is still handling, per server
+        self.active_clients = [[0] * len(zeroscales) for _ in channels]
+        self.tasks = []
+
+    async def setup(self):
+        """Connect to every worker, and start telling them of status changes"""
+
+        for worker, channel in enumerate(self.channels):
+            await channel.connect()
+            self.tasks.append(asyncio.ensure_future(self.follow_worker(worker, channel)))
+
+        for index, zeroscale in enumerate(self.zeroscales):
+            zeroscale.server.add_status_listener(
+                lambda status, index=index: self.broadcast(index, status))
+            self.broadcast(index, zeroscale.server.status)
+
+    def reload_workers(self):
+        """Ask every worker to reload too"""
+
+        for channel in self.channels:
+            channel.send(0, "reload")
+
+    def broadcast(self, index: int, status: Status):
+        if status is None:
+            return
+        for channel in self.channels:
+            channel.send(index, "status", status.name)
+
+    async def follow_worker(self, worker: int, channel: Channel):
+        counts = self.open_connections[worker]
+        active = self.active_clients[worker]
+
+        async for index, command, argument in channel.receive():
+            zeroscale = self.zeroscales[index]
+            source = None if argument == "-" else argument
+            if command == "admit":
+                limit = await zeroscale.admit(source)
+                if limit is None:
+                    active[index] += 1
+                channel.send(index, "answer", limit or "-")
+            elif command == "done":
+                active[index] -= 1
+                zeroscale.client_done()
+            elif command == "allow_start":
+                allowed = await zeroscale.allow_start(source)
+                channel.send(index, "answer", "1" if allowed else "0")
+            elif command == "opened":
+                counts[index] += 1
+                zeroscale.connection_opened()
+            elif command == "closed":
+                counts[index] -= 1
+                zeroscale.connection_closed()
+            elif command == "start":
+                asyncio.ensure_future(zeroscale.start_then_schedule_stop())
+            elif command == "unpause" and zeroscale.server.status is Status.paused:
+                asyncio.ensure_future(zeroscale.unpause())
+            elif command == "count":
+                name, count = argument.split("=")
+                add_count(zeroscale, name, int(count))
+            elif command == "connect":
+                zeroscale.metrics.upstream_connect.observe(float(argument))
+
+        logger.warning("Lost worker %i", worker)
+        # Its connections are gone with it
+        for index, count in enumerate(counts):
+            for _ in range(count):
+                self.zeroscales[index].connection_closed()
+            counts[index] = 0
+        for index, count in enumerate(active):
+            for _ in range(count):
+                self.zeroscales[index].client_done()
+            active[index] = 0
+
+
+def run_coordinator(zeroscales, channels, metrics_port: int = None, reload=None):
+    """Own the lifecycle of every server, counting clients of all workers"""
+
+    coordinator = Coordinator(zeroscales, channels)
+
+    reload_all = None
+    if reload:
+        async def reload_all():
+            await reload(zeroscales)
+            coordinator.reload_workers()
+
+    start_servers(zeroscales, setup=coordinator.setup, listen=False,
+            metrics_port=metrics_port, reload=reload_all)
+
+
+def start_workers(zeroscales, workers: int, metrics_port: int = None, reload=None):
+    """Fork worker processes that share the listen ports with SO_REUSEPORT,
+        while this process coordinates the servers
+
+    reload is an optional coroutine function taking the servers to
+    reconfigure. On SIGHUP, this process runs it first, then every worker.
+
+    Metrics are served by this process, with the counters of the workers
+    added up every REPORT_INTERVAL seconds."""
+
+    channels = []
+    pids = []
+
+    for worker in range(workers):
+        coordinator_sock, worker_sock = socket.socketpair()
+        pid = os.fork()
+
+        if pid == 0:
+            coordinator_sock.close()
+            for channel in channels:
+                channel.sock.close()
+
+            code = 0
+            try:
+                run_worker(zeroscales, Channel(worker_sock), worker, reload)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logger.exception("Worker %i failed", worker)
+                code = 1
+            finally:
+                os._exit(code)
+
+        worker_sock.close()
+        channels.append(Channel(coordinator_sock))
+        pids.append(pid)
+
+    logger.info("Started %i workers", workers)
+
+    try:
+        run_coordinator(zeroscales, channels, metrics_port, reload)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGINT)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
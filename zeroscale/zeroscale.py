@@ -1,9 +1,29 @@
 import asyncio
 import logging
+import signal
 import sys
+import time
 
-from .proxy import proxy
+from .limits import ClientLimits
+from .metrics import ServerMetrics, serve_metrics
+from .prewarm import Prewarmer
+from .proxy import ProxyStats, ReplayReader, proxy
 from .status import Status
+from .upstream import StatusPoller, Upstream
+
+# Most bytes kept from what the plugin reads of a client, to replay to the server
+REPLAY_BUFFER = 4096
+
+# Seconds between checks of how long the event loop was blocked
+LOOP_CHECK_INTERVAL = .1
+
+# Options of ZeroScale() that make up its Upstream, and its Prewarmer
+UPSTREAM_OPTIONS = ("server_host", "server_port", "dns_ttl", "connect_timeout",
+        "connect_retries", "upstream_pool")
+# Options of ZeroScale() that can not be changed by reconfigure()
+METHOD_OPTIONS = ("method_pause", "method_checkpoint")
+PREWARM_OPTIONS = ("prewarm_history", "prewarm_threshold", "prewarm_lead",
+        "prewarm_idle_shutdown", "prewarm_dry_run")
 
 logger = logging.getLogger(__name__)
 
@@ -18,90 +38,344 @@ class ZeroScale:
         server_port: int,
         server_host: str = None,
         method_pause: bool = True,
+        method_checkpoint: bool = False,
         server_idle_shutdown: int = 15,
         server_shutdown_timeout: int = 15,
         ignore_bad_clients: bool = False,
+        validate_all: bool = False,
+        splice: bool = False,
+        buffer_min: int = 2048,
+        buffer_max: int = 65536,
+        write_buffer_high: int = None,
+        write_buffer_low: int = None,
+        proxy_engine: str = "stream",
+        name: str = None,
+        reuse_port: bool = False,
+        prewarm_history: str = None,
+        prewarm_threshold: float = .5,
+        prewarm_lead: int = 600,
+        prewarm_idle_shutdown: int = 900,
+        prewarm_dry_run: bool = False,
+        hold_clients: bool = False,
+        hold_timeout: int = 60,
+        limits: ClientLimits = None,
+        dns_ttl: float = 30,
+        connect_timeout: float = 20,
+        connect_retries: int = 0,
+        upstream_pool: int = 0,
     ):
         self.server = server
         self.listen_port = listen_port
         self.server_port = server_port
         self.server_host = server_host
         self.method_pause = method_pause
+        # Checkpointing is a kind of pausing, with the server restored to unpause
+        self.method_checkpoint = method_checkpoint
         self.server_idle_shutdown = server_idle_shutdown
         self.server_shutdown_timeout = server_shutdown_timeout
         self.ignore_bad_clients = ignore_bad_clients
-
+        # Check every client, not only those that would wake the server
+        self.validate_all = validate_all
+        self.splice = splice
+        self.buffer_min = buffer_min
+        self.buffer_max = max(buffer_min, buffer_max)
+        self.write_buffer_high = write_buffer_high
+        self.write_buffer_low = write_buffer_low
+        self.proxy_engine = proxy_engine
+        self.name = name
+        self.reuse_port = reuse_port
+        self.hold_clients = hold_clients
+        self.hold_timeout = hold_timeout
+        self.limits = limits or ClientLimits()
+        self.upstream_options = dict(
+                server_host=server_host,
+                server_port=server_port,
+                dns_ttl=dns_ttl,
+                connect_timeout=connect_timeout,
+                connect_retries=connect_retries,
+                upstream_pool=upstream_pool)
+        self.upstream = self.create_upstream()
+        self.status_poller = StatusPoller(server, self.upstream)
+
+        # Each listener logs under its own name when several share a process
+        self.logger = logger.getChild(name) if name else logger
+
+        self.prewarm_options = dict(
+                prewarm_history=prewarm_history,
+                prewarm_threshold=prewarm_threshold,
+                prewarm_lead=prewarm_lead,
+                prewarm_idle_shutdown=prewarm_idle_shutdown,
+                prewarm_dry_run=prewarm_dry_run)
+        self.prewarmer = self.create_prewarmer()
+
+        self.stats = ProxyStats()
+        self.metrics = ServerMetrics(server)
         self.live_connections = 0
+        # Clients being handled in any way, including proxied ones
+        self.active_clients = 0
         self.kill_task = None
-
-    async def create_connection(self, client_reader, client_writer):
-        """Handle an incoming client connection, by proxying to the plugin server"""
-
-        self.cancel_stop()
-        self.live_connections += 1
-        logger.debug("Accepted connection: %s, total clients: %i",
+        # When the last client left, for delay_stop() to count from
+        self.idle_since = 0
+        self.proxy_server = None
+
+    def create_upstream(self) -> Upstream:
+        options = self.upstream_options
+        return Upstream(options["server_host"], options["server_port"],
+                dns_ttl=options["dns_ttl"],
+                connect_timeout=options["connect_timeout"],
+                connect_retries=options["connect_retries"],
+                pool_size=options["upstream_pool"])
+
+    def create_prewarmer(self):
+        options = self.prewarm_options
+        if not options["prewarm_history"]:
+            return None
+        return Prewarmer(self, options["prewarm_history"],
+                threshold=options["prewarm_threshold"],
+                lead=options["prewarm_lead"],
+                busy_idle_shutdown=options["prewarm_idle_shutdown"],
+                dry_run=options["prewarm_dry_run"])
+
+    async def create_connection(self, client_reader, client_writer, initial_data=b""):
+        """Handle an incoming client connection, by proxying to the plugin server
+
+        initial_data is what was already read from the client, to send first."""
+
+        self.connection_opened()
+        self.logger.debug("Accepted connection: %s, total clients: %i",
                 client_writer.get_extra_info('peername'),
                 self.live_connections)
 
         try:
             await proxy(client_reader, client_writer,
-                    self.server_host, self.server_port)
+                    self.server_host, self.server_port,
+                    stats=self.stats, splice=self.splice,
+                    buffer_min=self.buffer_min, buffer_max=self.buffer_max,
+                    write_buffer_high=self.write_buffer_high,
+                    write_buffer_low=self.write_buffer_low,
+                    engine=self.proxy_engine,
+                    connect_latency=self.metrics.upstream_connect,
+                    initial_data=initial_data,
+                    upstream=self.upstream)
         except (ConnectionError, TimeoutError, asyncio.TimeoutError):
-            logger.debug("Proxy connection error", exc_info=True)
+            self.logger.debug("Proxy connection error", exc_info=True)
         finally:
-            self.live_connections -= 1
-            logger.debug("Lost connection: %s, total clients: %i",
+            self.connection_closed()
+            self.logger.debug("Lost connection: %s, total clients: %i",
                     client_writer.get_extra_info('peername'),
                     self.live_connections)
-            if self.live_connections <= 0:
-                self.schedule_stop()
 
-    async def handle_unready(self, client_reader, client_writer):
+    def connection_opened(self):
+        """Count a new proxied client, keeping the server up"""
+
+        self.cancel_stop()
+        self.live_connections += 1
+        if self.prewarmer:
+            self.prewarmer.arrival()
+
+    def connection_closed(self):
+        """Count a lost proxied client, scheduling a stop after the last one"""
+
+        self.live_connections -= 1
+        if self.live_connections <= 0:
+            self.schedule_stop()
+
+    async def handle_unready(self, client_reader, client_writer, replay_reader):
+        """Handle a client of a server that is not running yet"""
+
+        if self.server.status is Status.stopped \
+                and await self.answer_client(replay_reader, client_writer):
+            return
+
+        if self.hold_clients:
+            await self.hold_client(client_reader, client_writer, replay_reader)
+            return
+
         try:
-            if self.ignore_bad_clients or await self.server.is_valid_connection(client_reader):
-                logger.debug("Sending fake response to %s", client_writer.get_extra_info('peername'))
+            if await self.check_client(replay_reader):
+                if not await self.start_allowed(client_writer):
+                    return
+                self.logger.debug("Sending fake response to %s", client_writer.get_extra_info('peername'))
                 client_writer.write(self.server.fake_status())
                 client_writer.close()
                 await self.start_then_schedule_stop()
-            else:
-                logger.debug("Invalid client attempted connection")
         except (ConnectionError, TimeoutError, asyncio.TimeoutError):
-            logger.debug("Invalid client; connection error")
+            self.logger.debug("Invalid client; connection error")
         finally:
             client_writer.close()
 
-    async def handle_client_pausing(self, client_reader, client_writer):
+    async def hold_client(self, client_reader, client_writer, replay_reader):
+        """Keep a client connected while the server starts, then proxy it
+
+        What the connection check read from the client through replay_reader
+        is replayed to the server once it is running. If it is not running in
+        hold_timeout, the client gets the fake status instead."""
+
+        peername = client_writer.get_extra_info('peername')
+
+        if not (await self.check_client(replay_reader)
+                and await self.start_allowed(client_writer)):
+            client_writer.close()
+            return
+
+        self.logger.debug("Holding %s until the server is running", peername)
+        asyncio.ensure_future(self.start_then_schedule_stop())
+
+        try:
+            await asyncio.wait_for(
+                self.server.wait_for_status(Status.running), timeout=self.hold_timeout
+            )
+        except asyncio.TimeoutError:
+            self.logger.debug("Server not running in time, sending fake response to %s", peername)
+            client_writer.write(self.server.fake_status())
+            client_writer.close()
+            return
+
+        await self.create_connection(client_reader, client_writer, replay_reader.data)
+
+    async def check_client(self, replay_reader) -> bool:
+        """Run the plugin's connection check on what the client sent
+
+        It reads through replay_reader, from the start of what the client
+        sent, so the check can run any number of times without reading more."""
+
+        if self.ignore_bad_clients:
+            return True
+
+        replay_reader.rewind()
+        try:
+            valid = await self.server.is_valid_connection(replay_reader)
+        except (ConnectionError, TimeoutError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.logger.debug("Invalid client; connection error")
+            return False
+
+        if not valid:
+            self.metrics.rejected_clients += 1
+            self.logger.debug("Invalid client attempted connection")
+        return valid
+
+    async def answer_client(self, replay_reader, client_writer) -> bool:
+        """Let the plugin answer a client itself, without waking the server"""
+
+        replay_reader.rewind()
+        try:
+            answered = await self.server.answer_client(replay_reader, client_writer)
+        except (ConnectionError, TimeoutError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.logger.debug("Client lost while answering it", exc_info=True)
+            client_writer.close()
+            return True
+
+        if answered:
+            self.metrics.answered_clients += 1
+            self.logger.debug("Answered %s without waking the server",
+                    client_writer.get_extra_info('peername'))
+            client_writer.close()
+        return answered
+
+    async def admit(self, source) -> str:
+        """Count a new client as active, or return the limit it hit instead"""
+
+        limit = self.limits.admit(source, self.active_clients)
+        if limit is None:
+            self.active_clients += 1
+        return limit
+
+    def client_done(self):
+        """Stop counting an admitted client as active"""
+
+        self.active_clients -= 1
+
+    async def allow_start(self, source) -> bool:
+        return self.limits.allow_start(source)
+
+    async def start_allowed(self, client_writer) -> bool:
+        """Check if this client may start the server, if it is stopped"""
+
+        if self.server.status is not Status.stopped:
+            return True
+
+        peername = client_writer.get_extra_info('peername')
+        if await self.allow_start(peername[0] if peername else None):
+            return True
+
+        self.metrics.limited_clients["start"] += 1
+        self.logger.debug("Not starting server for %s, over the start limit", peername)
+        return False
+
+    async def handle_client_pausing(self, client_reader, client_writer, replay_reader):
         """Handle an incoming client connection, by proxying after unpausing"""
 
         if self.server.status is Status.starting:
-            await self.handle_unready(client_reader, client_writer)
+            await self.handle_unready(client_reader, client_writer, replay_reader)
             return
 
         if self.server.status is Status.paused:
-            await self.server.unpause()
+            if await self.answer_client(replay_reader, client_writer):
+                return
 
-        await self.create_connection(client_reader, client_writer)
+            await self.unpause()
 
-    async def handle_client_stopping(self, client_reader, client_writer):
+        if self.server.status is Status.stopped:
+            # A checkpoint that could not be restored, so start it over
+            await self.handle_unready(client_reader, client_writer, replay_reader)
+            return
+
+        await self.create_connection(client_reader, client_writer, replay_reader.data)
+
+    async def handle_client_stopping(self, client_reader, client_writer, replay_reader):
         """Handle an incoming client connection, either by proxying or sending a status"""
 
         if self.server.status is Status.running:
-            await self.create_connection(client_reader, client_writer)
+            await self.create_connection(client_reader, client_writer, replay_reader.data)
 
         else:
-            await self.handle_unready(client_reader, client_writer)
+            await self.handle_unready(client_reader, client_writer, replay_reader)
 
     async def handle_client(self, client_reader, client_writer):
         """Handle an incoming client connection, depending on our manage method"""
 
-        logger.debug("New connection: %s, server is %s",
-                client_writer.get_extra_info('peername'),
-                self.server.status.name)
+        peername = client_writer.get_extra_info('peername')
+        limit = await self.admit(peername[0] if peername else None)
+        if limit:
+            self.metrics.limited_clients[limit] += 1
+            self.logger.debug("Rejected connection: %s, over the %s limit", peername, limit)
+            client_writer.close()
+            return
 
-        if self.method_pause:
-            await self.handle_client_pausing(client_reader, client_writer)
+        self.logger.debug("New connection: %s, server is %s",
+                peername, self.server.status.name)
+
+        # Whatever the plugin reads of the client is replayed to the server
+        replay_reader = ReplayReader(client_reader, REPLAY_BUFFER)
+
+        try:
+            if self.validate_all and not await self.check_client(replay_reader):
+                client_writer.close()
+                return
+
+            if self.method_pause:
+                await self.handle_client_pausing(client_reader, client_writer, replay_reader)
+            else:
+                await self.handle_client_stopping(client_reader, client_writer, replay_reader)
+        finally:
+            self.client_done()
+
+    async def prewarm(self):
+        """Bring the server up ahead of clients, then stop it again if none come"""
+
+        if self.server.status is Status.paused:
+            await self.unpause()
+        if self.server.status is Status.running:
+            self.schedule_stop()
         else:
-            await self.handle_client_stopping(client_reader, client_writer)
+            await self.start_then_schedule_stop()
+
+    async def unpause(self):
+        """Unpause the server, timing how long it takes"""
+
+        unpause_start = time.monotonic()
+        await self.server.unpause()
+        self.metrics.unpause.observe(time.monotonic() - unpause_start)
 
     async def start_then_schedule_stop(self):
         await self.server.start()
@@ -115,60 +389,260 @@ class ZeroScale:
             return
 
         self.cancel_stop()
-        logger.debug("Scheduling %s server stop", type(self.server).__name__)
+        self.logger.debug("Scheduling %s server stop", type(self.server).__name__)
+        self.idle_since = time.monotonic()
         self.kill_task = asyncio.ensure_future(self.delay_stop())
 
     def cancel_stop(self):
         """Kill the scheduled run of delay_stop() before it actually stops"""
 
         if self.kill_task and not self.kill_task.done():
-            logger.debug("Canceling %s server stop", type(self.server).__name__)
+            self.logger.debug("Canceling %s server stop", type(self.server).__name__)
             self.kill_task.cancel()
 
     async def delay_stop(self):
         """Stop the plugin server, but wait first"""
 
-        await asyncio.sleep(self.server_idle_shutdown)
+        idle_shutdown = self.server_idle_shutdown
+        if self.prewarmer:
+            idle_shutdown = self.prewarmer.idle_shutdown(idle_shutdown)
 
-        logger.debug("No clients online for %i seconds", self.server_idle_shutdown)
-        if self.method_pause:
+        # Counted from when the stop was first scheduled, if it was rescheduled
+        await asyncio.sleep(max(0, idle_shutdown - (time.monotonic() - self.idle_since)))
+
+        self.logger.debug("No clients online for %i seconds", idle_shutdown)
+        if self.method_checkpoint:
+            await self.server.checkpoint()
+        elif self.method_pause:
             await self.server.pause()
         else:
             await self.server.stop()
 
-    def start_server(self):
-        """Start the proxy server"""
+    async def serve(self, listen: bool = True):
+        """Start listening for clients, returning the asyncio server"""
 
-        loop = asyncio.get_event_loop()
+        await self.server.open()
 
-        if sys.platform == 'win32':
-            # See https://docs.python.org/3/library/asyncio-platforms.html#subprocess-support-on-windows
-            loop = asyncio.ProactorEventLoop()
+        if listen and not self.proxy_server:
+            # Before anything is started, so a port in use leaves nothing behind
+            self.proxy_server = await self.listen(self.listen_port)
+
+        if self.prewarmer:
+            self.prewarmer.start()
+        self.upstream.follow(self.server)
+        self.status_poller.follow()
 
         if self.method_pause:
             # If the managing method is pausing, then we need to do two things:
             # 1. Make sure the server is actually running
             # 2. Make sure the server is paused after that
-            loop.create_task(self.start_then_schedule_stop())
+            asyncio.ensure_future(self.start_then_schedule_stop())
+
+        return self.proxy_server
 
-        coro = asyncio.start_server(self.handle_client, port=self.listen_port)
-        proxy_server = loop.run_until_complete(coro)
+    async def listen(self, port: int):
+        """Start accepting clients on port, returning the asyncio server"""
+
+        proxy_server = await asyncio.start_server(self.handle_client,
+                port=port, reuse_port=self.reuse_port or None)
 
         for socket in proxy_server.sockets:
-            logger.debug("Listening on %s", socket.getsockname())
+            self.logger.debug("Listening on %s", socket.getsockname())
+
+        return proxy_server
+
+    async def reconfigure(self, **options):
+        """Apply new keyword arguments of ZeroScale() in place
+
+        Proxied connections are left as they are, so a new server address is
+        only used by new ones. A new listen_port is listened on before the old
+        one is closed, so no client is turned away in between. A scheduled
+        stop is rescheduled, still counting from when the last client left.
+
+        Raises ValueError for a new method, which needs a restart."""
+
+        for key in METHOD_OPTIONS:
+            if key in options and options[key] != getattr(self, key):
+                raise ValueError("Changing '%s' needs a restart" % key)
+
+        listen_port = options.pop("listen_port", self.listen_port)
+        upstream_options = {key: options.pop(key) for key in UPSTREAM_OPTIONS if key in options}
+        prewarm_options = {key: options.pop(key) for key in PREWARM_OPTIONS if key in options}
+        limits = options.pop("limits", None)
+
+        for key, value in options.items():
+            if not hasattr(self, key):
+                raise TypeError("Unknown option '%s'" % key)
+            setattr(self, key, value)
+        self.buffer_max = max(self.buffer_min, self.buffer_max)
+
+        # Replaced only if changed, to keep what the old ones counted
+        if limits and limits.settings != self.limits.settings:
+            self.limits = limits
+
+        if listen_port != self.listen_port:
+            await self.handoff(listen_port)
+
+        if dict(self.upstream_options, **upstream_options) != self.upstream_options:
+            self.upstream_options.update(upstream_options)
+            self.server_host = self.upstream_options["server_host"]
+            self.server_port = self.upstream_options["server_port"]
+            self.logger.info("Connecting new clients to %s:%s",
+                    self.server_host or "localhost", self.server_port)
+            old_upstream, self.upstream = self.upstream, self.create_upstream()
+            old_upstream.unfollow(self.server)
+            old_upstream.close()
+            self.upstream.follow(self.server)
+            self.status_poller.upstream = self.upstream
+
+        if dict(self.prewarm_options, **prewarm_options) != self.prewarm_options:
+            self.prewarm_options.update(prewarm_options)
+            if self.prewarmer:
+                self.prewarmer.close()
+            self.prewarmer = self.create_prewarmer()
+            if self.prewarmer:
+                self.prewarmer.start()
+
+        if self.kill_task and not self.kill_task.done():
+            self.kill_task.cancel()
+            self.kill_task = asyncio.ensure_future(self.delay_stop())
+
+    async def handoff(self, port: int):
+        """Move accepting clients over to a new port"""
+
+        if not self.proxy_server:
+            self.listen_port = port
+            return
+
+        try:
+            proxy_server = await self.listen(port)
+        except OSError:
+            self.logger.exception("Could not listen on port %i, staying on %i",
+                    port, self.listen_port)
+            return
+
+        self.logger.info("Moved from port %i to %i", self.listen_port, port)
+        # Only stops accepting, the clients it accepted stay connected
+        self.proxy_server.close()
+        self.proxy_server = proxy_server
+        self.listen_port = port
+
+    async def shutdown(self):
+        """Stop the server, waiting at most server_shutdown_timeout"""
+
+        await asyncio.wait_for(
+            self.server.stop(), timeout=self.server_shutdown_timeout
+        )
+
+    def close(self):
+        self.logger.info("Proxied %i bytes through streams, %i bytes through splice",
+                self.stats.stream_bytes, self.stats.splice_bytes)
+        self.cancel_stop()
+        if self.prewarmer:
+            self.prewarmer.close()
+        self.upstream.close()
+        self.status_poller.close()
+        self.server.close()
+
+    def start_server(self):
+        """Start the proxy server"""
+
+        start_servers([self])
+
+
+async def run_reload(reload, lock):
+    """Await a reload, logging why it failed instead of stopping"""
+
+    async with lock:
+        logger.info("Reloading configuration")
+        try:
+            await reload()
+        except Exception:
+            logger.exception("Failed to reload configuration, keeping the old one")
+
+
+async def watch_loop_blocking(interval: float = LOOP_CHECK_INTERVAL):
+    """Log every new worst case of the event loop being blocked"""
+
+    loop = asyncio.get_event_loop()
+    worst = 0
+
+    while True:
+        before = loop.time()
+        await asyncio.sleep(interval)
+        blocked = loop.time() - before - interval
+
+        if blocked > worst:
+            worst = blocked
+            logger.debug("Event loop blocked for up to %.1f ms", worst * 1000)
+
+
+def start_servers(zeroscales, setup=None, listen: bool = True, metrics_port: int = None,
+        reload=None):
+    """Run several ZeroScale proxy servers on one event loop
+
+    setup is an optional coroutine function awaited before serving, and
+    listen=False only manages the servers, without accepting any clients.
+    Metrics of all of them are served over HTTP on metrics_port, if set.
+    reload is an optional coroutine function awaited on every SIGHUP, to
+    reconfigure the servers while they run."""
+
+    loop = asyncio.get_event_loop()
+
+    if sys.platform == 'win32':
+        # See https://docs.python.org/3/library/asyncio-platforms.html#subprocess-support-on-windows
+        loop = asyncio.ProactorEventLoop()
+        asyncio.set_event_loop(loop)
+
+    logger.info("Using event loop %s.%s",
+            type(loop).__module__, type(loop).__name__)
+
+    monitor = None
+    if logger.isEnabledFor(logging.DEBUG):
+        monitor = loop.create_task(watch_loop_blocking())
+    metrics_server = None
+
+    # Everything that was set up is closed again, even if the rest failed
+    try:
+        if setup:
+            loop.run_until_complete(setup())
+
+        # Every port is bound before any server is started
+        if listen:
+            for zeroscale in zeroscales:
+                zeroscale.proxy_server = loop.run_until_complete(
+                        zeroscale.listen(zeroscale.listen_port))
+        if metrics_port:
+            metrics_server = loop.run_until_complete(serve_metrics(zeroscales, metrics_port))
+
+        for zeroscale in zeroscales:
+            loop.run_until_complete(zeroscale.serve(listen))
+
+        if reload and hasattr(signal, "SIGHUP"):
+            # One reload at a time, however fast the signals come
+            reload_lock = asyncio.Lock()
+            loop.add_signal_handler(signal.SIGHUP,
+                    lambda: asyncio.ensure_future(run_reload(reload, reload_lock)))
 
         # Serve requests until Ctrl+C is pressed
         try:
             loop.run_forever()
         except KeyboardInterrupt:
-            loop.run_until_complete(
-                asyncio.wait_for(
-                    self.server.stop(), timeout=self.server_shutdown_timeout
-                )
-            )
-        finally:
-            self.cancel_stop()
-            self.server.close()
+            results = loop.run_until_complete(asyncio.gather(
+                *(zeroscale.shutdown() for zeroscale in zeroscales),
+                return_exceptions=True
+            ))
+            for zeroscale, result in zip(zeroscales, results):
+                if isinstance(result, Exception):
+                    zeroscale.logger.error("Failed to stop server", exc_info=result)
+    finally:
+        if monitor:
+            monitor.cancel()
+        for zeroscale in zeroscales:
+            zeroscale.close()
+        # Taken only now, as reloads may have moved them to other ports
+        proxy_servers = [zeroscale.proxy_server for zeroscale in zeroscales]
+        for proxy_server in filter(None, proxy_servers + [metrics_server]):
             proxy_server.close()
             loop.run_until_complete(proxy_server.wait_closed())
-            loop.close()
+        loop.close()